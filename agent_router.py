@@ -1,5 +1,11 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from answer_cache import cached_search_rag
+from intent_router import classify_intent, split_clauses
+from metrics import timed
 from transcribe import transcribe_audio
 from rag import embed_and_store, search_rag
 from db import (
@@ -11,12 +17,20 @@ from db import (
 )
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Per-tool timeouts in seconds when a compound request runs several tools at once.
+TOOL_TIMEOUTS = {
+    "rag": float(os.getenv("ROUTER_RAG_TIMEOUT", "8")),
+    "db": float(os.getenv("ROUTER_DB_TIMEOUT", "5")),
+    "telegram": float(os.getenv("ROUTER_TELEGRAM_TIMEOUT", "5")),
+    "smalltalk": 1.0,
+}
+ROUTER_WORKERS = int(os.getenv("ROUTER_WORKERS", "16"))
 
 
-def rag_tool(query: str) -> Dict[str, Any]:
-    """Run a RAG search for the query and return results."""
+def rag_tool(query: str, filters: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Run a RAG search for the query (optionally restricted by metadata `filters`) and return results."""
     try:
-        results = search_rag(query, k=5)
+        results = cached_search_rag(query, k=5, filters=filters)
         return {"tool": "rag", "query": query, "results": results}
     except Exception as e:
         # fallback to listing recent docs
@@ -57,20 +71,93 @@ def telegram_tool(command: str, group_id: int = None, name: str = None, descript
     return {"ok": False, "error": "unknown command"}
 
 
-def route_text(text: str) -> Dict[str, Any]:
-    """Heuristic router: direct text to DB, Telegram, or RAG.
+def smalltalk_tool(text: str) -> Dict[str, Any]:
+    """Greetings and thanks: answer directly instead of searching the corpus."""
+    return {"tool": "smalltalk", "reply": "Hi! Ask me about the documents, customers or Telegram groups."}
 
-    - customer/account/update/delete -> DB tool
-    - group/telegram/chat -> Telegram tool
-    - otherwise -> RAG
-    """
-    t = (text or "").lower()
-    if any(k in t for k in ("customer", "account", "update", "delete", "create")):
+
+def choose_tool(text: str) -> str:
+    """Pick the tool for `text` without running it: 'db', 'telegram', 'rag' or 'smalltalk'."""
+    return classify_intent(text)["intent"]
+
+
+def plan_tools(text: str, routing: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Tool calls for `text`: one per detected intent, each with the clauses that asked for it, in utterance order."""
+    routing = routing or classify_intent(text)
+    intents = [i for i, _ in routing["intents"]]
+    if len(intents) == 1:
+        return [{"tool": intents[0], "text": text}]
+    parts: Dict[str, List[str]] = {}
+    for clause in split_clauses(text):
+        parts.setdefault(classify_intent(clause)["intent"], []).append(clause)
+    order = list(parts)
+    intents.sort(key=lambda i: order.index(i) if i in order else len(order))
+    return [{"tool": tool, "text": " ".join(parts.get(tool) or [text])} for tool in intents]
+
+
+def run_tool(tool: str, text: str) -> Dict[str, Any]:
+    if tool == "db":
         return db_tool("query", {"text": text})
-    if any(k in t for k in ("group", "telegram", "chat")):
+    if tool == "telegram":
         return telegram_tool("list")
+    if tool == "smalltalk":
+        return smalltalk_tool(text)
     return rag_tool(text)
 
 
+_tool_executor: Optional[ThreadPoolExecutor] = None
+_tool_executor_lock = threading.Lock()
+
+
+def _get_tool_executor() -> ThreadPoolExecutor:
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(max_workers=ROUTER_WORKERS, thread_name_prefix="router-tools")
+    return _tool_executor
+
+
+def run_plan(plan: List[Dict[str, Any]], timeouts: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """Run independent tool calls concurrently and merge their results.
+
+    Each call gets its own timeout (TOOL_TIMEOUTS, overridable via `timeouts`) counted from the
+    same start, so the request takes as long as its slowest tool rather than the sum. Calls that
+    time out or raise are listed under `timed_out` / `errors` and the rest are still returned.
+    """
+    timeouts = {**TOOL_TIMEOUTS, **(timeouts or {})}
+    pool = _get_tool_executor()
+    start = time.monotonic()
+    futures = [(call, pool.submit(run_tool, call["tool"], call["text"])) for call in plan]
+    results, timed_out, errors = [], [], {}
+    for call, fut in futures:
+        deadline = start + timeouts.get(call["tool"], TOOL_TIMEOUTS["rag"])
+        try:
+            results.append(fut.result(timeout=max(0.0, deadline - time.monotonic())))
+        except FutureTimeout:
+            # The worker finishes in the background; its result is dropped.
+            print(f"Router: {call['tool']} tool exceeded its timeout")
+            timed_out.append(call["tool"])
+        except Exception as e:
+            print(f"Router: {call['tool']} tool failed:", e)
+            errors[call["tool"]] = str(e)
+    return {"tool": "multi", "results": results, "timed_out": timed_out, "errors": errors, "seconds": time.monotonic() - start}
+
+
+@timed()
+def route_text(text: str, timeouts: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """Route text to the DB, Telegram, small-talk or RAG tool using the intent router.
+
+    A compound request ("delete customer 4 and list telegram groups") becomes a plan of several
+    tool calls run concurrently by `run_plan`; the merged response has tool "multi". Either way
+    the result carries `routing`: the chosen intent's confidence and every intent detected.
+    """
+    routing = classify_intent(text)
+    plan = plan_tools(text, routing)
+    result = run_tool(plan[0]["tool"], plan[0]["text"]) if len(plan) == 1 else run_plan(plan, timeouts)
+    result["routing"] = routing
+    return result
+
+
 if __name__ == "__main__":
     print("agent_router module - call route_text(text)")
@@ -0,0 +1,241 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+
+from embedding_cache import normalize_text
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") not in ("0", "false", "False", "")
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "500"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Minimum cosine similarity between query embeddings for a semantic hit.
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+
+class _Entry:
+    __slots__ = ("text", "scope", "embedding", "results", "stored_at")
+
+    def __init__(self, text, scope, embedding, results, stored_at):
+        self.text = text
+        self.scope = scope
+        self.embedding = embedding
+        self.results = results
+        self.stored_at = stored_at
+
+
+class SemanticCache:
+    """Cache of RAG results keyed by query meaning.
+
+    A lookup hits when the normalized query text matches exactly, or when its embedding is
+    within `threshold` cosine similarity of a cached query with the same filters/k (`scope`).
+    All entries are dropped as soon as the corpus version changes (any documents write),
+    results searched while it changed are not stored, and entries expire after `ttl` seconds;
+    the least recently used are evicted past `max_items`.
+    """
+
+    def __init__(
+        self,
+        max_items: int = ANSWER_CACHE_SIZE,
+        ttl: float = ANSWER_CACHE_TTL,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        version_fn: Optional[Callable[[], int]] = None,
+    ):
+        if version_fn is None:
+            from db import get_corpus_version
+
+            version_fn = get_corpus_version
+        self.max_items = max_items
+        self.ttl = ttl
+        self.threshold = threshold
+        self._version_fn = version_fn
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def scope(k: int, filters: Optional[Dict[str, Any]] = None) -> str:
+        return json.dumps({"k": k, "filters": filters or {}}, sort_keys=True, default=str)
+
+    @staticmethod
+    def _unit(embedding) -> Optional[np.ndarray]:
+        if embedding is None:
+            return None
+        v = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm else None
+
+    def version(self) -> int:
+        """Read the corpus version, dropping every entry if it changed since the last read."""
+        # Called with the lock released: the version query hits the database.
+        version = self._version_fn()
+        with self._lock:
+            if self._version is not None and version != self._version and self._entries:
+                self._entries.clear()
+                self._stats["invalidations"] += 1
+            self._version = version
+        return version
+
+    def _expire(self, now: float):
+        if not self.ttl:
+            return
+        stale = [key for key, e in self._entries.items() if now - e.stored_at > self.ttl]
+        for key in stale:
+            del self._entries[key]
+
+    def lookup(
+        self,
+        query: str,
+        scope: str,
+        embedding: Optional[List[float]] = None,
+        embed: Optional[Callable[[], Optional[List[float]]]] = None,
+        version: Optional[int] = None,
+        exact_only: bool = False,
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Return cached results for `query` in `scope`, or None.
+
+        The exact text match is tried first; only if it misses is `embed()` called (when no
+        `embedding` is given) for the semantic match. Pass `version` if it was just read.
+        With `exact_only` a miss returns None straight away and is not counted, for callers
+        that follow up with a full lookup.
+        """
+        if version is None:
+            self.version()
+        text = normalize_text(query).casefold()
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get((scope, text))
+            if entry is not None:
+                self._entries.move_to_end((scope, text))
+                self._stats["exact_hits"] += 1
+                return entry.results
+        if exact_only:
+            return None
+        if embedding is None and embed is not None:
+            embedding = embed()
+        q = self._unit(embedding)
+        with self._lock:
+            if q is not None:
+                candidates = [(key, e) for key, e in self._entries.items() if e.scope == scope and e.embedding is not None]
+                if candidates:
+                    sims = np.stack([e.embedding for _, e in candidates]) @ q
+                    best = int(np.argmax(sims))
+                    if sims[best] >= self.threshold:
+                        key, entry = candidates[best]
+                        self._entries.move_to_end(key)
+                        self._stats["semantic_hits"] += 1
+                        return entry.results
+            self._stats["misses"] += 1
+        return None
+
+    def store(
+        self,
+        query: str,
+        scope: str,
+        results: List[Dict[str, Any]],
+        embedding: Optional[List[float]] = None,
+        version: Optional[int] = None,
+    ):
+        """Cache `results`; with `version` (read before the search), only if the corpus is unchanged since."""
+        if version is not None and self.version() != version:
+            return
+        text = normalize_text(query).casefold()
+        with self._lock:
+            self._entries[(scope, text)] = _Entry(text, scope, self._unit(embedding), results, time.time())
+            self._entries.move_to_end((scope, text))
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+            out["items"] = len(self._entries)
+        hits = out["exact_hits"] + out["semantic_hits"]
+        lookups = hits + out["misses"]
+        out["hit_rate"] = hits / lookups if lookups else 0.0
+        return out
+
+
+_cache: Optional[SemanticCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> SemanticCache:
+    """Process-wide semantic answer cache."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SemanticCache()
+    return _cache
+
+
+def cached_exact(query: str, k: int = 5, filters: Optional[Dict[str, Any]] = None) -> Optional[List[Dict[str, Any]]]:
+    """Results cached for exactly this query text, or None. Never embeds the query."""
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    cache = get_answer_cache()
+    return cache.lookup(query, cache.scope(k, filters), exact_only=True)
+
+
+def _query_embedding(query: str) -> Optional[List[float]]:
+    # Bounded by the vector leg's budget: a slow embedding API must not delay the search. The
+    # call keeps running and is memoised by the embedding cache, so the vector leg reuses it.
+    from rag import HYBRID_VECTOR_BUDGET, _get_search_executor, embed_texts
+
+    future = _get_search_executor().submit(embed_texts, [query])
+    try:
+        return future.result(timeout=HYBRID_VECTOR_BUDGET)[0]
+    except FutureTimeout:
+        print("Answer cache: query embedding exceeded its latency budget; skipping the semantic lookup")
+    except Exception as e:
+        print("Answer cache: query embedding failed:", e)
+    return None
+
+
+def cached_search_rag(
+    query: str,
+    k: int = 5,
+    filters: Optional[Dict[str, Any]] = None,
+    embedding: Optional[List[float]] = None,
+    search: Optional[Callable[[], List[Dict[str, Any]]]] = None,
+) -> List[Dict[str, Any]]:
+    """search_rag behind the semantic answer cache.
+
+    Pass `embedding` when the query vector is already known, and `search` to replace the
+    search_rag call made on a miss (the pipeline uses it to search by that vector). Otherwise
+    the query is only embedded when the exact-text lookup misses.
+    """
+    from rag import OPENAI_API_KEY, search_rag
+
+    if search is None:
+        search = lambda: search_rag(query, k=k, filters=filters)  # noqa: E731
+    if not ANSWER_CACHE_ENABLED:
+        return search()
+    cache = get_answer_cache()
+    scope = cache.scope(k, filters)
+    computed: List[Optional[List[float]]] = []
+
+    def embed():
+        computed.append(_query_embedding(query))
+        return computed[0]
+
+    # Read before searching: results are only cached if no write lands while the search runs.
+    version = cache.version()
+    results = cache.lookup(query, scope, embedding, embed=embed if OPENAI_API_KEY else None, version=version)
+    if results is not None:
+        return results
+    results = search()
+    cache.store(query, scope, results, embedding if embedding is not None else (computed[0] if computed else None), version=version)
+    return results
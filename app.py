@@ -1,20 +1,101 @@
 import os
 from dotenv import load_dotenv
 import streamlit as st
-from streamlit_webrtc import webrtc_streamer, AudioProcessorBase, WebRtcMode
-import numpy as np
-import soundfile as sf
-import tempfile
-import pathlib
+import importlib
+import io
+import threading
+import time
 
 load_dotenv()
 
-from transcribe import transcribe_audio
-from agent_router import route_text
+# Only light modules are imported up front. Streamlit executes this script on every
+# interaction, so the login page must not pay for WebRTC/PyAV, numpy, psycopg2 or the RAG
+# stack; each page imports what it needs, and the module cache makes that free after the
+# first time. `python benchmarks/startup.py` prints the import profile.
+from transcribe import prewarm, WHISPER_PREWARM
+from audio_store import get_session_store
+from metrics import METRICS_PORT, recent_spans, snapshot as metrics_snapshot, start_metrics_server
 
 
 st.set_page_config(page_title="Voice Agent", layout="wide")
 
+DOCS_PAGE_SIZE = 50
+
+
+@st.cache_resource
+def _prewarm_whisper():
+    # Runs once per server process; the model then stays loaded in transcribe.py.
+    return prewarm()
+
+
+@st.cache_resource
+def _preload_voice_stack():
+    """Import the transcription/routing stack in the background the first time the Main page is shown,
+    so the first Transcribe click does not pay for it."""
+
+    def _load():
+        for name in ("agent_router", "audio_preprocess", "openai"):
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                print(f"Preloading {name} failed:", e)
+
+    thread = threading.Thread(target=_load, name="preload-voice-stack", daemon=True)
+    thread.start()
+    return thread
+
+
+@st.cache_resource
+def _recorder_class():
+    """The WebRTC audio processor class, built once per server process on the first Recorder visit."""
+    from streamlit_webrtc import AudioProcessorBase
+    from audio_stream import AudioRingBuffer, FrameResampler, StreamingTranscriber
+
+    class _AudioRecorder(AudioProcessorBase):
+        def __init__(self, live: bool = False):
+            # Audio is downmixed/resampled to 16 kHz mono int16 and kept in a bounded ring buffer.
+            self._resampler = FrameResampler()
+            self._buffer = AudioRingBuffer()
+            # Live mode: transcribe VAD segments as they arrive.
+            self._stream = StreamingTranscriber() if live else None
+
+        def recv_audio(self, frame):
+            samples = self._resampler(frame)
+            self._buffer.write(samples)
+            if self._stream is not None:
+                self._stream.feed(samples)
+            return frame
+
+        @property
+        def buffered_seconds(self) -> float:
+            return self._buffer.duration
+
+        @property
+        def partial_transcript(self) -> str:
+            return self._stream.partial_text if self._stream is not None else ""
+
+        def finish_transcript(self):
+            """Final live transcript, or None when live mode is off."""
+            if self._stream is None:
+                return None
+            text = self._stream.finish()
+            self._stream = StreamingTranscriber()
+            return text
+
+        def clear(self):
+            self._buffer.clear()
+            if self._stream is not None:
+                self._stream.finish(timeout=0)
+                self._stream = StreamingTranscriber()
+
+        def wav_bytes(self) -> bytes:
+            buf = io.BytesIO()
+            self._buffer.save(buf, format="WAV")
+            return buf.getvalue()
+
+    return _AudioRecorder
+
+
 def login_page():
     st.title("Voice Agent — Login")
     username = st.text_input("Username")
@@ -27,51 +108,62 @@ def default_page():
     st.title("Voice Agent — Main")
     st.write("Record or upload an audio clip ( ~25s recommended ) and press Transcribe.")
 
+    from pipeline import run_voice_request, StageTimeout
+
+    _preload_voice_stack()
     audio_file = st.file_uploader("Upload audio (wav/mp3/m4a)", type=["wav", "mp3", "m4a", "ogg"])
     if audio_file:
         st.audio(audio_file)
-        tmp_path = "temp_audio_upload"
-        with open(tmp_path, "wb") as f:
-            f.write(audio_file.read())
+        # Kept in this session's store under its content hash: reruns reuse it instead of rewriting it.
+        store = get_session_store(st.session_state)
+        key = store.put(audio_file.getvalue(), audio_file.name)
         if st.button("Transcribe & Route"):
-            with st.spinner("Transcribing audio..."):
-                transcript = transcribe_audio(tmp_path)
-            st.subheader("Transcript")
-            st.write(transcript)
-            st.subheader("Agent routing result")
-            result = route_text(transcript)
-            st.write(result)
+            clip = store.get(key)
+            # Only the transcript is reused; routing and retrieval run on every click.
+            transcript = clip.results.get("transcript")
+            with st.spinner("Routing..." if transcript is not None else "Transcribing and routing..."):
+                try:
+                    out = run_voice_request(None if transcript is not None else clip.read(), filename=clip.name, transcript=transcript)
+                except StageTimeout as e:
+                    st.error(str(e))
+                    return
+            store.cached(key, "transcript", lambda clip: out["transcript"])
+            show_voice_result(out)
+
+
+def show_voice_result(out):
+    st.subheader("Transcript")
+    st.write(out["transcript"])
+    st.subheader("Agent routing result")
+    st.write(out["result"])
+    st.caption(" · ".join(f"{k} {v * 1000:.0f} ms" for k, v in out["timings"].items()))
+    if out["audio"]:
+        a = out["audio"]
+        st.caption(
+            f"Sent {a['bytes_out'] / 1024:.0f} KB {a['format']} instead of {a['bytes_in'] / 1024:.0f} KB "
+            f"({a['seconds_out']:.1f}s of {a['seconds_in']:.1f}s after trimming silence)"
+        )
 
 
 def recorder_page():
     st.title("Recorder — In-browser")
-    st.write("Use the recorder to capture audio from your browser. Press Start to begin and Stop & Save to save a WAV file.")
+    st.write("Use the recorder to capture audio from your browser. Press Start to begin and Stop & Save to keep the recording for this session.")
 
-    class _AudioRecorder(AudioProcessorBase):
-        def __init__(self):
-            self._frames = []
+    from streamlit_webrtc import webrtc_streamer, WebRtcMode
+    from agent_router import route_text
+    from audio_stream import recorder_memory_usage
+    from transcribe import transcribe_bytes
 
-        def recv_audio(self, frame):
-            # frame.to_ndarray() -> shape (n_samples, n_channels)
-            arr = frame.to_ndarray()
-            self._frames.append((arr, frame.sample_rate))
-            return frame
-
-        def clear(self):
-            self._frames = []
-
-        def save_wav(self, path: str):
-            if not self._frames:
-                raise RuntimeError("No audio recorded")
-            # Concatenate frames
-            arrays = [a for a, sr in self._frames]
-            sr0 = self._frames[0][1]
-            combined = np.concatenate(arrays, axis=0)
-            # soundfile expects shape (n_samples, n_channels)
-            sf.write(path, combined, sr0)
+    recorder_cls = _recorder_class()
 
     st.sidebar.markdown("## Recorder controls")
-    webrtc_ctx = webrtc_streamer(key="audio-recorder", mode=WebRtcMode.SENDRECV, audio_processor_factory=_AudioRecorder, media_stream_constraints={"audio": True, "video": False})
+    live = st.sidebar.checkbox("Live transcription", value=True)
+    usage = recorder_memory_usage()
+    st.sidebar.caption(f"Recorder buffers: {usage['sessions']} session(s), {usage['used_bytes'] / 1e6:.1f} of {usage['allocated_bytes'] / 1e6:.1f} MB used")
+    store = get_session_store(st.session_state)
+    stored = store.stats()
+    st.sidebar.caption(f"Session audio: {stored['clips']} clip(s), {stored['bytes'] / 1e6:.1f} MB")
+    webrtc_ctx = webrtc_streamer(key="audio-recorder", mode=WebRtcMode.SENDRECV, audio_processor_factory=lambda: recorder_cls(live=live), media_stream_constraints={"audio": True, "video": False})
 
     col1, col2 = st.columns(2)
     with col1:
@@ -82,32 +174,56 @@ def recorder_page():
                 if proc is None:
                     st.error("No audio processor available yet. Wait a moment and try again.")
                 else:
-                    tmp_dir = tempfile.gettempdir()
-                    out_path = pathlib.Path(tmp_dir) / "recorded_audio.wav"
+                    final = proc.finish_transcript()
+                    if final is not None:
+                        st.subheader("Transcript")
+                        st.write(final)
+                        st.subheader("Agent routing result")
+                        st.write(route_text(final))
                     try:
-                        proc.save_wav(str(out_path))
-                        st.success(f"Saved to {out_path}")
-                        st.audio(str(out_path))
-                        # Provide a button to transcribe
-                        if st.button("Transcribe saved audio"):
-                            with st.spinner("Transcribing saved audio..."):
-                                transcript = transcribe_audio(str(out_path))
-                            st.subheader("Transcript")
-                            st.write(transcript)
-                            st.subheader("Agent routing result")
-                            st.write(route_text(transcript))
+                        audio = proc.wav_bytes()
                     except Exception as e:
                         st.error(f"Failed to save audio: {e}")
+                    else:
+                        key = store.put(audio, "recording.wav")
+                        st.session_state["recording_key"] = key
+                        if final is not None:
+                            # The live transcript is final; reruns must not transcribe the clip again.
+                            store.cached(key, "transcript", lambda clip: final)
+                        st.success("Recording saved for this session")
 
     with col2:
         if st.button("Clear recording"):
             proc = webrtc_ctx.state.audio_processor if webrtc_ctx else None
+            if st.session_state.get("recording_key"):
+                store.discard(st.session_state.pop("recording_key"))
             if proc:
                 proc.clear()
                 st.info("Cleared recorded frames")
             else:
                 st.warning("No recording to clear.")
 
+    key = st.session_state.get("recording_key")
+    if key and store.get(key) is not None:
+        st.audio(store.read(key), format="audio/wav")
+        if st.button("Transcribe recording"):
+            with st.spinner("Transcribing recording..."):
+                transcript = store.cached(key, "transcript", lambda clip: transcribe_bytes(clip.read(), clip.name))
+            st.subheader("Transcript")
+            st.write(transcript)
+            st.subheader("Agent routing result")
+            st.write(route_text(transcript))
+
+    # Show partial transcripts while recording; any button press reruns the script and ends this loop.
+    if live and webrtc_ctx and webrtc_ctx.state.playing:
+        st.subheader("Live transcript")
+        placeholder = st.empty()
+        while webrtc_ctx.state.playing:
+            proc = webrtc_ctx.state.audio_processor
+            if proc is not None:
+                placeholder.write(proc.partial_transcript or "_listening..._")
+            time.sleep(0.5)
+
 
 def admin_page():
     st.title("Admin")
@@ -117,21 +233,39 @@ def admin_page():
         os.system('python -c "from db import init_db; init_db()"')
         st.success("Requested DB initialization (check server logs).")
 
-    tabs = st.tabs(["Documents", "Telegram Groups"])
+    tabs = st.tabs(["Documents", "Telegram Groups", "Ingestion", "Latency"])
 
     # Documents tab
     with tabs[0]:
         st.subheader("Documents")
         try:
-            from db import list_documents, get_document, delete_document
+            from db import list_documents_page, get_document, delete_document
 
-            docs = list_documents(limit=200)
+            # Keyset pagination: a stack of cursors, one per page visited.
+            cursors = st.session_state.setdefault("doc_page_cursors", [None])
+            docs, next_cursor = list_documents_page(limit=DOCS_PAGE_SIZE, after=cursors[-1])
             if docs:
-                st.write(f"{len(docs)} documents found")
-                st.table(docs)
+                st.write(f"Page {len(cursors)} · {len(docs)} documents")
+                st.dataframe(
+                    [
+                        {"id": d["id"], "title": d["title"], "chars": d["content_length"], "created_at": d["created_at"]}
+                        for d in docs
+                    ],
+                    use_container_width=True,
+                )
+                prev_col, next_col = st.columns(2)
+                with prev_col:
+                    if len(cursors) > 1 and st.button("← Newer"):
+                        cursors.pop()
+                        st.rerun()
+                with next_col:
+                    if next_cursor is not None and st.button("Older →"):
+                        cursors.append(next_cursor)
+                        st.rerun()
 
                 chosen = st.selectbox("Select document ID to view or delete", [d["id"] for d in docs])
                 if st.button("View document"):
+                    # Content is only fetched for the document being viewed.
                     row = get_document(chosen)
                     if row:
                         st.markdown(f"### {row.get('title') or 'Untitled'}")
@@ -145,6 +279,9 @@ def admin_page():
                         st.success("Deleted document")
                     else:
                         st.error("Failed to delete document")
+            elif len(cursors) > 1:
+                st.session_state["doc_page_cursors"] = [None]
+                st.info("No more documents.")
             else:
                 st.info("No documents in the DB yet.")
         except Exception as e:
@@ -188,8 +325,116 @@ def admin_page():
         except Exception as e:
             st.error(f"Error listing/adding telegram groups: {e}")
 
+    # Ingestion tab
+    with tabs[2]:
+        ingestion_panel()
+
+    # Latency tab
+    with tabs[3]:
+        latency_panel()
+
+
+def ingestion_panel():
+    st.subheader("Ingestion queue")
+    try:
+        from db import ingestion_queue_stats, list_ingestion_jobs
+        from ingest_worker import enqueue
+
+        q = ingestion_queue_stats()
+        cols = st.columns(4)
+        cols[0].metric("Queued", q["queued"])
+        cols[1].metric("Running", q["running"])
+        cols[2].metric("Failed", q["failed"])
+        cols[3].metric("Done (last hour)", q["jobs_done"])
+        st.caption(f"Throughput over the last hour: {q['chunks_per_min']:.1f} chunks/min, {q['tokens_per_min']:,.0f} tokens/min")
+
+        jobs = list_ingestion_jobs(limit=50)
+        if jobs:
+            st.dataframe(
+                [
+                    {
+                        "id": j["id"],
+                        "title": j["title"],
+                        "status": j["status"],
+                        "progress": f"{j['chunks_done']}/{j['chunks_total']}" if j["chunks_total"] is not None else "",
+                        "attempts": j["attempts"],
+                        "worker": j["locked_by"] or "",
+                        "error": j["error"] or "",
+                        "created_at": j["created_at"],
+                        "finished_at": j["finished_at"],
+                    }
+                    for j in jobs
+                ],
+                use_container_width=True,
+            )
+        else:
+            st.info("No ingestion jobs yet.")
+
+        st.markdown("### Queue a document")
+        st.caption("Processed in the background by `python ingest_worker.py`.")
+        with st.form("enqueue_doc_form"):
+            title = st.text_input("Title")
+            upload = st.file_uploader("Text file", type=["txt", "md"])
+            text = st.text_area("Or paste text")
+            if st.form_submit_button("Queue for ingestion"):
+                body = upload.getvalue().decode("utf-8", errors="replace") if upload else text
+                if not title or not body.strip():
+                    st.error("A title and some text are required")
+                else:
+                    job_id = enqueue(title, body, {"source": upload.name if upload else "admin"})
+                    st.success(f"Queued as job {job_id}")
+    except Exception as e:
+        st.error(f"Error reading the ingestion queue: {e}")
+
+
+def latency_panel():
+    st.subheader("Latency by stage")
+    stats = metrics_snapshot()
+    if not stats:
+        st.info("No requests recorded in this process yet.")
+        return
+    st.table(
+        [
+            {
+                "stage": name,
+                "count": row["count"],
+                "errors": row["errors"],
+                "p50 ms": round(row["p50"] * 1000, 1),
+                "p95 ms": round(row["p95"] * 1000, 1),
+                "p99 ms": round(row["p99"] * 1000, 1),
+                "max ms": round(row["max"] * 1000, 1),
+            }
+            for name, row in stats.items()
+        ]
+    )
+    st.subheader("Recent spans")
+    st.table(
+        [
+            {"stage": s["name"], "parent": s["parent"] or "", "ms": round(s["seconds"] * 1000, 1), "error": s["error"]}
+            for s in recent_spans(30)
+        ]
+    )
+    from answer_cache import get_answer_cache
+
+    cache = get_answer_cache().stats()
+    st.caption(
+        f"Answer cache: {cache['items']} entries, hit rate {cache['hit_rate']:.0%} "
+        f"({cache['exact_hits']} exact, {cache['semantic_hits']} semantic, {cache['misses']} misses)"
+    )
+    if METRICS_PORT:
+        st.caption(f"Prometheus metrics: http://127.0.0.1:{METRICS_PORT}/metrics")
+
+
+@st.cache_resource
+def _start_metrics_server():
+    return start_metrics_server(METRICS_PORT)
+
 
 def main():
+    if METRICS_PORT:
+        _start_metrics_server()
+    if WHISPER_PREWARM:
+        _prewarm_whisper()
     menu = ["Login", "Main", "Recorder", "Admin"]
     choice = st.sidebar.selectbox("Menu", menu)
     if choice == "Login":
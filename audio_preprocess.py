@@ -0,0 +1,193 @@
+import io
+import os
+import time
+from typing import Any, Dict, Optional, Tuple, Union
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+from audio_stream import SAMPLE_RATE, VAD_ENERGY_THRESHOLD, VAD_FRAME_MS, FrameResampler
+from metrics import span, timed
+
+# Preprocess uploads before transcription: decode, 16 kHz mono, trim silence, re-encode.
+AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "1") not in ("0", "false", "False", "")
+# Payload format sent to transcription: flac (lossless) | opus (smallest) | wav.
+AUDIO_PREPROCESS_FORMAT = os.getenv("AUDIO_PREPROCESS_FORMAT", "flac")
+AUDIO_OPUS_BITRATE = int(os.getenv("AUDIO_OPUS_BITRATE", "24000"))
+# Audio kept around detected speech, and the longest pause left inside it.
+AUDIO_TRIM_PADDING_MS = int(os.getenv("AUDIO_TRIM_PADDING_MS", "200"))
+AUDIO_MAX_PAUSE_MS = int(os.getenv("AUDIO_MAX_PAUSE_MS", "1000"))
+
+EXTENSIONS = {"flac": ".flac", "opus": ".ogg", "wav": ".wav"}
+
+
+def decode_audio(source, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Decode any container/codec PyAV understands (path or file object) to mono int16 at `sample_rate`."""
+    import av
+
+    resample = FrameResampler(sample_rate)
+    parts = []
+    with av.open(source) as container:
+        for frame in container.decode(audio=0):
+            parts.append(resample(frame))
+    parts.append(resample.flush())
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int16)
+
+
+def trim_silence(
+    samples: np.ndarray,
+    sample_rate: int = SAMPLE_RATE,
+    threshold: float = VAD_ENERGY_THRESHOLD,
+    padding_ms: int = AUDIO_TRIM_PADDING_MS,
+    max_pause_ms: Optional[int] = AUDIO_MAX_PAUSE_MS,
+) -> np.ndarray:
+    """Drop leading/trailing silence and shorten pauses longer than `max_pause_ms`.
+
+    Uses the same frame energy test as the live VADSegmenter. Returns an empty array when no
+    frame reaches `threshold`.
+    """
+    samples = np.asarray(samples).reshape(-1)
+    frame_len = sample_rate * VAD_FRAME_MS // 1000
+    n = len(samples) // frame_len
+    if n == 0:
+        return samples
+    frames = samples[: n * frame_len].reshape(n, frame_len).astype(np.float32)
+    if samples.dtype == np.int16:
+        frames /= 32768.0
+    voiced = np.sqrt(np.mean(frames * frames, axis=1)) >= threshold
+    if not voiced.any():
+        return samples[:0]
+    # Dilate speech by the padding so word onsets and tails survive.
+    pad = padding_ms // VAD_FRAME_MS
+    keep = np.convolve(voiced.astype(np.int8), np.ones(2 * pad + 1, dtype=np.int8), mode="same") > 0
+    if max_pause_ms is not None:
+        # Inside the speech span, silent runs keep at most max_pause (half each side).
+        half = max(1, max_pause_ms // VAD_FRAME_MS) // 2
+        idx = np.flatnonzero(keep)
+        first, last = idx[0], idx[-1]
+        run_start = None
+        for i in range(first, last + 2):
+            if i <= last and not keep[i]:
+                if run_start is None:
+                    run_start = i
+                continue
+            if run_start is not None:
+                keep[run_start : min(i, run_start + half)] = True
+                keep[max(run_start, i - half) : i] = True
+                run_start = None
+    else:
+        idx = np.flatnonzero(keep)
+        keep[idx[0] : idx[-1] + 1] = True
+    out = samples[: n * frame_len].reshape(n, frame_len)[keep].reshape(-1)
+    if keep[-1] and len(samples) > n * frame_len:
+        # Speech runs to the very end: keep the partial last frame too.
+        out = np.concatenate([out, samples[n * frame_len :]])
+    return out
+
+
+def _encode_opus(samples: np.ndarray, sample_rate: int, bitrate: int) -> bytes:
+    import av
+
+    buf = io.BytesIO()
+    with av.open(buf, "w", format="ogg") as out:
+        stream = out.add_stream("libopus", rate=sample_rate)
+        stream.bit_rate = bitrate
+        stream.layout = "mono"
+        frame_size = stream.codec_context.frame_size or sample_rate // 50
+        padded = np.zeros(-(-len(samples) // frame_size) * frame_size, dtype=np.int16)
+        padded[: len(samples)] = samples
+        for pts in range(0, len(padded), frame_size):
+            frame = av.AudioFrame.from_ndarray(padded[pts : pts + frame_size].reshape(1, -1), format="s16", layout="mono")
+            frame.sample_rate = sample_rate
+            frame.pts = pts
+            for packet in stream.encode(frame):
+                out.mux(packet)
+        for packet in stream.encode(None):
+            out.mux(packet)
+    return buf.getvalue()
+
+
+def encode_audio(samples: np.ndarray, sample_rate: int = SAMPLE_RATE, fmt: str = AUDIO_PREPROCESS_FORMAT) -> bytes:
+    """Encode mono int16 samples as flac, opus (Ogg) or wav bytes."""
+    if fmt == "opus":
+        return _encode_opus(samples, sample_rate, AUDIO_OPUS_BITRATE)
+    if fmt not in ("flac", "wav"):
+        raise ValueError(f"unknown audio format {fmt!r}; expected 'flac', 'opus' or 'wav'")
+    import soundfile as sf
+
+    buf = io.BytesIO()
+    sf.write(buf, samples, sample_rate, format=fmt.upper(), subtype="PCM_16")
+    return buf.getvalue()
+
+
+@timed()
+def preprocess_audio(source: Union[str, bytes], fmt: str = AUDIO_PREPROCESS_FORMAT) -> Tuple[bytes, Dict[str, Any]]:
+    """Decode, downmix/resample to 16 kHz mono, trim silence and re-encode a file path or audio bytes.
+
+    Returns (encoded bytes, stats) where stats has bytes_in/bytes_out, seconds_in/seconds_out
+    and the preprocessing time. If trimming finds no speech the whole clip is kept.
+    """
+    start = time.perf_counter()
+    if isinstance(source, str):
+        bytes_in = os.path.getsize(source)
+    else:
+        bytes_in = len(source)
+        source = io.BytesIO(source)
+    with span("audio.decode"):
+        samples = decode_audio(source)
+    trimmed = trim_silence(samples)
+    if not len(trimmed):
+        trimmed = samples
+    try:
+        data = encode_audio(trimmed, SAMPLE_RATE, fmt)
+    except Exception as e:
+        if fmt == "flac":
+            raise
+        print(f"Audio preprocessing: {fmt} encode failed, using flac:", e)
+        fmt = "flac"
+        data = encode_audio(trimmed, SAMPLE_RATE, fmt)
+    stats = {
+        "format": fmt,
+        "bytes_in": bytes_in,
+        "bytes_out": len(data),
+        "seconds_in": len(samples) / SAMPLE_RATE,
+        "seconds_out": len(trimmed) / SAMPLE_RATE,
+        "preprocess_seconds": time.perf_counter() - start,
+    }
+    stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+    return data, stats
+
+
+def main(argv=None) -> int:
+    """Report bytes saved for a clip and, with --transcribe, transcription latency before/after."""
+    import argparse
+
+    ap = argparse.ArgumentParser(description=main.__doc__)
+    ap.add_argument("path")
+    ap.add_argument("--format", default=AUDIO_PREPROCESS_FORMAT, choices=sorted(EXTENSIONS))
+    ap.add_argument("--transcribe", action="store_true", help="also time transcribe_audio on both versions")
+    args = ap.parse_args(argv)
+
+    data, stats = preprocess_audio(args.path, args.format)
+    print(
+        f"{stats['bytes_in']:,} B -> {stats['bytes_out']:,} B ({stats['bytes_out'] / max(1, stats['bytes_in']):.1%}), "
+        f"{stats['seconds_in']:.1f}s -> {stats['seconds_out']:.1f}s audio, "
+        f"preprocess {stats['preprocess_seconds'] * 1000:.0f} ms"
+    )
+    if args.transcribe:
+        from transcribe import transcribe_bytes
+
+        with open(args.path, "rb") as f:
+            original = f.read()
+        for label, payload, name in (
+            ("original", original, os.path.basename(args.path)),
+            ("preprocessed", data, "audio" + EXTENSIONS[stats["format"]]),
+        ):
+            start = time.perf_counter()
+            text = transcribe_bytes(payload, name)
+            print(f"{label:13s} {time.perf_counter() - start:6.2f}s  {text[:80]!r}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
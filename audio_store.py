@@ -0,0 +1,120 @@
+import hashlib
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+# Clips kept per browser session; the least recently used is dropped beyond this.
+AUDIO_STORE_MAX_CLIPS = int(os.getenv("AUDIO_STORE_MAX_CLIPS", "4"))
+# Clips up to this size stay in memory; larger ones spill to an anonymous temp file.
+AUDIO_STORE_SPOOL_BYTES = int(os.getenv("AUDIO_STORE_SPOOL_BYTES", str(16 << 20)))
+
+
+class AudioClip:
+    """One stored clip: content in a spooled temp file, plus results computed from it."""
+
+    def __init__(self, key: str, name: str, data: bytes, spool_bytes: int):
+        self.key = key
+        self.name = name
+        self.size = len(data)
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        self._file.write(data)
+        self.results: Dict[str, Any] = {}
+
+    def read(self) -> bytes:
+        self._file.seek(0)
+        return self._file.read()
+
+    @property
+    def on_disk(self) -> bool:
+        return bool(getattr(self._file, "_rolled", False))
+
+    def close(self):
+        self._file.close()
+
+
+def _close_all(clips: Dict[str, AudioClip]):
+    for clip in clips.values():
+        clip.close()
+    clips.clear()
+
+
+class SessionAudioStore:
+    """Per-session audio clips keyed by content hash.
+
+    Storing the same bytes again (a Streamlit rerun re-reading the uploader) returns the existing
+    key, and `cached()` memoises work such as transcription per clip, so reruns neither rewrite
+    nor re-transcribe. Nothing is written under a fixed path: small clips live in memory and
+    large ones in anonymous temp files, all closed when the store is closed or garbage collected
+    with its session.
+    """
+
+    def __init__(self, max_clips: int = AUDIO_STORE_MAX_CLIPS, spool_bytes: int = AUDIO_STORE_SPOOL_BYTES):
+        self.max_clips = max_clips
+        self.spool_bytes = spool_bytes
+        self._clips: "OrderedDict[str, AudioClip]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _close_all, self._clips)
+
+    def put(self, data: bytes, name: str = "audio.wav") -> str:
+        key = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if key in self._clips:
+                self._clips.move_to_end(key)
+                return key
+            self._clips[key] = AudioClip(key, name, data, self.spool_bytes)
+            while len(self._clips) > self.max_clips:
+                _, old = self._clips.popitem(last=False)
+                old.close()
+        return key
+
+    def get(self, key: str) -> Optional[AudioClip]:
+        with self._lock:
+            return self._clips.get(key)
+
+    def read(self, key: str) -> bytes:
+        clip = self.get(key)
+        if clip is None:
+            raise KeyError(key)
+        return clip.read()
+
+    def cached(self, key: str, label: str, fn: Callable[[AudioClip], Any]) -> Any:
+        """Return fn(clip), computed at most once per clip and `label`. Failures are not cached."""
+        clip = self.get(key)
+        if clip is None:
+            raise KeyError(key)
+        if label not in clip.results:
+            clip.results[label] = fn(clip)
+        return clip.results[label]
+
+    def discard(self, key: str):
+        with self._lock:
+            clip = self._clips.pop(key, None)
+        if clip is not None:
+            clip.close()
+
+    def close(self):
+        with self._lock:
+            self._finalizer()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            clips: List[AudioClip] = list(self._clips.values())
+        return {
+            "clips": len(clips),
+            "bytes": sum(c.size for c in clips),
+            "on_disk": sum(1 for c in clips if c.on_disk),
+        }
+
+
+def get_session_store(session_state) -> SessionAudioStore:
+    """The audio store for a Streamlit session, created on first use.
+
+    It lives in `session_state`, so it is freed (and its temp files closed) when the session ends.
+    """
+    store = session_state.get("audio_store")
+    if store is None:
+        store = session_state["audio_store"] = SessionAudioStore()
+    return store
@@ -0,0 +1,290 @@
+import os
+import queue
+import threading
+import weakref
+from collections import deque
+from typing import Callable, List, Optional
+import numpy as np
+
+# Whisper works on 16 kHz mono; everything the recorder streams is converted to this.
+SAMPLE_RATE = 16000
+VAD_FRAME_MS = 30
+# RMS level (of samples scaled to [-1, 1]) above which a frame counts as speech.
+VAD_ENERGY_THRESHOLD = float(os.getenv("VAD_ENERGY_THRESHOLD", "0.01"))
+# Trailing silence that closes a speech segment.
+VAD_SILENCE_MS = int(os.getenv("VAD_SILENCE_MS", "500"))
+# Segments are cut at this length even without a pause so partials keep flowing.
+VAD_MAX_SEGMENT_S = float(os.getenv("VAD_MAX_SEGMENT_S", "15"))
+# Segments with less speech than this are dropped (clicks, coughs).
+VAD_MIN_SPEECH_MS = int(os.getenv("VAD_MIN_SPEECH_MS", "250"))
+# Audio kept from before speech onset so the first syllable isn't clipped.
+VAD_PREROLL_MS = 200
+# Longest recording kept per recorder session; older audio is overwritten.
+RECORDER_MAX_SECONDS = float(os.getenv("RECORDER_MAX_SECONDS", "300"))
+
+
+class FrameResampler:
+    """Convert av.AudioFrame objects of any rate/layout/format to 16 kHz mono int16 arrays."""
+
+    def __init__(self, rate: int = SAMPLE_RATE):
+        import av
+
+        self._resampler = av.AudioResampler(format="s16", layout="mono", rate=rate)
+
+    def __call__(self, frame) -> np.ndarray:
+        out = self._resampler.resample(frame)
+        # PyAV < 9 returns a single frame, newer versions a list (possibly empty while buffering).
+        if not isinstance(out, list):
+            out = [out] if out is not None else []
+        if not out:
+            return np.zeros(0, dtype=np.int16)
+        return np.concatenate([f.to_ndarray().reshape(-1) for f in out])
+
+    def flush(self) -> np.ndarray:
+        """Drain samples still buffered in the resampler (end of a file)."""
+        try:
+            out = self._resampler.resample(None)
+        except Exception:
+            # Older PyAV cannot flush; the tail is at most a few milliseconds.
+            return np.zeros(0, dtype=np.int16)
+        if not isinstance(out, list):
+            out = [out] if out is not None else []
+        if not out:
+            return np.zeros(0, dtype=np.int16)
+        return np.concatenate([f.to_ndarray().reshape(-1) for f in out])
+
+
+_live_buffers: "weakref.WeakSet[AudioRingBuffer]" = weakref.WeakSet()
+
+
+class AudioRingBuffer:
+    """Fixed-size int16 mono ring buffer for recorded audio.
+
+    Storage is allocated once up front (np.zeros, so pages are only committed as they are
+    written). When full, the oldest audio is overwritten. `save()` writes a copy taken under the
+    lock, so the recorder thread can keep appending while it is encoded.
+    """
+
+    def __init__(self, max_seconds: float = RECORDER_MAX_SECONDS, sample_rate: int = SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.capacity = max(1, int(max_seconds * sample_rate))
+        self._buf = np.zeros(self.capacity, dtype=np.int16)
+        self._end = 0  # next write position
+        self._count = 0
+        self.dropped_samples = 0
+        self._lock = threading.Lock()
+        _live_buffers.add(self)
+
+    def write(self, samples: np.ndarray):
+        """Append mono samples (int16, or float in [-1, 1]); overwrites the oldest audio when full."""
+        samples = np.asarray(samples).reshape(-1)
+        if samples.dtype != np.int16:
+            samples = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+        n = len(samples)
+        if n == 0:
+            return
+        with self._lock:
+            if n >= self.capacity:
+                self.dropped_samples += self._count + n - self.capacity
+                self._buf[:] = samples[-self.capacity :]
+                self._end = 0
+                self._count = self.capacity
+                return
+            first = min(n, self.capacity - self._end)
+            self._buf[self._end : self._end + first] = samples[:first]
+            self._buf[: n - first] = samples[first:]
+            self._end = (self._end + n) % self.capacity
+            overflow = self._count + n - self.capacity
+            if overflow > 0:
+                self.dropped_samples += overflow
+            self._count = min(self.capacity, self._count + n)
+
+    def views(self):
+        """Return (older, newer) arrays covering the buffered audio in order.
+
+        They are copies made under the lock: views into the ring would be overwritten by
+        concurrent writes (or a clear) while the caller still reads them.
+        """
+        with self._lock:
+            start = (self._end - self._count) % self.capacity
+            if start + self._count <= self.capacity:
+                return self._buf[start : start + self._count].copy(), self._buf[:0].copy()
+            return self._buf[start:].copy(), self._buf[: self._end].copy()
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def duration(self) -> float:
+        return self._count / self.sample_rate
+
+    @property
+    def nbytes(self) -> int:
+        return self._buf.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._end = 0
+            self._count = 0
+            self.dropped_samples = 0
+
+    def save(self, path, format: Optional[str] = None):
+        """Write the buffered audio as 16-bit PCM (WAV, or FLAC when the path/format says so)."""
+        import soundfile as sf
+
+        older, newer = self.views()
+        if not len(older) and not len(newer):
+            raise RuntimeError("No audio recorded")
+        with sf.SoundFile(path, "w", samplerate=self.sample_rate, channels=1, subtype="PCM_16", format=format) as f:
+            f.write(older)
+            if len(newer):
+                f.write(newer)
+
+
+def recorder_memory_usage() -> dict:
+    """Memory held by all live recorder buffers in this process."""
+    buffers = list(_live_buffers)
+    return {
+        "sessions": len(buffers),
+        "allocated_bytes": sum(b.nbytes for b in buffers),
+        "used_bytes": sum(len(b) * 2 for b in buffers),
+    }
+
+
+class VADSegmenter:
+    """Energy-based voice activity detector that cuts a 16 kHz mono stream into speech segments."""
+
+    def __init__(
+        self,
+        sample_rate: int = SAMPLE_RATE,
+        threshold: float = VAD_ENERGY_THRESHOLD,
+        silence_ms: int = VAD_SILENCE_MS,
+        max_segment_s: float = VAD_MAX_SEGMENT_S,
+        min_speech_ms: int = VAD_MIN_SPEECH_MS,
+    ):
+        self.sample_rate = sample_rate
+        self.frame_len = sample_rate * VAD_FRAME_MS // 1000
+        self.threshold = threshold
+        self._silence_limit = max(1, silence_ms // VAD_FRAME_MS)
+        self._max_frames = max(1, int(max_segment_s * 1000) // VAD_FRAME_MS)
+        self._min_speech = max(1, min_speech_ms // VAD_FRAME_MS)
+        self._preroll = deque(maxlen=max(1, VAD_PREROLL_MS // VAD_FRAME_MS))
+        self._leftover = np.zeros(0, dtype=np.float32)
+        self._frames: List[np.ndarray] = []
+        self._speech_frames = 0
+        self._silent_run = 0
+
+    def _close(self) -> Optional[np.ndarray]:
+        frames, speech = self._frames, self._speech_frames
+        self._frames, self._speech_frames, self._silent_run = [], 0, 0
+        if speech < self._min_speech:
+            return None
+        return np.concatenate(frames)
+
+    def feed(self, samples: np.ndarray) -> List[np.ndarray]:
+        """Add audio; returns any segments (float32) completed by it."""
+        samples = np.asarray(samples).reshape(-1)
+        if samples.dtype == np.int16:
+            samples = samples.astype(np.float32) / 32768.0
+        buf = np.concatenate([self._leftover, samples.astype(np.float32, copy=False)])
+        n = len(buf) // self.frame_len
+        self._leftover = buf[n * self.frame_len :]
+        done = []
+        for frame in buf[: n * self.frame_len].reshape(n, self.frame_len):
+            voiced = float(np.sqrt(np.mean(frame * frame))) >= self.threshold
+            if not self._frames:
+                if not voiced:
+                    self._preroll.append(frame)
+                    continue
+                self._frames.extend(self._preroll)
+                self._preroll.clear()
+            self._frames.append(frame)
+            if voiced:
+                self._speech_frames += 1
+                self._silent_run = 0
+            else:
+                self._silent_run += 1
+            if self._silent_run >= self._silence_limit or len(self._frames) >= self._max_frames:
+                seg = self._close()
+                if seg is not None:
+                    done.append(seg)
+        return done
+
+    def flush(self) -> Optional[np.ndarray]:
+        """Close the in-progress segment (call when the recording stops)."""
+        if self._frames and len(self._leftover):
+            self._frames.append(self._leftover)
+        self._leftover = np.zeros(0, dtype=np.float32)
+        self._preroll.clear()
+        if not self._frames:
+            return None
+        return self._close()
+
+
+class StreamingTranscriber:
+    """Transcribe VAD segments on a background thread as audio arrives.
+
+    `feed()` is cheap and safe to call from the WebRTC audio callback; `partial_text` shows what
+    has been transcribed so far and `finish()` returns the final transcript once the last
+    (usually short) segment is done.
+    """
+
+    def __init__(self, transcribe_fn: Optional[Callable[[np.ndarray, int], str]] = None, segmenter: Optional[VADSegmenter] = None):
+        if transcribe_fn is None:
+            from transcribe import transcribe_array
+
+            transcribe_fn = transcribe_array
+        self._transcribe = transcribe_fn
+        self._segmenter = segmenter or VADSegmenter()
+        self._queue: "queue.Queue[Optional[np.ndarray]]" = queue.Queue()
+        self._texts: List[str] = []
+        self._lock = threading.Lock()
+        # feed() runs on the WebRTC thread and finish() on the script thread; both touch the segmenter.
+        self._feed_lock = threading.Lock()
+        self._finished = False
+        self._worker = threading.Thread(target=self._run, name="streaming-transcriber", daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        while True:
+            seg = self._queue.get()
+            if seg is None:
+                return
+            try:
+                text = self._transcribe(seg, self._segmenter.sample_rate)
+            except Exception as e:
+                print("Segment transcription failed:", e)
+                text = ""
+            text = (text or "").strip()
+            if text:
+                with self._lock:
+                    self._texts.append(text)
+
+    def feed(self, samples: np.ndarray):
+        """Add 16 kHz mono audio (int16 or float32)."""
+        with self._feed_lock:
+            if self._finished:
+                return
+            for seg in self._segmenter.feed(samples):
+                self._queue.put(seg)
+
+    @property
+    def partial_text(self) -> str:
+        with self._lock:
+            return " ".join(self._texts)
+
+    @property
+    def pending_segments(self) -> int:
+        return self._queue.qsize()
+
+    def finish(self, timeout: Optional[float] = None) -> str:
+        """Flush the trailing segment, wait for transcription to drain and return the full text."""
+        with self._feed_lock:
+            if not self._finished:
+                self._finished = True
+                seg = self._segmenter.flush()
+                if seg is not None:
+                    self._queue.put(seg)
+                self._queue.put(None)
+        self._worker.join(timeout)
+        return self.partial_text
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Set
+from dotenv import load_dotenv
+load_dotenv()
+
+import retry
+import transcribe
+
+# Concurrent OpenAI transcription requests.
+BATCH_TRANSCRIBE_CONCURRENCY = int(os.getenv("BATCH_TRANSCRIBE_CONCURRENCY", "4"))
+# Local whisper worker processes; each loads its own copy of WHISPER_MODEL, so mind the memory.
+BATCH_TRANSCRIBE_PROCESSES = int(os.getenv("BATCH_TRANSCRIBE_PROCESSES", "1"))
+# Retries of one file on rate limits / transient API errors, with jittered exponential backoff.
+BATCH_TRANSCRIBE_RETRIES = int(os.getenv("BATCH_TRANSCRIBE_RETRIES", "4"))
+BATCH_TRANSCRIBE_BACKOFF_BASE = float(os.getenv("BATCH_TRANSCRIBE_BACKOFF_BASE", "2"))
+BATCH_TRANSCRIBE_BACKOFF_MAX = float(os.getenv("BATCH_TRANSCRIBE_BACKOFF_MAX", "60"))
+
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".m4a", ".ogg", ".opus", ".flac", ".webm", ".mp4", ".mpga"}
+
+
+def iter_inputs(source: str) -> Iterator[Dict[str, Any]]:
+    """Yield {"path", "title", "metadata"} for a directory (audio files, recursively, sorted) or a manifest.
+
+    A manifest is either JSONL with a "path" plus optional "title"/"metadata" per line, or plain
+    text with one path per line (blank lines and # comments skipped). Relative paths are resolved
+    against the manifest's directory.
+    """
+    if os.path.isdir(source):
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                    yield {"path": os.path.join(dirpath, name), "title": None, "metadata": {}}
+        return
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if source.endswith(".jsonl"):
+                entry = json.loads(line)
+                item = {"path": entry["path"], "title": entry.get("title"), "metadata": entry.get("metadata") or {}}
+            else:
+                item = {"path": line, "title": None, "metadata": {}}
+            item["path"] = os.path.join(base, os.path.expanduser(item["path"]))
+            yield item
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_done(output: str) -> Set[str]:
+    """Content hashes already transcribed successfully in an existing output JSONL."""
+    done: Set[str] = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            if row.get("sha256") and row.get("text") is not None and not row.get("error"):
+                done.add(row["sha256"])
+    return done
+
+
+def transcribe_api(path: str, retries: int = BATCH_TRANSCRIBE_RETRIES, sleep: Callable[[float], None] = time.sleep) -> str:
+    """One file through the OpenAI API, retrying rate limits and transient errors."""
+    return retry.call_with_backoff(
+        lambda: transcribe._transcribe_openai(path),
+        retries,
+        BATCH_TRANSCRIBE_BACKOFF_BASE,
+        BATCH_TRANSCRIBE_BACKOFF_MAX,
+        sleep=sleep,
+        label=f"Transcription of {os.path.basename(path)}",
+    )
+
+
+_local_init_error: Optional[Exception] = None
+
+
+def _init_local_worker():
+    # Load the model once per worker process, before its first file. A failure is reported
+    # per file instead of breaking the pool.
+    global _local_init_error
+    try:
+        transcribe.get_local_model()
+    except Exception as e:
+        _local_init_error = e
+
+
+def transcribe_local(path: str) -> str:
+    """One file through local whisper; runs inside a worker process."""
+    if _local_init_error is not None:
+        raise RuntimeError("No transcription method available: " + str(_local_init_error))
+    return transcribe._transcribe_local([path])[0]
+
+
+def _ingest_transcript(mode: str, row: Dict[str, Any], title: Optional[str], metadata: Dict[str, Any]) -> Any:
+    md = dict(metadata, source="transcript", audio_path=row["path"], sha256=row["sha256"])
+    title = title or os.path.splitext(os.path.basename(row["path"]))[0]
+    # Keyed by content hash: re-running the batch updates the same document instead of duplicating it.
+    doc_key = f"audio:{row['sha256']}"
+    if mode == "queue":
+        from ingest_worker import enqueue
+
+        return enqueue(title, row["text"], md, doc_key=doc_key)
+    from rag import embed_and_store
+
+    return embed_and_store(title, row["text"], md, doc_key=doc_key)["chunks"]
+
+
+def run_batch(
+    items: Iterable[Dict[str, Any]],
+    output: str,
+    backend: str = "auto",
+    concurrency: int = BATCH_TRANSCRIBE_CONCURRENCY,
+    processes: int = BATCH_TRANSCRIBE_PROCESSES,
+    ingest: Optional[str] = None,
+    api_fn: Callable[[str], str] = transcribe_api,
+    local_fn: Callable[[str], str] = transcribe_local,
+) -> Dict[str, Any]:
+    """Transcribe `items` (see iter_inputs), appending one JSON line per file to `output` as each finishes.
+
+    backend "api" uses the OpenAI API with `concurrency` requests in flight, "local" uses
+    `processes` whisper worker processes, and "auto" uses the API when OPENAI_API_KEY is set and
+    retries files it fails on locally. Files whose content hash already has a transcript in
+    `output` (or appeared earlier in this batch) are skipped, so an interrupted run resumes
+    where it stopped. With `ingest` ("queue" or "inline") each transcript is also added to RAG.
+    """
+    fallback = backend == "auto"
+    if backend == "auto":
+        backend = "api" if transcribe.OPENAI_API_KEY else "local"
+    if backend not in ("api", "local"):
+        raise ValueError(f"unknown backend {backend!r}; expected 'auto', 'api' or 'local'")
+    seen = load_done(output)
+    stats = {"files": 0, "skipped": 0, "transcribed": 0, "failed": 0, "ingested": 0, "bytes": 0}
+    start = time.perf_counter()
+
+    api_pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-transcribe") if backend == "api" else None
+    local_pool: Optional[ProcessPoolExecutor] = None
+
+    def local_submit(path: str) -> Future:
+        nonlocal local_pool
+        if local_pool is None:
+            import multiprocessing
+
+            # spawn: the parent has live threads (the API pool), which fork does not copy safely.
+            local_pool = ProcessPoolExecutor(
+                max_workers=processes, mp_context=multiprocessing.get_context("spawn"), initializer=_init_local_worker
+            )
+        return local_pool.submit(local_fn, path)
+
+    # Future -> (item, row, backend, started)
+    in_flight: Dict[Future, tuple] = {}
+    limit = concurrency if backend == "api" else processes * 2
+
+    with open(output, "a", encoding="utf-8") as out:
+
+        def finish(fut: Future):
+            item, row, used, started = in_flight.pop(fut)
+            try:
+                row["text"] = fut.result()
+            except Exception as e:
+                if used == "api" and fallback:
+                    print(f"{row['path']}: API transcription failed ({e}); retrying with local whisper")
+                    in_flight[local_submit(row["path"])] = (item, row, "local", time.perf_counter())
+                    return
+                row["error"] = f"{type(e).__name__}: {e}"
+                stats["failed"] += 1
+            else:
+                stats["transcribed"] += 1
+                if ingest:
+                    try:
+                        row["ingested"] = _ingest_transcript(ingest, row, item.get("title"), item.get("metadata") or {})
+                        stats["ingested"] += 1
+                    except Exception as e:
+                        print(f"{row['path']}: ingestion failed:", e)
+                        row["ingest_error"] = str(e)
+            row["backend"] = used
+            row["seconds"] = round(time.perf_counter() - started, 3)
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+
+        try:
+            for item in items:
+                stats["files"] += 1
+                path = item["path"]
+                try:
+                    digest = file_sha256(path)
+                except OSError as e:
+                    print(f"{path}: unreadable, skipped:", e)
+                    stats["failed"] += 1
+                    continue
+                if digest in seen:
+                    stats["skipped"] += 1
+                    continue
+                seen.add(digest)
+                size = os.path.getsize(path)
+                stats["bytes"] += size
+                row = {"path": path, "sha256": digest, "bytes": size}
+                fut = api_pool.submit(api_fn, path) if backend == "api" else local_submit(path)
+                in_flight[fut] = (item, row, backend, time.perf_counter())
+                # Bounded: hash and submit more files only as results come back.
+                while len(in_flight) >= limit:
+                    done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        finish(fut)
+            while in_flight:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for fut in done:
+                    finish(fut)
+        finally:
+            if api_pool is not None:
+                api_pool.shutdown(wait=False, cancel_futures=True)
+            if local_pool is not None:
+                local_pool.shutdown(wait=False, cancel_futures=True)
+
+    stats["seconds"] = time.perf_counter() - start
+    stats["files_per_min"] = stats["transcribed"] / stats["seconds"] * 60 if stats["seconds"] else 0.0
+    return stats
+
+
+def main(argv=None) -> int:
+    """Transcribe a directory or manifest of audio files to JSONL, skipping files already transcribed."""
+    import argparse
+
+    ap = argparse.ArgumentParser(description=main.__doc__)
+    ap.add_argument("source", help="directory of audio files, or a manifest (.jsonl with path/title/metadata, or one path per line)")
+    ap.add_argument("-o", "--output", default="transcripts.jsonl", help="JSONL results, appended to (default: %(default)s)")
+    ap.add_argument("--backend", choices=("auto", "api", "local"), default="auto")
+    ap.add_argument("--concurrency", type=int, default=BATCH_TRANSCRIBE_CONCURRENCY, help="concurrent API requests")
+    ap.add_argument("--processes", type=int, default=BATCH_TRANSCRIBE_PROCESSES, help="local whisper worker processes")
+    ap.add_argument(
+        "--ingest",
+        choices=("queue", "inline"),
+        help="add transcripts to RAG: via the ingestion queue (ingest_worker.py) or embed_and_store in this process",
+    )
+    args = ap.parse_args(argv)
+
+    if not os.path.exists(args.source):
+        print(f"{args.source}: no such file or directory", file=sys.stderr)
+        return 2
+    stats = run_batch(
+        iter_inputs(args.source),
+        args.output,
+        backend=args.backend,
+        concurrency=max(1, args.concurrency),
+        processes=max(1, args.processes),
+        ingest=args.ingest,
+    )
+    print(
+        f"{stats['transcribed']} transcribed, {stats['skipped']} skipped, {stats['failed']} failed "
+        f"of {stats['files']} files in {stats['seconds']:.1f}s ({stats['files_per_min']:.1f} files/min)"
+        + (f", {stats['ingested']} ingested" if args.ingest else "")
+    )
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,470 @@
+"""Reproducible benchmarks for chunking, ingestion, retrieval, intent routing and transcription.
+
+Runs offline by default: OpenAI is replaced by a deterministic fake (hash-seeded unit vectors,
+fixed transcripts with optional simulated latency) and Postgres by an in-process exact-search
+store. Set BENCH_DATABASE_URL to a scratch Postgres+pgvector database to benchmark the real
+db.py path instead (rows are tagged and deleted afterwards).
+
+    python benchmarks/bench.py --out bench.json
+    python benchmarks/bench.py --sizes 10000,100000,1000000 --out after.json --compare before.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import uuid
+import wave
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EMBED_DIM = 1536
+WORDS = (
+    "invoice account refund shipping pallet warehouse order delivery customer telegram group "
+    "manual section torque valve pressure sensor firmware reset warranty serial battery charger"
+).split()
+
+
+def fake_embedding(text: str, dim: int = EMBED_DIM) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    v /= np.linalg.norm(v)
+    return v.tolist()
+
+
+def install_fake_openai(dim: int = EMBED_DIM, embed_latency: float = 0.0, transcribe_latency: float = 0.0):
+    """Replace the `openai` module with a deterministic offline stand-in."""
+    fake = types.ModuleType("openai")
+    fake.api_key = None
+    calls = {"embedding_requests": 0, "embedding_inputs": 0, "transcriptions": 0}
+
+    class Embedding:
+        @staticmethod
+        def create(input, model, dimensions=None):
+            inputs = [input] if isinstance(input, str) else list(input)
+            calls["embedding_requests"] += 1
+            calls["embedding_inputs"] += len(inputs)
+            if embed_latency:
+                time.sleep(embed_latency)
+            return {"data": [{"index": i, "embedding": fake_embedding(t, dimensions or dim)} for i, t in enumerate(inputs)]}
+
+    class Audio:
+        @staticmethod
+        def transcribe(model, f):
+            calls["transcriptions"] += 1
+            data = f.read()
+            if transcribe_latency:
+                time.sleep(transcribe_latency)
+            return {"text": f"transcript {hashlib.sha256(data).hexdigest()[:8]}"}
+
+    fake.Embedding = Embedding
+    fake.Audio = Audio
+    fake.calls = calls
+    sys.modules["openai"] = fake
+    return fake
+
+
+class InMemoryStore:
+    """Exact cosine top-k over an in-process matrix; stands in for the documents table."""
+
+    def __init__(self, dim: int = EMBED_DIM):
+        self.dim = dim
+        self._parts: List[np.ndarray] = []
+        self._mat: Optional[np.ndarray] = None
+        self._rows: List[Dict[str, Any]] = []
+        self._hashes: Dict[str, set] = {}
+
+    def __len__(self):
+        return len(self._rows)
+
+    def insert_documents(self, rows: List[Dict[str, Any]], page_size: int = 500) -> List[int]:
+        start = len(self._rows)
+        embs = np.array([r.get("embedding") or [0.0] * self.dim for r in rows], dtype=np.float32)
+        self._parts.append(embs)
+        self._mat = None
+        for r in rows:
+            self._rows.append({"title": r.get("title"), "content": r.get("content"), "metadata": r.get("metadata") or {}})
+        return list(range(start + 1, start + 1 + len(rows)))
+
+    def get_document_chunk_hashes(self, doc_key: str) -> List[str]:
+        return list(self._hashes.get(doc_key, ()))
+
+    def sync_document_chunks(self, doc_key: str, chunks: List[Dict[str, Any]], embeddings: Dict[str, Any], embed_missing=None) -> Dict[str, int]:
+        # Append-only approximation of db.sync_document_chunks: only unseen hashes are inserted.
+        seen = self._hashes.setdefault(doc_key, set())
+        new = [dict(c, embedding=embeddings.get(c["content_hash"])) for c in chunks if c["content_hash"] not in seen]
+        seen.update(c["content_hash"] for c in chunks)
+        self.insert_documents(new)
+        return {"inserted": len(new), "updated": 0, "unchanged": len(chunks) - len(new), "deleted": 0}
+
+    def add_vectors(self, vectors: np.ndarray):
+        start = len(self._rows)
+        self._parts.append(vectors.astype(np.float32, copy=False))
+        self._mat = None
+        self._rows.extend({"title": f"synthetic {i}", "content": "", "metadata": {}} for i in range(start, start + len(vectors)))
+
+    def search_similar_by_embedding(self, embedding: List[float], k: int = 5, **kwargs):
+        if self._mat is None:
+            self._mat = np.concatenate(self._parts) if self._parts else np.zeros((0, self.dim), np.float32)
+            self._parts = [self._mat]
+        q = np.asarray(embedding, dtype=np.float32)
+        dist = 1.0 - self._mat @ q
+        k = min(k, len(dist))
+        top = np.argpartition(dist, k - 1)[:k]
+        top = top[np.argsort(dist[top])]
+        return [dict(self._rows[i], id=int(i) + 1, distance=float(dist[i])) for i in top]
+
+
+def synthetic_document(n_words: int, seed: int) -> str:
+    rng = np.random.default_rng(seed)
+    words = rng.choice(WORDS, size=n_words)
+    sentences = [" ".join(words[i : i + 12]).capitalize() + "." for i in range(0, n_words, 12)]
+    return "\n\n".join(" ".join(sentences[i : i + 6]) for i in range(0, len(sentences), 6))
+
+
+def synthetic_vectors(n: int, dim: int, seed: int) -> np.ndarray:
+    v = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    v /= np.linalg.norm(v, axis=1, keepdims=True)
+    return v
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    arr = np.asarray(samples) * 1000
+    return {
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "p99_ms": float(np.percentile(arr, 99)),
+        "mean_ms": float(arr.mean()),
+    }
+
+
+def bench_ingestion(rag, fake, n_words: int, repeats: int) -> Dict[str, Any]:
+    from embedding_cache import get_embedding_cache
+
+    cache = get_embedding_cache()
+    runs = []
+    for r in range(repeats):
+        cache.clear()
+        before = dict(fake.calls)
+        stats = rag.embed_and_store(f"bench doc {r}", synthetic_document(n_words, seed=r), {"bench": True})
+        stats["embedding_requests"] = fake.calls["embedding_requests"] - before["embedding_requests"]
+        runs.append(stats)
+    best = max(runs, key=lambda s: s["chunks_per_sec"])
+    return {
+        "words": n_words,
+        "chunks": best["chunks"],
+        "tokens": best["tokens"],
+        "embedding_requests": best["embedding_requests"],
+        "chunks_per_sec": best["chunks_per_sec"],
+        "tokens_per_sec": best["tokens_per_sec"],
+    }
+
+
+def bench_chunking(mb: float) -> Dict[str, Any]:
+    from chunker import chunk_file
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "corpus.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            written, seed = 0, 0
+            while written < mb * 1e6:
+                block = synthetic_document(20_000, seed) + "\n\n"
+                f.write(block)
+                written += len(block)
+                seed += 1
+        start = time.perf_counter()
+        chunks = sum(1 for _ in chunk_file(path))
+        elapsed = time.perf_counter() - start
+    return {"mb": written / 1e6, "chunks": chunks, "mb_per_min": written / 1e6 / elapsed * 60}
+
+
+def _popcount(x: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).sum(axis=-1)
+    return np.unpackbits(x, axis=-1).sum(axis=-1)
+
+
+def bench_quantization(n: int, dim: int, queries: int, k: int = 10) -> Dict[str, Any]:
+    """Recall@k and bytes/vector of float16 and binary-quantized (+ exact re-rank) storage vs float32.
+
+    Offline model of db.py's VECTOR_STORAGE / VECTOR_QUANTIZATION on clustered synthetic
+    embeddings (exact search, so no latency figures); `python db.py recall-report` measures
+    recall and latency of the real index on real data.
+    """
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((max(1, n // 100), dim)).astype(np.float32)
+    corpus = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+    qs = corpus[rng.integers(0, n, queries)] + 0.1 * rng.standard_normal((queries, dim)).astype(np.float32)
+    qs /= np.linalg.norm(qs, axis=1, keepdims=True)
+
+    def topk(scores, kk):
+        idx = np.argpartition(-scores, kk - 1)[:kk]
+        return idx[np.argsort(-scores[idx])]
+
+    truth = [set(topk(corpus @ q, k)) for q in qs]
+    half = corpus.astype(np.float16)
+    bits = np.packbits(corpus > 0, axis=1)
+    out: Dict[str, Any] = {"vectors": n, "dim": dim, "vector_bytes": dim * 4, "halfvec_bytes": dim * 2, "binary_bytes": bits.shape[1]}
+
+    hits = 0
+    for q, t in zip(qs, truth):
+        hits += len(t & set(topk(half.astype(np.float32) @ q, k)))
+    out["halfvec_recall"] = hits / (k * queries)
+    for factor in (1, 2, 4, 8, 16):
+        hits = 0
+        for q, t in zip(qs, truth):
+            cand = topk(-_popcount(bits ^ np.packbits(q > 0)).astype(np.float32), k * factor)
+            hits += len(t & set(cand[topk(corpus[cand] @ q, k)]))
+        out[f"binary_rerank{factor}_recall"] = hits / (k * queries)
+    return out
+
+
+def bench_routing(path: str, repeats: int) -> Dict[str, Any]:
+    """Intent-router accuracy on a labelled JSONL set ({"text", "intents"}) and per-utterance latency."""
+    from intent_router import IntentRouter
+
+    with open(path, encoding="utf-8") as f:
+        labelled = [json.loads(line) for line in f if line.strip()]
+    router = IntentRouter()
+    top1 = exact = 0
+    for row in labelled:
+        out = router.classify(row["text"])
+        top1 += out["intent"] in row["intents"]
+        exact += {i for i, _ in out["intents"]} == set(row["intents"])
+    samples = []
+    for _ in range(repeats):
+        for row in labelled:
+            start = time.perf_counter()
+            router.classify(row["text"])
+            samples.append(time.perf_counter() - start)
+    return {
+        "utterances": len(labelled),
+        "top1_accuracy": top1 / len(labelled),
+        "intent_set_accuracy": exact / len(labelled),
+        **percentiles(samples),
+        "routes_per_sec": len(samples) / sum(samples),
+    }
+
+
+def bench_search(rag, load_vectors, sizes: List[int], dim: int, queries: int, mode: str) -> Dict[str, Any]:
+    out = {}
+    loaded = 0
+    for size in sizes:
+        batch = 50_000
+        while loaded < size:
+            n = min(batch, size - loaded)
+            load_vectors(synthetic_vectors(n, dim, seed=loaded))
+            loaded += n
+        latencies = []
+        for q in range(queries):
+            start = time.perf_counter()
+            rag.search_rag(f"bench query {q} {WORDS[q % len(WORDS)]}", k=5, mode=mode)
+            latencies.append(time.perf_counter() - start)
+        out[str(size)] = percentiles(latencies)
+    return out
+
+
+def write_wav(path: str, seconds: float, rate: int = 16000, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    samples = (rng.standard_normal(int(seconds * rate)) * 3000).astype(np.int16)
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.tobytes())
+
+
+def bench_preprocess(files: int, seconds: float) -> Dict[str, Any]:
+    """Payload size and time of audio_preprocess on 44.1 kHz stereo clips with silence around speech."""
+    from audio_preprocess import preprocess_audio
+
+    rate = 44100
+    rng = np.random.default_rng(0)
+    bytes_in = bytes_out = 0
+    samples = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(files):
+            speech = (rng.standard_normal(int(seconds * rate)) * 3000).astype(np.int16)
+            quiet = np.zeros(int(2 * rate), dtype=np.int16)
+            mono = np.concatenate([quiet, speech, quiet])
+            p = os.path.join(tmp, f"clip{i}.wav")
+            with wave.open(p, "wb") as w:
+                w.setnchannels(2)
+                w.setsampwidth(2)
+                w.setframerate(rate)
+                w.writeframes(np.repeat(mono, 2).tobytes())
+            _, stats = preprocess_audio(p)
+            bytes_in += stats["bytes_in"]
+            bytes_out += stats["bytes_out"]
+            samples.append(stats["preprocess_seconds"])
+    return {"files": files, "bytes_in": bytes_in, "bytes_out": bytes_out, "payload_ratio": bytes_out / bytes_in, **percentiles(samples)}
+
+
+def bench_transcription(files: int, seconds: float) -> Dict[str, Any]:
+    import transcribe
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(files):
+            p = os.path.join(tmp, f"clip{i}.wav")
+            write_wav(p, seconds, seed=i)
+            paths.append(p)
+        start = time.perf_counter()
+        transcribe.transcribe_batch(paths)
+        elapsed = time.perf_counter() - start
+    return {
+        "files": files,
+        "audio_seconds": files * seconds,
+        "files_per_sec": files / elapsed,
+        "audio_seconds_per_sec": files * seconds / elapsed,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def _flatten(d: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(_flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = float(v)
+    return out
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Report metrics that moved by more than `threshold` (fraction) in the bad direction."""
+    cur, base = _flatten(current["results"]), _flatten(baseline["results"])
+    regressions = []
+    for key in sorted(cur.keys() & base.keys()):
+        old, new = base[key], cur[key]
+        if not old:
+            continue
+        change = (new - old) / old
+        higher_is_better = key.endswith("_per_sec") or key.endswith("_per_min")
+        higher_is_better = higher_is_better or key.endswith("_accuracy") or key.endswith("_recall")
+        lower_is_better = key.endswith("_ms")
+        flag = ""
+        if (higher_is_better and change < -threshold) or (lower_is_better and change > threshold):
+            flag = "  REGRESSION"
+            regressions.append(key)
+        if higher_is_better or lower_is_better:
+            print(f"{key:45s} {old:12.2f} -> {new:12.2f} ({change:+.1%}){flag}")
+    return regressions
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="10000,100000", help="corpus sizes for search latency (comma separated)")
+    ap.add_argument("--dim", type=int, default=EMBED_DIM)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--ingest-words", type=int, default=50_000)
+    ap.add_argument("--ingest-repeats", type=int, default=3)
+    ap.add_argument("--chunk-mb", type=float, default=50.0, help="size of the synthetic file for chunking throughput")
+    ap.add_argument("--quant-size", type=int, default=20_000, help="vectors for the quantization recall model")
+    ap.add_argument("--intents", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "intents.jsonl"), help="labelled routing set")
+    ap.add_argument("--transcribe-files", type=int, default=20)
+    ap.add_argument("--clip-seconds", type=float, default=10.0)
+    ap.add_argument("--embed-latency", type=float, default=0.0, help="simulated seconds per embedding request")
+    ap.add_argument("--transcribe-latency", type=float, default=0.0, help="simulated seconds per transcription")
+    ap.add_argument("--search-mode", help="search_rag mode (default: vector in-memory, SEARCH_MODE with Postgres)")
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--compare", help="baseline results JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=0.10, help="regression threshold (fraction)")
+    args = ap.parse_args(argv)
+
+    fake = install_fake_openai(args.dim, args.embed_latency, args.transcribe_latency)
+    import db
+    import embedding_cache
+    import rag
+    import transcribe
+
+    rag.OPENAI_API_KEY = transcribe.OPENAI_API_KEY = "offline-benchmark"
+    bench_db = os.getenv("BENCH_DATABASE_URL")
+    run_id = uuid.uuid4().hex[:12]
+    if bench_db:
+        db.DATABASE_URL = bench_db
+        db.close_pool()
+        db.init_db()
+        backend = "postgres"
+
+        def load_vectors(vectors):
+            db.insert_documents([{"title": "synthetic", "content": "", "metadata": {"bench": run_id}, "embedding": v.tolist()} for v in vectors])
+            db.rebuild_vector_index()
+
+    else:
+        store = InMemoryStore(args.dim)
+        rag.get_document_chunk_hashes = store.get_document_chunk_hashes
+        rag.sync_document_chunks = store.sync_document_chunks
+        rag.search_similar_by_embedding = store.search_similar_by_embedding
+        embedding_cache.get_embedding_cache().persist = False
+        backend = "in-memory"
+        load_vectors = store.add_vectors
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    results: Dict[str, Any] = {}
+    try:
+        print(f"[{backend}] ingestion: {args.ingest_words} words x {args.ingest_repeats}")
+        results["ingestion"] = bench_ingestion(rag, fake, args.ingest_words, args.ingest_repeats)
+        print(f"[{backend}] chunking: {args.chunk_mb} MB file")
+        results["chunking"] = bench_chunking(args.chunk_mb)
+        print(f"[{backend}] search latency at {sizes}")
+        mode = args.search_mode or (rag.SEARCH_MODE if bench_db else "vector")
+        results["search"] = bench_search(rag, load_vectors, sizes, args.dim, args.queries, mode)
+        print(f"[{backend}] quantization recall: {args.quant_size} x {args.dim}d")
+        results["quantization"] = bench_quantization(args.quant_size, args.dim, min(args.queries, 100))
+        print(f"[{backend}] routing: {args.intents}")
+        results["routing"] = bench_routing(args.intents, repeats=200)
+        print(f"[{backend}] audio preprocessing: {args.transcribe_files} x {args.clip_seconds}s clips")
+        try:
+            results["preprocess"] = bench_preprocess(args.transcribe_files, args.clip_seconds)
+        except ImportError as e:
+            print("  skipped:", e)
+        print(f"[{backend}] transcription: {args.transcribe_files} x {args.clip_seconds}s clips")
+        results["transcription"] = bench_transcription(args.transcribe_files, args.clip_seconds)
+    finally:
+        if bench_db:
+            with db.connection() as conn:
+                cur = conn.cursor()
+                cur.execute("DELETE FROM documents WHERE metadata->>'bench' IN (%s, 'true')", (run_id,))
+                cur.close()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "backend": backend,
+        "params": vars(args),
+        "results": results,
+    }
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nvs {args.compare} (commit {baseline.get('commit')}):")
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""Import-time profile of the Streamlit app: cold start, per-page first visit and per-rerun cost.
+
+Streamlit executes app.py on every interaction. Module imports are cached after the first
+run, so what matters is (a) the cold start, i.e. everything app.py imports at module level,
+(b) what each page imports the first time it is opened, and (c) the steady per-rerun time.
+
+(a) and (b) are read from app.py's AST and timed in fresh interpreters (best of --runs);
+packages that are not installed are listed and skipped. (c) needs streamlit and uses its
+AppTest harness. Pass --rev to profile another git revision for a before/after comparison.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --rev HEAD~1 --out before.json
+    python benchmarks/startup.py --out after.json --compare before.json
+"""
+import argparse
+import ast
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional, Set
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PAGES = {"Login": "login_page", "Main": "default_page", "Recorder": "recorder_page", "Admin": "admin_page"}
+
+_TIME_IMPORTS = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+base = {base!r}
+extra = {extra!r}
+for name in base:
+    __import__(name)
+start = time.perf_counter()
+for name in extra:
+    __import__(name)
+print(json.dumps(time.perf_counter() - start))
+"""
+
+_TIME_RERUNS = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=120)
+start = time.perf_counter()
+at.run()
+first = time.perf_counter() - start
+at.sidebar.selectbox[0].select({page!r})
+start = time.perf_counter()
+at.run()
+visit = time.perf_counter() - start
+reruns = []
+for _ in range({reruns}):
+    start = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - start)
+print(json.dumps({{"first_run": first, "first_visit": visit, "rerun": sorted(reruns)[len(reruns) // 2]}}))
+"""
+
+
+def _imported(nodes) -> Set[str]:
+    names: Set[str] = set()
+    for node in nodes:
+        for sub in ast.walk(node):
+            if isinstance(sub, ast.Import):
+                names.update(a.name for a in sub.names)
+            elif isinstance(sub, ast.ImportFrom) and sub.module and not sub.level:
+                names.add(sub.module)
+    return names
+
+
+def app_imports(path: str) -> Dict[str, Set[str]]:
+    """Modules app.py imports at module level ("startup") and, per page, inside the page function
+    and the app.py functions it calls."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    funcs = {n.name: n for n in tree.body if isinstance(n, ast.FunctionDef)}
+    top = [n for n in tree.body if isinstance(n, (ast.Import, ast.ImportFrom))]
+    out = {"startup": _imported(top)}
+    for page, fname in PAGES.items():
+        seen, todo, names = set(), [fname], set()
+        while todo:
+            fn = funcs.get(todo.pop())
+            if fn is None or fn.name in seen:
+                continue
+            seen.add(fn.name)
+            names |= _imported(fn.body)
+            todo.extend(c.func.id for c in ast.walk(fn) if isinstance(c, ast.Call) and isinstance(c.func, ast.Name))
+        out[page] = names - out["startup"]
+    return out
+
+
+def _installed(name: str, root: str) -> bool:
+    if os.path.exists(os.path.join(root, name.split(".")[0] + ".py")):
+        return True
+    try:
+        return importlib.util.find_spec(name.split(".")[0]) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def time_imports(root: str, base: List[str], extra: List[str], runs: int) -> float:
+    """Best-of-`runs` seconds to import `extra` in a fresh interpreter that already imported `base`."""
+    code = _TIME_IMPORTS.format(root=root, base=base, extra=extra)
+    best = None
+    for _ in range(runs):
+        res = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True)
+        if res.returncode != 0:
+            raise RuntimeError(res.stderr.strip().splitlines()[-1] if res.stderr.strip() else "import failed")
+        t = json.loads(res.stdout.strip().splitlines()[-1])
+        best = t if best is None else min(best, t)
+    return best or 0.0
+
+
+def top_packages(root: str, modules: List[str], n: int = 8) -> List[List[Any]]:
+    """Largest contributors by self import time (summed per top-level package), via -X importtime."""
+    code = "import sys; sys.path.insert(0, %r)\n" % root + "".join(f"import {m}\n" for m in modules)
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=root, capture_output=True, text=True)
+    totals: Dict[str, int] = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        pkg = name.strip().split(".")[0]
+        totals[pkg] = totals.get(pkg, 0) + int(self_us)
+    ranked = sorted(totals.items(), key=lambda kv: -kv[1])[:n]
+    return [[pkg, round(us / 1000, 1)] for pkg, us in ranked]
+
+
+def profile(root: str, runs: int, reruns: int) -> Dict[str, Any]:
+    imports = app_imports(os.path.join(root, "app.py"))
+    missing = sorted({m for names in imports.values() for m in names if not _installed(m, root)})
+    startup = sorted(m for m in imports["startup"] if m not in missing)
+    result: Dict[str, Any] = {"missing": missing, "cold_start_ms": {}, "first_visit_ms": {}, "rerun_ms": {}, "top_packages": {}}
+    result["cold_start_ms"]["app"] = time_imports(root, [], startup, runs) * 1000
+    result["top_packages"]["startup"] = top_packages(root, startup)
+    for page in PAGES:
+        extra = sorted(m for m in imports[page] if m not in missing)
+        result["first_visit_ms"][page] = time_imports(root, startup, extra, runs) * 1000 if extra else 0.0
+        if extra:
+            result["top_packages"][page] = top_packages(root, startup + extra)
+    if _installed("streamlit", root) and not missing:
+        for page in PAGES:
+            code = _TIME_RERUNS.format(root=root, app=os.path.join(root, "app.py"), page=page, reruns=reruns)
+            res = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True)
+            if res.returncode == 0:
+                timings = json.loads(res.stdout.strip().splitlines()[-1])
+                result["rerun_ms"][page] = timings["rerun"] * 1000
+                result["first_visit_ms"][page + "_apptest"] = timings["first_visit"] * 1000
+            else:
+                print(f"{page}: AppTest run failed:", (res.stderr.strip().splitlines() or ["?"])[-1])
+    return result
+
+
+def _checkout(rev: str) -> str:
+    path = tempfile.mkdtemp(prefix="startup-")
+    subprocess.run(["git", "worktree", "add", "--detach", path, rev], cwd=ROOT, check=True, capture_output=True)
+    return path
+
+
+def report(result: Dict[str, Any], label: str):
+    print(f"== {label}")
+    if result["missing"]:
+        print("   not installed (skipped):", ", ".join(result["missing"]))
+    print(f"   cold start (module-level imports): {result['cold_start_ms']['app']:8.1f} ms")
+    for page in PAGES:
+        line = f"   first visit {page:9s}: {result['first_visit_ms'][page]:8.1f} ms"
+        if page in result["rerun_ms"]:
+            line += f"   rerun {result['rerun_ms'][page]:7.1f} ms"
+        print(line)
+    if not result["rerun_ms"]:
+        print("   per-rerun timing needs streamlit and every app dependency installed")
+    for what, pkgs in result["top_packages"].items():
+        print(f"   top packages ({what}):", ", ".join(f"{p} {ms}ms" for p, ms in pkgs))
+
+
+def _metrics(result: Dict[str, Any]) -> Dict[str, float]:
+    """Flat metric names ending in _ms, as bench.compare expects."""
+    out = {"cold_start.app_ms": result["cold_start_ms"]["app"]}
+    for section in ("first_visit_ms", "rerun_ms"):
+        for page, ms in result[section].items():
+            out[f"{section[:-3]}.{page}_ms"] = ms
+    return out
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rev", help="profile this git revision (checked out in a temporary worktree)")
+    ap.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement (best is kept)")
+    ap.add_argument("--reruns", type=int, default=10)
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--compare", help="baseline results JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=0.10, help="regression threshold (fraction)")
+    args = ap.parse_args(argv)
+
+    root: Optional[str] = None
+    if args.rev:
+        root = _checkout(args.rev)
+    try:
+        result = profile(root or ROOT, args.runs, args.reruns)
+    finally:
+        if root:
+            subprocess.run(["git", "worktree", "remove", "--force", root], cwd=ROOT, capture_output=True)
+    report(result, args.rev or "working tree")
+    out = {"rev": args.rev, "results": _metrics(result), "missing": result["missing"], "top_packages": result["top_packages"]}
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(out, f, indent=2)
+    if args.compare:
+        from bench import compare
+
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        return 1 if compare(out, baseline, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
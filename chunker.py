@@ -0,0 +1,137 @@
+import os
+import re
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# Chunk size and overlap in tokens of the embedding model's tokenizer.
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "250"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+# Characters buffered from a stream before paragraphs are split off and tokenized together.
+CHUNK_BLOCK_SIZE = 1 << 20
+
+_PARAGRAPH = re.compile(r"\n[ \t\r\f\v]*\n\s*")
+_SENTENCE = re.compile(r"(?<=[.!?;:])\s+(?=\S)|\n+")
+
+
+@lru_cache(maxsize=8)
+def get_encoding(model: str):
+    """tiktoken encoding for `model` (cl100k_base for unknown models); None if tiktoken is unavailable."""
+    try:
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def _default_model() -> str:
+    return os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+
+
+def _token_counts(units: List[str], enc) -> List[int]:
+    if enc is None:
+        return [max(1, len(u) // 4) for u in units]
+    return [len(t) for t in enc.encode_ordinary_batch(units)]
+
+
+def _split_long(unit: str, max_tokens: int, enc) -> List[Tuple[str, int]]:
+    # A single sentence longer than a chunk (tables, logs): fall back to fixed token windows.
+    if enc is None:
+        width = max_tokens * 4
+        return [(unit[i : i + width], max(1, len(unit[i : i + width]) // 4)) for i in range(0, len(unit), width)]
+    tokens = enc.encode_ordinary(unit)
+    return [(enc.decode(tokens[i : i + max_tokens]), len(tokens[i : i + max_tokens])) for i in range(0, len(tokens), max_tokens)]
+
+
+def _paragraphs(source: Iterable[str], block_size: int) -> Iterator[List[str]]:
+    """Group complete paragraphs from a stream of text pieces into ~block_size batches."""
+    pending: List[str] = []
+    size = 0
+    for piece in source:
+        pending.append(piece)
+        size += len(piece)
+        if size < block_size:
+            continue
+        paras = _PARAGRAPH.split("".join(pending))
+        tail = paras.pop()
+        if len(tail) > 4 * block_size:
+            # No blank line for a long stretch: cut at the last line break to bound memory.
+            cut = tail.rfind("\n", 0, len(tail) - 1) + 1 or len(tail)
+            paras.append(tail[:cut])
+            tail = tail[cut:]
+        pending, size = [tail], len(tail)
+        if paras:
+            yield paras
+    rest = "".join(pending)
+    if rest.strip():
+        yield _PARAGRAPH.split(rest)
+
+
+def chunk_stream(
+    source: Iterable[str],
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    model: Optional[str] = None,
+    block_size: int = CHUNK_BLOCK_SIZE,
+) -> Iterator[str]:
+    """Yield chunks of at most ~`max_tokens` tokens from an iterable of text pieces.
+
+    Chunks break on sentence and paragraph boundaries; consecutive chunks share up to
+    `overlap_tokens` of trailing sentences. Only about `block_size` characters of input are
+    held in memory at a time, so arbitrarily large files can be streamed.
+    """
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens must be smaller than max_tokens")
+    enc = get_encoding(model or _default_model())
+    # Current chunk as (text, tokens, starts_paragraph) units.
+    cur: List[Tuple[str, int, bool]] = []
+    cur_tokens = 0
+
+    def render(units):
+        out = []
+        for text, _, para_start in units:
+            if out:
+                out.append("\n\n" if para_start else " ")
+            out.append(text)
+        return "".join(out)
+
+    for paras in _paragraphs(source, block_size):
+        units: List[str] = []
+        starts: List[bool] = []
+        for para in paras:
+            first = True
+            for sent in _SENTENCE.split(para):
+                sent = sent.strip()
+                if sent:
+                    units.append(sent)
+                    starts.append(first)
+                    first = False
+        for text, n, para_start in zip(units, _token_counts(units, enc), starts):
+            pieces = _split_long(text, max_tokens, enc) if n > max_tokens else [(text, n)]
+            for piece, n in pieces:
+                if cur and cur_tokens + n > max_tokens:
+                    yield render(cur)
+                    keep: List[Tuple[str, int, bool]] = []
+                    kept = 0
+                    for u in reversed(cur):
+                        if kept + u[1] > overlap_tokens or kept + u[1] + n > max_tokens:
+                            break
+                        keep.insert(0, u)
+                        kept += u[1]
+                    cur, cur_tokens = keep, kept
+                cur.append((piece, n, para_start))
+                cur_tokens += n
+                para_start = False
+    # Every flush is followed by a new unit, so the tail always holds unseen text.
+    if cur:
+        yield render(cur)
+
+
+def chunk_file(path: str, encoding: str = "utf-8", **kwargs) -> Iterator[str]:
+    """Stream chunks from a text file without reading it all into memory."""
+    with open(path, "r", encoding=encoding, errors="replace") as f:
+        yield from chunk_stream(iter(lambda: f.read(CHUNK_BLOCK_SIZE), ""), **kwargs)
+
@@ -1,119 +1,738 @@
 import os
 import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Iterator
 import json
 import os
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+from psycopg2.extras import RealDictCursor, execute_values
 from dotenv import load_dotenv
-
 load_dotenv()
 
+from embedding_cache import text_hash
+from metrics import observe, timed
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Connection pool sizing. Keep DB_POOL_MAX below the pgbouncer pool size for this app.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# Seconds a connection may live before it is closed and replaced (0 disables recycling).
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+# Seconds to wait for a free connection before raising PoolTimeout.
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Idle connections older than this many seconds are pinged with SELECT 1 before reuse.
+DB_POOL_HEALTH_CHECK_IDLE = float(os.getenv("DB_POOL_HEALTH_CHECK_IDLE", "30"))
+
+
+# Approximate nearest-neighbour index on documents.embedding. The distance must match the
+# embedding model: OpenAI embeddings are normalised, so cosine is the right choice.
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw")  # hnsw | ivfflat | none
+VECTOR_DISTANCE = os.getenv("VECTOR_DISTANCE", "cosine")  # cosine | l2 | ip
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+# Default per-query recall/speed tunables; None leaves the server default in place.
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH") or 0) or None
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES") or 0) or None
+# pgvector's default and maximum for hnsw.ef_search.
+HNSW_DEFAULT_EF_SEARCH = 40
+HNSW_MAX_EF_SEARCH = 1000
+VECTOR_INDEX_NAME = "documents_embedding_idx"
+# Iterative index scans for filtered queries (pgvector >= 0.8): relaxed_order | strict_order | off.
+# Only the GUC of VECTOR_INDEX_TYPE is set; IVFFlat has no strict_order and uses relaxed_order.
+VECTOR_ITERATIVE_SCAN = os.getenv("VECTOR_ITERATIVE_SCAN", "relaxed_order")
+if VECTOR_ITERATIVE_SCAN not in ("relaxed_order", "strict_order", "off"):
+    raise RuntimeError("VECTOR_ITERATIVE_SCAN must be relaxed_order, strict_order or off")
+# Upper bound on tuples an iterative HNSW scan visits before giving up (0 = server default).
+HNSW_MAX_SCAN_TUPLES = int(os.getenv("HNSW_MAX_SCAN_TUPLES") or 0)
+# Stored embedding width. Must match what rag.py produces (EMBEDDING_DIMENSIONS, default 1536).
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIMENSIONS") or 1536)
+# Column type for documents.embedding: vector (float32, 4 B/dim) | halfvec (float16, 2 B/dim).
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "vector")
+if VECTOR_STORAGE not in ("vector", "halfvec"):
+    raise RuntimeError("VECTOR_STORAGE must be vector or halfvec")
+# binary: index binary-quantized embeddings (1 bit/dim, Hamming distance) and re-rank the
+# candidates by exact distance; none: index the embeddings themselves.
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+if VECTOR_QUANTIZATION not in ("none", "binary"):
+    raise RuntimeError("VECTOR_QUANTIZATION must be none or binary")
+# Candidates taken from the binary index per requested row before re-ranking.
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "8"))
+# Text search configuration for documents.content_tsv. Changing it requires recreating the column.
+FTS_CONFIG = os.getenv("FTS_CONFIG", "english")
+
+# distance -> (SQL operator, operator class)
+_DISTANCE_OPS = {
+    "cosine": ("<=>", "vector_cosine_ops"),
+    "l2": ("<->", "vector_l2_ops"),
+    "ip": ("<#>", "vector_ip_ops"),
+}
+
 
 def get_conn():
+    """Open a new, unpooled connection. Prefer `connection()` for normal queries."""
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL not set in environment")
     return psycopg2.connect(DATABASE_URL)
 
 
+class PoolTimeout(RuntimeError):
+    """Raised when no pooled connection became available within the timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool with health checks and max-lifetime recycling.
+
+    Connections are created lazily up to `maxconn`. On checkout an idle connection is
+    recycled if it exceeded `max_lifetime`, and pinged if it sat idle longer than
+    `health_check_idle`. On return, any open transaction is rolled back so the next
+    borrower always starts clean.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        minconn: int = DB_POOL_MIN,
+        maxconn: int = DB_POOL_MAX,
+        max_lifetime: float = DB_POOL_MAX_LIFETIME,
+        timeout: float = DB_POOL_TIMEOUT,
+        health_check_idle: float = DB_POOL_HEALTH_CHECK_IDLE,
+    ):
+        if maxconn < 1:
+            raise ValueError("maxconn must be >= 1")
+        self._connect = connect
+        self.minconn = max(0, min(minconn, maxconn))
+        self.maxconn = maxconn
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.health_check_idle = health_check_idle
+        self._cond = threading.Condition()
+        # Idle connections as (conn, created_at, returned_at); most recently returned at the right.
+        self._idle = deque()
+        self._born: Dict[int, float] = {}
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "connections_created": 0,
+            "connections_recycled": 0,
+            "health_check_failures": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+
+    def _open(self):
+        start = time.perf_counter()
+        conn = self._connect()
+        observe("db.connect", time.perf_counter() - start)
+        with self._cond:
+            self._born[id(conn)] = time.monotonic()
+            self._stats["connections_created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._size -= 1
+            self._cond.notify()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.max_lifetime > 0 and now - created_at >= self.max_lifetime
+
+    def _healthy(self, conn) -> bool:
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """Borrow a connection, blocking up to `timeout` seconds if the pool is exhausted."""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        entry = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("connection pool is closed")
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"no database connection available after {self.timeout:.1f}s (pool size {self.maxconn})")
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        try:
+            conn = None
+            if entry is not None:
+                conn, created_at, returned_at = entry
+                now = time.monotonic()
+                if conn.closed or self._expired(created_at, now):
+                    self._recycle(conn)
+                    conn = None
+                elif now - returned_at >= self.health_check_idle and not self._healthy(conn):
+                    with self._cond:
+                        self._stats["health_check_failures"] += 1
+                    self._recycle(conn)
+                    conn = None
+            if conn is None:
+                conn = self._open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        observe("db.pool_wait", waited)
+        with self._cond:
+            self._stats["checkouts"] += 1
+            self._stats["wait_time_total"] += waited
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+        return conn
+
+    def _recycle(self, conn):
+        # Close a pooled connection but keep its slot reserved for the caller.
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._stats["connections_recycled"] += 1
+
+    def putconn(self, conn, discard: bool = False):
+        """Return a borrowed connection. Broken, expired or `discard`ed connections are closed."""
+        with self._cond:
+            self._in_use -= 1
+            created_at = self._born.get(id(conn), 0.0)
+        if not discard and not conn.closed:
+            try:
+                status = conn.get_transaction_status()
+                if status == TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        now = time.monotonic()
+        if discard or conn.closed or self._closed or self._expired(created_at, now):
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, now))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a `with` block.
+
+        Commits on normal exit and rolls back if the block raises.
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            broken = False
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            self.putconn(conn, discard=broken)
+            raise
+        self.putconn(conn)
+
+    def prefill(self):
+        """Open connections until `minconn` are available."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append((conn, self._born[id(conn)], time.monotonic()))
+                self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of pool metrics for sizing under load."""
+        with self._cond:
+            out = dict(self._stats)
+            out.update(
+                {
+                    "size": self._size,
+                    "in_use": self._in_use,
+                    "idle": len(self._idle),
+                    "maxconn": self.maxconn,
+                    "wait_time_avg": out["wait_time_total"] / out["checkouts"] if out["checkouts"] else 0.0,
+                }
+            )
+        return out
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide pool, creating it on first use (and again after a fork)."""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            # Connections inherited across fork must not be shared with the parent; drop them.
+            _pool = ConnectionPool(get_conn)
+            _pool_pid = pid
+            _pool.prefill()
+    return _pool
+
+
+@contextmanager
+def connection(corpus_write: bool = False):
+    """Borrow a pooled connection; commits on success, rolls back on error.
+
+    Pass `corpus_write=True` when the block writes `documents`: the corpus version is then
+    advanced again once the commit has landed (see init_db).
+    """
+    with get_pool().connection() as conn:
+        yield conn
+    if corpus_write:
+        _bump_corpus_version()
+
+
+def _bump_corpus_version():
+    # A search that read the trigger's bump while the write was still invisible may have cached
+    # pre-write rows under it; moving past that version makes such entries stale.
+    try:
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT nextval('corpus_version_seq')")
+            cur.close()
+    except Exception as e:
+        print("Corpus version bump failed:", e)
+
+
+def pool_stats() -> Dict[str, Any]:
+    return get_pool().stats()
+
+
+@contextmanager
+def _autocommit_connection():
+    # Needed for statements that cannot run inside a transaction block (CREATE INDEX CONCURRENTLY, REINDEX CONCURRENTLY).
+    with connection() as conn:
+        conn.autocommit = True
+        try:
+            yield conn
+        finally:
+            conn.autocommit = False
+
+
+def close_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
+        _pool_pid = None
+
+
+@timed()
 def init_db():
     """Create pgvector extension and base tables (documents, telegram_groups, users).
 
     Note: this will attempt to create the `vector` extension (pgvector). If the DB user
     doesn't have permission to create extensions, run the extension installation as a superuser.
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    # Create extension if not exists
-    cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+    with connection() as conn:
+        cur = conn.cursor()
+        # Create extension if not exists
+        cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
 
-    # Documents table with embedding vector. Embedding dimension is flexible; using 1536 by default
-    # (OpenAI embeddings use 1536 for some models). Adjust if you use a different model.
-    cur.execute(
+        # Documents table. The embedding column type follows VECTOR_STORAGE / EMBEDDING_DIM;
+        # convert an existing table with `python db.py migrate-embeddings`.
+        cur.execute(
+            f"""
+        CREATE TABLE IF NOT EXISTS documents (
+            id SERIAL PRIMARY KEY,
+            title TEXT,
+            content TEXT,
+            metadata JSONB,
+            embedding {_vec_type()},
+            created_at TIMESTAMP DEFAULT NOW()
+        );
         """
-    CREATE TABLE IF NOT EXISTS documents (
-        id SERIAL PRIMARY KEY,
-        title TEXT,
-        content TEXT,
-        metadata JSONB,
-        embedding vector(1536),
-        created_at TIMESTAMP DEFAULT NOW()
-    );
-    """
-    )
+        )
+        # Chunk tracking for incremental re-ingestion (see sync_document_chunks).
+        cur.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS doc_key TEXT")
+        cur.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS chunk_index INT")
+        cur.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash TEXT")
+        cur.execute("CREATE INDEX IF NOT EXISTS documents_doc_key_idx ON documents (doc_key, content_hash)")
+        # Full-text search for the lexical leg of hybrid retrieval.
+        cur.execute(
+            f"ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('{FTS_CONFIG}', coalesce(title, '') || ' ' || coalesce(content, ''))) STORED"
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS documents_content_tsv_idx ON documents USING gin (content_tsv)")
+        # Metadata filters: JSON containment (metadata @> ...) and created_at ranges.
+        cur.execute("CREATE INDEX IF NOT EXISTS documents_metadata_idx ON documents USING gin (metadata jsonb_path_ops)")
+        # Also serves keyset pagination in list_documents_page.
+        cur.execute("CREATE INDEX IF NOT EXISTS documents_created_at_idx ON documents (created_at, id)")
+        cur.execute(_vector_index_sql())
 
-    # Telegram groups table
-    cur.execute(
+        # Telegram groups table
+        cur.execute(
+            """
+        CREATE TABLE IF NOT EXISTS telegram_groups (
+            id SERIAL PRIMARY KEY,
+            tg_id BIGINT,
+            name TEXT,
+            description TEXT,
+            metadata JSONB,
+            created_at TIMESTAMP DEFAULT NOW()
+        );
         """
-    CREATE TABLE IF NOT EXISTS telegram_groups (
-        id SERIAL PRIMARY KEY,
-        tg_id BIGINT,
-        name TEXT,
-        description TEXT,
-        metadata JSONB,
-        created_at TIMESTAMP DEFAULT NOW()
-    );
-    """
-    )
+        )
 
-    # Users table
-    cur.execute(
+        # Embedding cache (see embedding_cache.py), keyed by model + normalized text hash
+        cur.execute(
+            """
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            model TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            embedding REAL[] NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (model, text_hash)
+        );
         """
-    CREATE TABLE IF NOT EXISTS users (
-        id SERIAL PRIMARY KEY,
-        username TEXT UNIQUE,
-        full_name TEXT,
-        is_admin BOOLEAN DEFAULT FALSE,
-        metadata JSONB,
-        created_at TIMESTAMP DEFAULT NOW()
-    );
-    """
-    )
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS embedding_cache_created_at_idx ON embedding_cache (created_at)")
 
-    conn.commit()
-    cur.close()
-    conn.close()
+        # Durable ingestion queue (see ingest_worker.py). Workers claim rows with SKIP LOCKED;
+        # a running job whose heartbeat is older than the lease is reclaimed by another worker.
+        cur.execute(
+            """
+        CREATE TABLE IF NOT EXISTS ingestion_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            doc_key TEXT NOT NULL,
+            title TEXT,
+            content TEXT,
+            metadata JSONB,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INT NOT NULL DEFAULT 0,
+            chunks_total INT,
+            chunks_done INT NOT NULL DEFAULT 0,
+            stats JSONB,
+            error TEXT,
+            run_after TIMESTAMP NOT NULL DEFAULT NOW(),
+            locked_by TEXT,
+            heartbeat_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT NOW(),
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        );
+        """
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS ingestion_jobs_ready_idx ON ingestion_jobs (run_after, id) "
+            "WHERE status IN ('queued', 'running')"
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS ingestion_jobs_finished_idx ON ingestion_jobs (finished_at) WHERE status = 'done'")
+
+        # Corpus version: a sequence advanced on every documents write, so caches (see
+        # answer_cache.py) can tell whether results may have changed. nextval takes no row lock,
+        # so concurrent writers do not queue on it. Sequences are not transactional, though: the
+        # trigger's bump is visible before the write commits, so the write helpers bump it once
+        # more after the commit (connection(corpus_write=True)). The trigger still covers writes
+        # made outside this module.
+        cur.execute("CREATE SEQUENCE IF NOT EXISTS corpus_version_seq")
+        cur.execute(
+            """
+        CREATE OR REPLACE FUNCTION bump_corpus_version() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM nextval('corpus_version_seq');
+            RETURN NULL;
+        END
+        $$;
+        """
+        )
+        cur.execute("DROP TRIGGER IF EXISTS documents_corpus_version ON documents")
+        cur.execute("DROP TRIGGER IF EXISTS documents_corpus_version_truncate ON documents")
+        cur.execute("DROP TABLE IF EXISTS corpus_version")
+        cur.execute(
+            "CREATE TRIGGER documents_corpus_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON documents "
+            "FOR EACH STATEMENT EXECUTE FUNCTION bump_corpus_version()"
+        )
 
+        # Users table
+        cur.execute(
+            """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username TEXT UNIQUE,
+            full_name TEXT,
+            is_admin BOOLEAN DEFAULT FALSE,
+            metadata JSONB,
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+        """
+        )
+        cur.close()
 
+
+@timed()
 def insert_document(title: str, content: str, metadata: Optional[Dict[str, Any]] = None, embedding: Optional[List[float]] = None) -> int:
     """Insert a document with optional embedding. Returns the inserted row id."""
-    conn = get_conn()
-    cur = conn.cursor()
     metadata_json = json.dumps(metadata or {})
-    if embedding:
-        # Insert embedding as PostgreSQL array - cast to vector in SQL for pgvector
-        cur.execute(
-            "INSERT INTO documents (title, content, metadata, embedding) VALUES (%s, %s, %s, %s) RETURNING id",
-            (title, content, metadata_json, embedding),
+    with connection(corpus_write=True) as conn:
+        cur = conn.cursor()
+        if embedding:
+            # Insert embedding as PostgreSQL array - cast to vector in SQL for pgvector
+            cur.execute(
+                "INSERT INTO documents (title, content, metadata, embedding) VALUES (%s, %s, %s, %s) RETURNING id",
+                (title, content, metadata_json, embedding),
+            )
+        else:
+            cur.execute(
+                "INSERT INTO documents (title, content, metadata) VALUES (%s, %s, %s) RETURNING id",
+                (title, content, metadata_json),
+            )
+        _id = cur.fetchone()[0]
+        cur.close()
+    return _id
+
+
+@timed()
+def insert_documents(rows: List[Dict[str, Any]], page_size: int = 500) -> List[int]:
+    """Insert many documents in a single transaction with multi-row INSERTs.
+
+    Each row is a dict with `title`, `content` and optional `metadata` / `embedding` /
+    `doc_key` / `chunk_index` / `content_hash`. Returns the inserted ids in input order.
+    """
+    if not rows:
+        return []
+    with connection(corpus_write=True) as conn:
+        cur = conn.cursor()
+        ids = _insert_rows(cur, rows, page_size)
+        cur.close()
+    return ids
+
+
+def _insert_rows(cur, rows: List[Dict[str, Any]], page_size: int = 500) -> List[int]:
+    values = [
+        (
+            r.get("title"),
+            r.get("content"),
+            json.dumps(r.get("metadata") or {}),
+            r.get("embedding") or None,
+            r.get("doc_key"),
+            r.get("chunk_index"),
+            r.get("content_hash"),
         )
-    else:
-        cur.execute(
-            "INSERT INTO documents (title, content, metadata) VALUES (%s, %s, %s) RETURNING id",
-            (title, content, metadata_json),
+        for r in rows
+    ]
+    result = execute_values(
+        cur,
+        "INSERT INTO documents (title, content, metadata, embedding, doc_key, chunk_index, content_hash) VALUES %s RETURNING id",
+        values,
+        template=f"(%s, %s, %s, %s::{_vec_type()}, %s, %s, %s)",
+        page_size=page_size,
+        fetch=True,
+    )
+    return [r[0] for r in result]
+
+
+@timed()
+def get_document_chunk_hashes(doc_key: str) -> List[str]:
+    """Content hashes of the chunks stored with an embedding for `doc_key`.
+
+    Rows whose embedding is missing (a failed batch) are left out, so re-ingesting repairs them.
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT content_hash FROM documents WHERE doc_key = %s AND embedding IS NOT NULL", (doc_key,))
+        rows = cur.fetchall()
+        cur.close()
+    return [r[0] for r in rows]
+
+
+@timed()
+def sync_document_chunks(
+    doc_key: str,
+    chunks: List[Dict[str, Any]],
+    embeddings: Dict[str, Optional[List[float]]],
+    embed_missing: Optional[Callable[[List[str]], List[Optional[List[float]]]]] = None,
+) -> Dict[str, int]:
+    """Make the stored chunks for `doc_key` match `chunks`, in one transaction.
+
+    Chunks are matched to existing rows by `content_hash`: matches are kept (their title,
+    position and metadata are refreshed if they moved), new hashes are inserted using
+    `embeddings[content_hash]`, and rows whose content disappeared are deleted. Extra copies
+    of a stored chunk reuse its embedding, and kept rows without one get `embeddings[hash]`.
+
+    Concurrent syncs of the same key are serialised, and what is stored is read under that
+    lock. If chunks need a vector that is not in `embeddings` (because another sync changed
+    the document since the caller looked), the transaction is given up, `embed_missing(texts)`
+    is called with no lock or connection held, and the sync starts over. Chunks it cannot
+    embed are stored without a vector, to be repaired by a later sync.
+    """
+    embeddings = {h: e for h, e in embeddings.items() if e is not None}
+    content = {c["content_hash"]: c["content"] for c in chunks}
+    attempted: set = set()
+    while True:
+        with connection() as conn:
+            cur = conn.cursor()
+            counts, missing = _sync_chunks_locked(cur, doc_key, chunks, embeddings, attempted if embed_missing else None)
+            cur.close()
+        if counts is not None:
+            _bump_corpus_version()
+            return counts
+        # Every pass embeds hashes not attempted before, so this ends.
+        attempted.update(missing)
+        for h, e in zip(missing, embed_missing([content[h] for h in missing])):
+            if e is not None:
+                embeddings[h] = e
+
+
+def _sync_chunks_locked(cur, doc_key: str, chunks: List[Dict[str, Any]], embeddings: Dict[str, List[float]], attempted: Optional[set]):
+    # Returns (counts, []) after writing, or (None, missing hashes) without writing anything
+    # when `attempted` is given and some needed vectors are neither known nor attempted yet.
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0, "repaired": 0}
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (doc_key,))
+    cur.execute(
+        "SELECT id, content_hash, chunk_index, title, metadata, embedding IS NOT NULL "
+        "FROM documents WHERE doc_key = %s ORDER BY chunk_index, id",
+        (doc_key,),
+    )
+    existing: Dict[str, List[tuple]] = {}
+    for row in cur.fetchall():
+        existing.setdefault(row[1], []).append(row)
+    embedded = {h for h, rows in existing.items() if any(r[5] for r in rows)}
+    for rows in existing.values():
+        # Match chunks to rows that have a vector first, so duplicates never drop the only one.
+        rows.sort(key=lambda r: not r[5])
+
+    inserts = []
+    moves = []
+    repairs = []  # (content_hash, id) of kept rows with no embedding
+    for c in chunks:
+        rows = existing.get(c["content_hash"])
+        if not rows:
+            inserts.append(dict(c, doc_key=doc_key))
+            continue
+        _id, _, chunk_index, title, metadata, has_embedding = rows.pop(0)
+        if not has_embedding:
+            repairs.append((c["content_hash"], _id))
+        if chunk_index != c["chunk_index"] or title != c["title"] or (metadata or {}) != (c.get("metadata") or {}):
+            moves.append((c["chunk_index"], c["title"], json.dumps(c.get("metadata") or {}), _id))
+        elif has_embedding:
+            counts["unchanged"] += 1
+
+    if attempted is not None:
+        needed = dict.fromkeys([c["content_hash"] for c in inserts] + [h for h, _ in repairs])
+        missing = [h for h in needed if h not in embeddings and h not in embedded and h not in attempted]
+        if missing:
+            return None, missing
+
+    stale = [row[0] for rows in existing.values() for row in rows]
+    if stale:
+        cur.execute("DELETE FROM documents WHERE id = ANY(%s)", (stale,))
+        counts["deleted"] = cur.rowcount
+    if moves:
+        execute_values(
+            cur,
+            "UPDATE documents AS d SET chunk_index = v.chunk_index, title = v.title, metadata = v.metadata::jsonb "
+            "FROM (VALUES %s) AS v (chunk_index, title, metadata, id) WHERE d.id = v.id",
+            moves,
         )
-    _id = cur.fetchone()[0]
-    conn.commit()
-    cur.close()
-    conn.close()
-    return _id
+        counts["updated"] = len(moves)
+    fixes = [(embeddings[h], _id) for h, _id in repairs if h in embeddings]
+    if fixes:
+        execute_values(
+            cur,
+            "UPDATE documents AS d SET embedding = v.embedding FROM (VALUES %s) AS v (embedding, id) WHERE d.id = v.id",
+            fixes,
+            template=f"(%s::{_vec_type()}, %s)",
+        )
+    if inserts:
+        for c in inserts:
+            c["embedding"] = embeddings.get(c["content_hash"])
+        counts["inserted"] = len(_insert_rows(cur, inserts))
+    # Rows still without a vector (extra copies of a stored chunk) take one from a row
+    # with the same content.
+    cur.execute(
+        "UPDATE documents AS d SET embedding = s.embedding FROM ("
+        "SELECT DISTINCT ON (content_hash) content_hash, embedding FROM documents "
+        "WHERE doc_key = %s AND embedding IS NOT NULL ORDER BY content_hash, id"
+        ") AS s WHERE d.doc_key = %s AND d.embedding IS NULL AND d.content_hash = s.content_hash",
+        (doc_key, doc_key),
+    )
+    counts["repaired"] = sum(1 for h, _ in repairs if h in embeddings or h in embedded)
+    return counts, []
 
 
+@timed()
 def get_document(doc_id: int) -> Optional[Dict[str, Any]]:
-    conn = get_conn()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT id, title, content, metadata, created_at FROM documents WHERE id = %s", (doc_id,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("SELECT id, title, content, metadata, created_at FROM documents WHERE id = %s", (doc_id,))
+        row = cur.fetchone()
+        cur.close()
     return row
 
 
-def update_document(doc_id: int, title: Optional[str] = None, content: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None) -> bool:
-    conn = get_conn()
-    cur = conn.cursor()
+@timed()
+def update_document(
+    doc_id: int,
+    title: Optional[str] = None,
+    content: Optional[str] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+    embedding: Optional[List[float]] = None,
+) -> bool:
+    """Update fields of a document.
+
+    Changing `content` also refreshes its content hash. Pass the new `embedding` with it
+    (see rag.update_document_text); otherwise the old embedding is cleared rather than left
+    pointing at text that no longer exists.
+    """
     updates = []
     params = []
     if title is not None:
@@ -122,100 +741,729 @@ def update_document(doc_id: int, title: Optional[str] = None, content: Optional[
     if content is not None:
         updates.append("content = %s")
         params.append(content)
+        updates.append("content_hash = %s")
+        params.append(text_hash(content))
+        updates.append(f"embedding = %s::{_vec_type()}")
+        params.append(embedding)
+    elif embedding is not None:
+        updates.append(f"embedding = %s::{_vec_type()}")
+        params.append(embedding)
     if metadata is not None:
         updates.append("metadata = %s")
         params.append(json.dumps(metadata))
     if not updates:
-        cur.close()
-        conn.close()
         return False
     params.append(doc_id)
     sql = f"UPDATE documents SET {', '.join(updates)} WHERE id = %s"
-    cur.execute(sql, tuple(params))
-    conn.commit()
-    cur.close()
-    conn.close()
+    with connection(corpus_write=True) as conn:
+        cur = conn.cursor()
+        cur.execute(sql, tuple(params))
+        cur.close()
     return True
 
 
+@timed()
 def delete_document(doc_id: int) -> bool:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM documents WHERE id = %s", (doc_id,))
-    changed = cur.rowcount
-    conn.commit()
-    cur.close()
-    conn.close()
+    with connection(corpus_write=True) as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM documents WHERE id = %s", (doc_id,))
+        changed = cur.rowcount
+        cur.close()
     return changed > 0
 
 
+@timed()
 def list_documents(limit: int = 20):
-    conn = get_conn()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT id, title, metadata, created_at FROM documents ORDER BY created_at DESC LIMIT %s", (limit,))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("SELECT id, title, metadata, created_at FROM documents ORDER BY created_at DESC LIMIT %s", (limit,))
+        rows = cur.fetchall()
+        cur.close()
     return rows
 
 
-def search_similar_by_embedding(embedding: List[float], k: int = 5):
-    """Return top-k similar documents using pgvector <-> operator (Euclidean distance).
+@timed()
+def list_documents_page(limit: int = 50, after: Optional[tuple] = None):
+    """Keyset-paginated listing, newest first, without document content.
+
+    Returns (rows, next_cursor). Pass `next_cursor` back as `after` for the next page; it is
+    None on the last page. Each row carries `content_length` instead of the content itself.
+    """
+    where = "WHERE (created_at, id) < (%s, %s) " if after else ""
+    params: List[Any] = list(after) if after else []
+    with connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            f"SELECT id, title, metadata, created_at, length(content) AS content_length FROM documents "
+            f"{where}ORDER BY created_at DESC, id DESC LIMIT %s",
+            (*params, limit + 1),
+        )
+        rows = cur.fetchall()
+        cur.close()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1]["created_at"], rows[-1]["id"])
+    return rows, next_cursor
+
+
+@timed()
+def get_documents(doc_ids: List[int]) -> List[Dict[str, Any]]:
+    """Fetch full rows (with content) for several ids, e.g. to expand lean search hits."""
+    if not doc_ids:
+        return []
+    with connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("SELECT id, title, content, metadata, created_at FROM documents WHERE id = ANY(%s)", (list(doc_ids),))
+        rows = {r["id"]: r for r in cur.fetchall()}
+        cur.close()
+    return [rows[i] for i in doc_ids if i in rows]
+
+
+def iter_documents(batch_size: int = 1000, include_content: bool = True) -> Iterator[Dict[str, Any]]:
+    """Stream every document through a server-side cursor, `batch_size` rows per round trip.
+
+    Memory stays flat regardless of table size. The pooled connection is held until the
+    iterator is exhausted or closed.
+    """
+    cols = "id, title, content, metadata, created_at" if include_content else "id, title, metadata, created_at"
+    with connection() as conn:
+        cur = conn.cursor(name=f"export_{os.getpid()}_{threading.get_ident()}", cursor_factory=RealDictCursor)
+        cur.itersize = batch_size
+        cur.execute(f"SELECT {cols} FROM documents ORDER BY id")
+        try:
+            for row in cur:
+                yield row
+        finally:
+            cur.close()
+
+
+def export_documents_jsonl(path: str, batch_size: int = 1000) -> int:
+    """Write all documents to a JSONL file via iter_documents. Returns the row count."""
+    n = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for row in iter_documents(batch_size):
+            f.write(json.dumps(row, default=str) + "\n")
+            n += 1
+    return n
+
+
+def _distance_ops(distance: Optional[str] = None):
+    distance = distance or VECTOR_DISTANCE
+    if distance not in _DISTANCE_OPS:
+        raise ValueError(f"unknown vector distance {distance!r}; expected one of {sorted(_DISTANCE_OPS)}")
+    return _DISTANCE_OPS[distance]
+
+
+def _vec_type() -> str:
+    return f"{VECTOR_STORAGE}({EMBEDDING_DIM})"
+
+
+def _index_target(distance: Optional[str] = None) -> str:
+    """Indexed expression plus operator class for the ANN index."""
+    if VECTOR_QUANTIZATION == "binary":
+        # Hamming distance between sign bits approximates cosine/inner-product order.
+        return f"(binary_quantize(embedding)::bit({EMBEDDING_DIM})) bit_hamming_ops"
+    _, opclass = _distance_ops(distance)
+    return "embedding " + opclass.replace("vector", VECTOR_STORAGE, 1)
+
+
+def _ivfflat_lists(row_count: int) -> int:
+    # pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond that.
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(row_count ** 0.5)
+
+
+def _vector_index_sql(kind: Optional[str] = None, distance: Optional[str] = None, lists: Optional[int] = None, concurrently: bool = False) -> str:
+    kind = kind or VECTOR_INDEX_TYPE
+    target = _index_target(distance)
+    conc = "CONCURRENTLY " if concurrently else ""
+    if kind == "hnsw":
+        return (
+            f"CREATE INDEX {conc}IF NOT EXISTS {VECTOR_INDEX_NAME} ON documents "
+            f"USING hnsw ({target}) WITH (m = {int(HNSW_M)}, ef_construction = {int(HNSW_EF_CONSTRUCTION)})"
+        )
+    if kind == "ivfflat":
+        return (
+            f"CREATE INDEX {conc}IF NOT EXISTS {VECTOR_INDEX_NAME} ON documents "
+            f"USING ivfflat ({target}) WITH (lists = {int(lists or 100)})"
+        )
+    if kind == "none":
+        return "SELECT 1"
+    raise ValueError(f"unknown vector index type {kind!r}; expected 'hnsw', 'ivfflat' or 'none'")
+
+
+@timed()
+def create_vector_index(kind: Optional[str] = None, distance: Optional[str] = None, concurrently: bool = True):
+    """Create the ANN index on documents.embedding if it doesn't exist.
+
+    IVFFlat list count is derived from the current row count, so build it after loading data.
+    """
+    lists = None
+    if (kind or VECTOR_INDEX_TYPE) == "ivfflat":
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT count(*) FROM documents WHERE embedding IS NOT NULL")
+            lists = _ivfflat_lists(cur.fetchone()[0])
+            cur.close()
+    with _autocommit_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(_vector_index_sql(kind, distance, lists=lists, concurrently=concurrently))
+        cur.close()
+
+
+@timed()
+def rebuild_vector_index(kind: Optional[str] = None, distance: Optional[str] = None):
+    """Rebuild the ANN index after bulk loads.
+
+    HNSW is reindexed in place; IVFFlat is dropped and recreated so its list count and
+    centroids reflect the current data. Changing `kind` or `distance` also recreates it.
+    """
+    kind = kind or VECTOR_INDEX_TYPE
+    recreate = kind == "ivfflat" or kind != VECTOR_INDEX_TYPE or (distance or VECTOR_DISTANCE) != VECTOR_DISTANCE
+    with _autocommit_connection() as conn:
+        cur = conn.cursor()
+        if recreate:
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {VECTOR_INDEX_NAME}")
+        else:
+            cur.execute("SELECT to_regclass(%s)", (VECTOR_INDEX_NAME,))
+            if cur.fetchone()[0] is not None:
+                cur.execute(f"REINDEX INDEX CONCURRENTLY {VECTOR_INDEX_NAME}")
+                cur.execute("ANALYZE documents")
+                cur.close()
+                return
+        cur.close()
+    create_vector_index(kind, distance)
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("ANALYZE documents")
+        cur.close()
+
+
+def _set_search_tunables(
+    cur, ef_search: Optional[int] = None, probes: Optional[int] = None, iterative: bool = False, limit: Optional[int] = None
+):
+    # SET LOCAL only lasts for the current transaction, so it is safe behind pgbouncer.
+    ef_search = ef_search or HNSW_EF_SEARCH
+    probes = probes or IVFFLAT_PROBES
+    if limit and VECTOR_INDEX_TYPE == "hnsw" and limit > (ef_search or HNSW_DEFAULT_EF_SEARCH):
+        # An HNSW scan returns at most ef_search rows, so an oversampled LIMIT needs a wider
+        # beam; past the server's maximum an iterative scan keeps going instead.
+        ef_search = min(limit, HNSW_MAX_EF_SEARCH)
+        iterative = iterative or limit > HNSW_MAX_EF_SEARCH
+    if ef_search:
+        cur.execute(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
+    if probes:
+        cur.execute(f"SET LOCAL ivfflat.probes = {int(probes)}")
+    if iterative and VECTOR_ITERATIVE_SCAN != "off" and VECTOR_INDEX_TYPE in ("hnsw", "ivfflat") and _supports_iterative_scan(cur):
+        # Keep scanning the index until k rows pass the filter instead of returning short.
+        if VECTOR_INDEX_TYPE == "hnsw":
+            cur.execute(f"SET LOCAL hnsw.iterative_scan = {VECTOR_ITERATIVE_SCAN}")
+            if HNSW_MAX_SCAN_TUPLES:
+                cur.execute(f"SET LOCAL hnsw.max_scan_tuples = {int(HNSW_MAX_SCAN_TUPLES)}")
+        else:
+            # IVFFlat only supports relaxed_order; the outer ORDER BY distance restores the order.
+            cur.execute("SET LOCAL ivfflat.iterative_scan = relaxed_order")
+
+
+_iterative_scan_supported: Optional[bool] = None
+
+
+def _supports_iterative_scan(cur) -> bool:
+    # Iterative index scans arrived in pgvector 0.8.0; older versions reject the settings.
+    global _iterative_scan_supported
+    if _iterative_scan_supported is None:
+        cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        row = cur.fetchone()
+        version = (row["extversion"] if isinstance(row, dict) else row[0]) if row else "0"
+        parts = tuple(int(p) for p in version.split(".")[:2] if p.isdigit())
+        _iterative_scan_supported = parts >= (0, 8)
+    return _iterative_scan_supported
+
+
+def _content_projection(snippet_chars: Optional[int]) -> str:
+    if snippet_chars is None:
+        return "content"
+    return f"left(content, {int(snippet_chars)}) AS snippet"
+
+
+def _metadata_filter_sql(filters: Optional[Dict[str, Any]]):
+    """Translate metadata predicates into a SQL WHERE fragment and params.
+
+    - `created_after` / `created_before`: range on documents.created_at
+    - list/tuple/set value: metadata key equals any of the values
+    - any other value: metadata key equals the value (JSON containment, GIN-indexed)
+    """
+    if not filters:
+        return "", []
+    clauses = []
+    params: List[Any] = []
+    contains: Dict[str, Any] = {}
+    for key, value in filters.items():
+        if key == "created_after":
+            clauses.append("created_at >= %s")
+            params.append(value)
+        elif key == "created_before":
+            clauses.append("created_at < %s")
+            params.append(value)
+        elif isinstance(value, (list, tuple, set)):
+            values = list(value)
+            if not values:
+                clauses.append("FALSE")
+                continue
+            clauses.append("(" + " OR ".join(["metadata @> %s::jsonb"] * len(values)) + ")")
+            params.extend(json.dumps({key: v}) for v in values)
+        else:
+            contains[key] = value
+    if contains:
+        clauses.insert(0, "metadata @> %s::jsonb")
+        params.insert(0, json.dumps(contains))
+    return " AND ".join(clauses), params
+
+
+@timed()
+def search_similar_by_embedding(
+    embedding: List[float],
+    k: int = 5,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    snippet_chars: Optional[int] = None,
+    rerank_factor: Optional[int] = None,
+):
+    """Return top-k similar documents ordered by the configured distance (VECTOR_DISTANCE).
 
     This function expects the `embedding` to be a Python list of floats. The SQL performs a cast
-    to `vector` to compare against the stored embeddings.
+    to the column type (`vector` or `halfvec`) to compare against the stored embeddings.
+    `ef_search` (HNSW) and `probes` (IVFFlat) trade recall for speed for this query only.
+    With VECTOR_QUANTIZATION=binary the index yields k * `rerank_factor` candidates by Hamming
+    distance (hnsw.ef_search is raised to cover them), which are then re-ranked by exact
+    distance. `filters` are metadata predicates (see _metadata_filter_sql) applied in SQL;
+    with pgvector >= 0.8 filtered queries use an iterative index scan so they still return k
+    rows when the filter is selective.
+    With `snippet_chars` the rows carry a `snippet` instead of the full `content`.
     """
-    conn = get_conn()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    # Build SQL that casts the passed array to vector. The exact cast syntax may vary; psycopg2
-    # will send the list as a PostgreSQL array and pgvector accepts array to vector casting.
+    op, _ = _distance_ops()
+    vt = _vec_type()
+    body = _content_projection(snippet_chars)
+    where, fparams = _metadata_filter_sql(filters)
+    where_sql = f"WHERE {where} " if where else ""
+    if VECTOR_QUANTIZATION == "binary":
+        order = f"binary_quantize(embedding)::bit({EMBEDDING_DIM}) <~> binary_quantize(%s::{vt})"
+        limit = k * max(1, rerank_factor or VECTOR_RERANK_FACTOR)
+    else:
+        order = f"embedding {op} %s::{vt}"
+        limit = k
+    with connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        _set_search_tunables(cur, ef_search, probes, iterative=bool(where), limit=limit)
+        # psycopg2 sends the list as a PostgreSQL array, which pgvector casts to vector/halfvec.
+        # The CTE takes `limit` rows in index order and computes the exact distance for just those;
+        # the outer sort re-ranks them (binary candidates, or relaxed-order iterative scans).
+        cur.execute(
+            f"WITH hits AS MATERIALIZED ("
+            f"SELECT id, title, {body}, metadata, created_at, embedding {op} %s::{vt} AS distance "
+            f"FROM documents {where_sql}ORDER BY {order} LIMIT %s"
+            f") SELECT * FROM hits ORDER BY distance LIMIT %s",
+            (embedding, *fparams, embedding, limit, k),
+        )
+        rows = cur.fetchall()
+        cur.close()
+    return rows
+
+
+def _embedding_column_type(cur) -> str:
     cur.execute(
-        "SELECT id, title, content, metadata, created_at FROM documents ORDER BY embedding <-> %s::vector LIMIT %s",
-        (embedding, k),
+        "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+        "WHERE attrelid = 'documents'::regclass AND attname = 'embedding'"
     )
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    return cur.fetchone()[0]
+
+
+@timed()
+def migrate_embedding_storage() -> Dict[str, str]:
+    """Convert documents.embedding to VECTOR_STORAGE / EMBEDDING_DIM and rebuild the ANN index.
+
+    Narrower dimensions are produced by truncating and re-normalising the stored vectors, which
+    matches the `dimensions` parameter for Matryoshka-trained models (text-embedding-3-*);
+    other models need re-embedding instead. Widening is impossible and raises before anything
+    is changed; when column and index already match, nothing is done. The ALTER rewrites the
+    table under an exclusive lock, so run it in a maintenance window.
+    """
+    target = _vec_type()
+    with connection() as conn:
+        cur = conn.cursor()
+        current = _embedding_column_type(cur)
+        cur.execute("SELECT indexdef FROM pg_indexes WHERE indexname = %s", (VECTOR_INDEX_NAME,))
+        index = cur.fetchone()
+        cur.close()
+    using = None
+    if current != target:
+        # Validate before touching the index: a rejected migration must leave search intact.
+        dims = int(current[current.index("(") + 1 : -1]) if "(" in current else None
+        if dims is not None and dims < EMBEDDING_DIM:
+            raise RuntimeError(f"documents.embedding is {current}; cannot widen to {target}, re-embed instead")
+        using = "embedding"
+        if dims is None or dims > EMBEDDING_DIM:
+            using = f"l2_normalize(subvector(embedding, 1, {EMBEDDING_DIM}))"
+    quantized = index is not None and "binary_quantize" in index[0]
+    if using is None and index is not None and quantized == (VECTOR_QUANTIZATION == "binary"):
+        return {"from": current, "to": target, "quantization": VECTOR_QUANTIZATION, "changed": False}
+    with _autocommit_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {VECTOR_INDEX_NAME}")
+        cur.close()
+    if using is not None:
+        with connection(corpus_write=True) as conn:
+            cur = conn.cursor()
+            cur.execute(f"ALTER TABLE documents ALTER COLUMN embedding TYPE {target} USING {using}::{target}")
+            cur.close()
+    create_vector_index()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("ANALYZE documents")
+        cur.close()
+    return {"from": current, "to": target, "quantization": VECTOR_QUANTIZATION, "changed": True}
+
+
+@timed()
+def recall_report(
+    queries: int = 50,
+    k: int = 10,
+    rerank_factors: Optional[List[int]] = None,
+    ef_search_values: Optional[List[int]] = None,
+) -> List[Dict[str, Any]]:
+    """Recall@k and latency of indexed search against an exact scan, per search setting.
+
+    Uses `queries` stored embeddings as queries. Ground truth is a sequential scan ordered by the
+    exact distance at the stored precision. Settings swept: `rerank_factors` with binary
+    quantization, otherwise `ef_search_values` for HNSW.
+    """
+    op, _ = _distance_ops()
+    vt = _vec_type()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT embedding::text FROM documents WHERE embedding IS NOT NULL ORDER BY random() LIMIT %s", (queries,))
+        samples = [json.loads(r[0]) for r in cur.fetchall()]
+        truth = []
+        cur.execute("SET LOCAL enable_indexscan = off")
+        cur.execute("SET LOCAL enable_bitmapscan = off")
+        for q in samples:
+            cur.execute(f"SELECT id FROM documents ORDER BY embedding {op} %s::{vt} LIMIT %s", (q, k))
+            truth.append({r[0] for r in cur.fetchall()})
+        cur.close()
+    if VECTOR_QUANTIZATION == "binary":
+        settings = [{"rerank_factor": f} for f in (rerank_factors or [1, 2, 4, 8, 16])]
+    elif VECTOR_INDEX_TYPE == "hnsw":
+        settings = [{"ef_search": e} for e in (ef_search_values or [40, 100, 200, 400])]
+    else:
+        settings = [{}]
+    report = []
+    for setting in settings:
+        latencies, hits = [], 0
+        for q, expected in zip(samples, truth):
+            start = time.perf_counter()
+            rows = search_similar_by_embedding(q, k=k, snippet_chars=0, **setting)
+            latencies.append(time.perf_counter() - start)
+            hits += len(expected & {r["id"] for r in rows})
+        latencies.sort()
+        report.append(
+            {
+                "storage": vt,
+                "quantization": VECTOR_QUANTIZATION,
+                **setting,
+                "recall": hits / max(1, sum(len(t) for t in truth)),
+                "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+                "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0.0,
+            }
+        )
+    return report
+
+
+@timed()
+def search_lexical(query: str, k: int = 5, filters: Optional[Dict[str, Any]] = None, snippet_chars: Optional[int] = None):
+    """Return top-k documents by full-text rank (ts_rank_cd) for a free-form query.
+
+    Query terms are OR-ed (spoken questions rarely contain every word of the answer);
+    documents matching more terms, closer together, rank higher. `filters` as for
+    search_similar_by_embedding.
+    """
+    body = _content_projection(snippet_chars)
+    where, fparams = _metadata_filter_sql(filters)
+    and_sql = f"AND {where} " if where else ""
+    with connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            f"SELECT id, title, {body}, metadata, created_at, ts_rank_cd(content_tsv, q) AS rank "
+            "FROM documents, to_tsquery(%s::regconfig, replace(plainto_tsquery(%s::regconfig, %s)::text, ' & ', ' | ')) AS q "
+            f"WHERE content_tsv @@ q {and_sql}ORDER BY rank DESC LIMIT %s",
+            (FTS_CONFIG, FTS_CONFIG, query, *fparams, k),
+        )
+        rows = cur.fetchall()
+        cur.close()
     return rows
 
 
+@timed()
+def get_corpus_version() -> int:
+    """Counter that changes whenever any row in `documents` is written."""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT last_value FROM corpus_version_seq")
+        row = cur.fetchone()
+        cur.close()
+    return row[0] if row else 0
+
+
+@timed()
+def get_cached_embeddings(model: str, text_hashes: List[str], max_age_seconds: Optional[float] = None) -> Dict[str, List[float]]:
+    """Look up cached embeddings by text hash; entries older than `max_age_seconds` are ignored."""
+    if not text_hashes:
+        return {}
+    sql = "SELECT text_hash, embedding FROM embedding_cache WHERE model = %s AND text_hash = ANY(%s)"
+    params: List[Any] = [model, list(text_hashes)]
+    if max_age_seconds:
+        sql += " AND created_at > NOW() - make_interval(secs => %s)"
+        params.append(max_age_seconds)
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, tuple(params))
+        rows = cur.fetchall()
+        cur.close()
+    return {h: emb for h, emb in rows}
+
+
+@timed()
+def put_cached_embeddings(model: str, items: Dict[str, List[float]]):
+    """Store embeddings keyed by text hash, refreshing existing entries."""
+    if not items:
+        return
+    with connection() as conn:
+        cur = conn.cursor()
+        execute_values(
+            cur,
+            "INSERT INTO embedding_cache (model, text_hash, embedding) VALUES %s "
+            "ON CONFLICT (model, text_hash) DO UPDATE SET embedding = EXCLUDED.embedding, created_at = NOW()",
+            [(model, h, emb) for h, emb in items.items()],
+            page_size=500,
+        )
+        cur.close()
+
+
+@timed()
+def prune_embedding_cache(max_age_seconds: Optional[float] = None, max_rows: Optional[int] = None) -> int:
+    """Evict expired cache rows, then the oldest rows beyond `max_rows`. Returns rows deleted."""
+    deleted = 0
+    with connection() as conn:
+        cur = conn.cursor()
+        if max_age_seconds:
+            cur.execute("DELETE FROM embedding_cache WHERE created_at <= NOW() - make_interval(secs => %s)", (max_age_seconds,))
+            deleted += cur.rowcount
+        if max_rows is not None:
+            cur.execute(
+                "DELETE FROM embedding_cache WHERE ctid IN "
+                "(SELECT ctid FROM embedding_cache ORDER BY created_at DESC OFFSET %s)",
+                (max_rows,),
+            )
+            deleted += cur.rowcount
+        cur.close()
+    return deleted
+
+
+@timed()
+def enqueue_ingestion_job(doc_key: str, title: str, content: str, metadata: Optional[Dict[str, Any]] = None) -> int:
+    """Queue a document for the ingestion worker. Returns the job id."""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO ingestion_jobs (doc_key, title, content, metadata) VALUES (%s, %s, %s, %s) RETURNING id",
+            (doc_key, title, content, json.dumps(metadata or {})),
+        )
+        job_id = cur.fetchone()[0]
+        cur.close()
+    return job_id
+
+
+@timed()
+def claim_ingestion_job(worker_id: str, lease_seconds: float, max_attempts: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Lock the next runnable job for `worker_id`, or return None if the queue is empty.
+
+    Runnable means queued and due, or running with a heartbeat older than `lease_seconds`
+    (its worker died). With `max_attempts`, stale jobs that already used all their attempts
+    are marked failed instead of being reclaimed, so a job that kills its worker cannot loop
+    forever. SKIP LOCKED lets any number of workers poll without blocking each other.
+    """
+    with connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        if max_attempts is not None:
+            cur.execute(
+                "UPDATE ingestion_jobs SET status = 'failed', locked_by = NULL, finished_at = NOW(), "
+                "error = coalesce(error || E'\\n', '') || 'worker lost after ' || attempts || ' attempts' "
+                "WHERE id IN ("
+                "SELECT id FROM ingestion_jobs WHERE status = 'running' AND attempts >= %s "
+                "AND heartbeat_at < NOW() - make_interval(secs => %s) FOR UPDATE SKIP LOCKED"
+                ")",
+                (max_attempts, lease_seconds),
+            )
+        cur.execute(
+            "UPDATE ingestion_jobs SET status = 'running', attempts = attempts + 1, locked_by = %s, "
+            "heartbeat_at = NOW(), started_at = coalesce(started_at, NOW()) "
+            "WHERE id = ("
+            "SELECT id FROM ingestion_jobs "
+            "WHERE status IN ('queued', 'running') AND run_after <= NOW() "
+            "AND (status = 'queued' OR heartbeat_at < NOW() - make_interval(secs => %s)) "
+            "ORDER BY run_after, id FOR UPDATE SKIP LOCKED LIMIT 1"
+            ") RETURNING id, doc_key, title, content, metadata, attempts, chunks_done",
+            (worker_id, lease_seconds),
+        )
+        row = cur.fetchone()
+        cur.close()
+    return row
+
+
+@timed()
+def update_ingestion_progress(job_id: int, worker_id: str, chunks_done: int, chunks_total: int) -> bool:
+    """Record progress and refresh the heartbeat. False if the job was reclaimed by another worker."""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE ingestion_jobs SET chunks_done = %s, chunks_total = %s, heartbeat_at = NOW() "
+            "WHERE id = %s AND locked_by = %s AND status = 'running'",
+            (chunks_done, chunks_total, job_id, worker_id),
+        )
+        ok = cur.rowcount == 1
+        cur.close()
+    return ok
+
+
+@timed()
+def finish_ingestion_job(job_id: int, worker_id: str, stats: Optional[Dict[str, Any]] = None, error: Optional[str] = None, retry_in: Optional[float] = None):
+    """Mark a job done (no `error`), requeue it after `retry_in` seconds, or mark it failed.
+
+    The document text is dropped once it has been ingested.
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        if error is None:
+            cur.execute(
+                "UPDATE ingestion_jobs SET status = 'done', stats = %s, error = NULL, content = NULL, "
+                "locked_by = NULL, finished_at = NOW() WHERE id = %s AND locked_by = %s",
+                (json.dumps(stats or {}), job_id, worker_id),
+            )
+        elif retry_in is not None:
+            cur.execute(
+                "UPDATE ingestion_jobs SET status = 'queued', error = %s, locked_by = NULL, "
+                "run_after = NOW() + make_interval(secs => %s) WHERE id = %s AND locked_by = %s",
+                (error, retry_in, job_id, worker_id),
+            )
+        else:
+            cur.execute(
+                "UPDATE ingestion_jobs SET status = 'failed', error = %s, locked_by = NULL, finished_at = NOW() "
+                "WHERE id = %s AND locked_by = %s",
+                (error, job_id, worker_id),
+            )
+        cur.close()
+
+
+@timed()
+def ingestion_queue_stats(window_seconds: float = 3600) -> Dict[str, Any]:
+    """Job counts by status, plus jobs/chunks/tokens finished within the last `window_seconds`."""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT status, count(*) FROM ingestion_jobs GROUP BY status")
+        counts = dict(cur.fetchall())
+        cur.execute(
+            "SELECT count(*), coalesce(sum((stats->>'chunks')::bigint), 0), coalesce(sum((stats->>'tokens')::bigint), 0) "
+            "FROM ingestion_jobs WHERE status = 'done' AND finished_at > NOW() - make_interval(secs => %s)",
+            (window_seconds,),
+        )
+        jobs, chunks, tokens = cur.fetchone()
+        cur.close()
+    return {
+        "queued": counts.get("queued", 0),
+        "running": counts.get("running", 0),
+        "done": counts.get("done", 0),
+        "failed": counts.get("failed", 0),
+        "window_seconds": window_seconds,
+        "jobs_done": jobs,
+        "chunks_per_min": chunks / window_seconds * 60,
+        "tokens_per_min": tokens / window_seconds * 60,
+    }
+
+
+@timed()
+def list_ingestion_jobs(limit: int = 50) -> List[Dict[str, Any]]:
+    """Most recent jobs without their text, newest first."""
+    with connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            "SELECT id, doc_key, title, status, attempts, chunks_done, chunks_total, error, locked_by, "
+            "run_after, created_at, started_at, finished_at FROM ingestion_jobs ORDER BY id DESC LIMIT %s",
+            (limit,),
+        )
+        rows = cur.fetchall()
+        cur.close()
+    return rows
+
+
+@timed()
 def add_telegram_group(tg_id: int, name: str, description: str = "", metadata: Optional[Dict[str, Any]] = None) -> int:
-    conn = get_conn()
-    cur = conn.cursor()
     metadata_json = json.dumps(metadata or {})
-    cur.execute(
-        "INSERT INTO telegram_groups (tg_id, name, description, metadata) VALUES (%s, %s, %s, %s) RETURNING id",
-        (tg_id, name, description, metadata_json),
-    )
-    _id = cur.fetchone()[0]
-    conn.commit()
-    cur.close()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO telegram_groups (tg_id, name, description, metadata) VALUES (%s, %s, %s, %s) RETURNING id",
+            (tg_id, name, description, metadata_json),
+        )
+        _id = cur.fetchone()[0]
+        cur.close()
     return _id
 
 
+@timed()
 def list_telegram_groups(limit: int = 50):
-    conn = get_conn()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT id, tg_id, name, description, metadata, created_at FROM telegram_groups ORDER BY created_at DESC LIMIT %s", (limit,))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("SELECT id, tg_id, name, description, metadata, created_at FROM telegram_groups ORDER BY created_at DESC LIMIT %s", (limit,))
+        rows = cur.fetchall()
+        cur.close()
     return rows
 
 
+@timed()
 def delete_telegram_group(group_id: int) -> bool:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM telegram_groups WHERE id = %s", (group_id,))
-    changed = cur.rowcount
-    conn.commit()
-    cur.close()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM telegram_groups WHERE id = %s", (group_id,))
+        changed = cur.rowcount
+        cur.close()
     return changed > 0
 
 
 if __name__ == "__main__":
-    print("Initializing DB (creating tables and extension).")
-    init_db()
+    import sys
+
+    if len(sys.argv) > 2 and sys.argv[1] == "export":
+        print(f"Exported {export_documents_jsonl(sys.argv[2])} documents to {sys.argv[2]}.")
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate-embeddings":
+        print(f"Migrating documents.embedding to {_vec_type()} (quantization: {VECTOR_QUANTIZATION}).")
+        print(migrate_embedding_storage())
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "prune-cache":
+        from embedding_cache import get_embedding_cache
+
+        print(f"Pruned {get_embedding_cache().prune()} embedding cache rows.")
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "recall-report":
+        for row in recall_report(queries=int(sys.argv[2]) if len(sys.argv) > 2 else 50):
+            print(json.dumps(row))
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "reindex":
+        print(f"Rebuilding {VECTOR_INDEX_TYPE} index ({VECTOR_DISTANCE}) on documents.embedding.")
+        rebuild_vector_index()
+    else:
+        print("Initializing DB (creating tables and extension).")
+        init_db()
     print("Done.")
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any
+
+# In-memory LRU entries (each 1536-dim embedding is ~6 KB stored as float32).
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2000"))
+# Entries older than this many seconds are treated as misses (0 disables expiry).
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", str(30 * 24 * 3600)))
+# Upper bound on rows kept in the Postgres `embedding_cache` table when pruning.
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "1000000"))
+# Prune the Postgres tier in the background after this many new rows (0: only `python db.py prune-cache`).
+EMBEDDING_CACHE_PRUNE_EVERY = int(os.getenv("EMBEDDING_CACHE_PRUNE_EVERY", "10000"))
+# Set to 0 to keep the cache in memory only.
+EMBEDDING_CACHE_PERSIST = os.getenv("EMBEDDING_CACHE_PERSIST", "1") not in ("0", "false", "False", "")
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text so trivially different copies (unicode form, whitespace) share a cache key."""
+    return _WS.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache: an in-memory LRU in front of the Postgres `embedding_cache` table.
+
+    Keys are (model, sha256 of normalized text). Persistent-tier errors are logged and treated
+    as misses so a DB hiccup never blocks embedding.
+    """
+
+    def __init__(
+        self,
+        max_items: int = EMBEDDING_CACHE_SIZE,
+        ttl: float = EMBEDDING_CACHE_TTL,
+        persist: bool = EMBEDDING_CACHE_PERSIST,
+        prune_every: int = EMBEDDING_CACHE_PRUNE_EVERY,
+    ):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.persist = persist
+        self.prune_every = prune_every
+        self._lock = threading.Lock()
+        # (model, hash) -> (float32 array, stored_at)
+        self._items: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._written_since_prune = 0
+        self._prune_thread: Optional[threading.Thread] = None
+        self._stats = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "evictions": 0, "persistent_errors": 0, "pruned": 0}
+
+    def _mem_get(self, key, now):
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        emb, stored_at = entry
+        if self.ttl and now - stored_at > self.ttl:
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return emb
+
+    def _mem_put(self, key, emb, now):
+        if self.max_items <= 0:
+            return
+        self._items[key] = (array("f", emb), now)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Return cached embeddings for `texts` in order, None where missing."""
+        hashes = [text_hash(t) for t in texts]
+        out: List[Optional[List[float]]] = [None] * len(texts)
+        missing: Dict[str, List[int]] = {}
+        now = time.time()
+        with self._lock:
+            for i, h in enumerate(hashes):
+                emb = self._mem_get((model, h), now)
+                if emb is not None:
+                    out[i] = emb.tolist()
+                    self._stats["memory_hits"] += 1
+                else:
+                    missing.setdefault(h, []).append(i)
+
+        if missing and self.persist:
+            try:
+                from db import get_cached_embeddings
+
+                found = get_cached_embeddings(model, list(missing), max_age_seconds=self.ttl or None)
+            except Exception as e:
+                print("Embedding cache lookup failed:", e)
+                found = {}
+                with self._lock:
+                    self._stats["persistent_errors"] += 1
+            with self._lock:
+                for h, emb in found.items():
+                    self._mem_put((model, h), emb, now)
+                    for i in missing.pop(h):
+                        out[i] = list(emb)
+                        self._stats["persistent_hits"] += 1
+
+        with self._lock:
+            self._stats["misses"] += sum(len(v) for v in missing.values())
+        return out
+
+    def put_many(self, model: str, texts: List[str], embeddings: List[Optional[List[float]]]):
+        """Store freshly computed embeddings in both tiers; None entries are skipped."""
+        items = {text_hash(t): e for t, e in zip(texts, embeddings) if e is not None}
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            for h, emb in items.items():
+                self._mem_put((model, h), emb, now)
+        if self.persist:
+            try:
+                from db import put_cached_embeddings
+
+                put_cached_embeddings(model, items)
+            except Exception as e:
+                print("Embedding cache write failed:", e)
+                with self._lock:
+                    self._stats["persistent_errors"] += 1
+            else:
+                self._maybe_prune(len(items))
+
+    def _maybe_prune(self, written: int):
+        # Off the caller's thread: embedding never waits on the DELETEs, and one prune runs at a time.
+        with self._lock:
+            self._written_since_prune += written
+            if not self.prune_every or self._written_since_prune < self.prune_every:
+                return
+            if self._prune_thread is not None and self._prune_thread.is_alive():
+                return
+            self._written_since_prune = 0
+            self._prune_thread = threading.Thread(target=self._prune_quietly, name="embedding-cache-prune", daemon=True)
+            self._prune_thread.start()
+
+    def _prune_quietly(self):
+        try:
+            self.prune()
+        except Exception as e:
+            print("Embedding cache prune failed:", e)
+            with self._lock:
+                self._stats["persistent_errors"] += 1
+
+    def prune(self, max_rows: int = EMBEDDING_CACHE_MAX_ROWS) -> int:
+        """Evict expired and excess rows from the persistent tier. Returns rows deleted."""
+        from db import prune_embedding_cache
+
+        deleted = prune_embedding_cache(max_age_seconds=self.ttl or None, max_rows=max_rows)
+        with self._lock:
+            self._stats["pruned"] += deleted
+        return deleted
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+            out["memory_items"] = len(self._items)
+        lookups = out["memory_hits"] + out["persistent_hits"] + out["misses"]
+        out["hit_rate"] = (out["memory_hits"] + out["persistent_hits"]) / lookups if lookups else 0.0
+        return out
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide embedding cache."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+    return _cache
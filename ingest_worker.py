@@ -0,0 +1,192 @@
+import os
+import signal
+import socket
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+load_dotenv()
+
+from db import (
+    claim_ingestion_job,
+    enqueue_ingestion_job,
+    finish_ingestion_job,
+    update_ingestion_progress,
+)
+from metrics import span, timed
+import retry
+
+# Worker processes started by `python ingest_worker.py`; each claims its own jobs.
+INGEST_WORKER_PROCESSES = int(os.getenv("INGEST_WORKER_PROCESSES", "2"))
+# Idle sleep between polls of an empty queue.
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "2"))
+# A running job whose heartbeat is older than this is treated as abandoned and reclaimed.
+INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", "300"))
+# Attempts per job before it is marked failed.
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+# Chunks embedded between progress updates (and heartbeats).
+INGEST_BATCH_CHUNKS = int(os.getenv("INGEST_BATCH_CHUNKS", "64"))
+# Exponential backoff for retryable embedding errors: base * 2**n seconds with jitter, capped.
+INGEST_BACKOFF_BASE = float(os.getenv("INGEST_BACKOFF_BASE", "1"))
+INGEST_BACKOFF_MAX = float(os.getenv("INGEST_BACKOFF_MAX", "60"))
+# In-job retries of one embedding batch before the job is requeued.
+INGEST_EMBED_RETRIES = int(os.getenv("INGEST_EMBED_RETRIES", "5"))
+
+
+class LeaseLost(RuntimeError):
+    """The job was reclaimed by another worker (our heartbeat went stale)."""
+
+
+def enqueue(title: str, text: str, metadata: Optional[Dict[str, Any]] = None, doc_key: Optional[str] = None) -> int:
+    """Queue a document for background ingestion (embed_and_store semantics). Returns the job id."""
+    return enqueue_ingestion_job(doc_key or title, title, text, metadata)
+
+
+def backoff_delay(attempt: int, e: Optional[BaseException] = None) -> float:
+    """retry.backoff_delay with the INGEST_BACKOFF_* settings."""
+    return retry.backoff_delay(attempt, e, INGEST_BACKOFF_BASE, INGEST_BACKOFF_MAX)
+
+
+def embed_with_backoff(
+    texts: List[str],
+    token_counts: List[int],
+    embed: Optional[Callable[..., List[Optional[List[float]]]]] = None,
+    retries: int = INGEST_EMBED_RETRIES,
+    sleep: Callable[[float], None] = time.sleep,
+) -> List[Optional[List[float]]]:
+    """embed_texts for one batch, retrying rate limits and transient errors with backoff."""
+    if embed is None:
+        from rag import embed_texts as embed
+    out = retry.call_with_backoff(
+        lambda: embed(texts, token_counts=token_counts, raise_errors=True),
+        retries,
+        INGEST_BACKOFF_BASE,
+        INGEST_BACKOFF_MAX,
+        sleep=sleep,
+        label="Ingest: embedding batch",
+    )
+    if any(v is None for v in out):
+        raise RuntimeError("Embedding API returned no vector for some chunks")
+    return out
+
+
+def progress_embedder(job_id: int, worker_id: str, batch_chunks: int = INGEST_BATCH_CHUNKS, embed=None, sleep=time.sleep):
+    """An embed_fn for embed_and_store that embeds in batches and records progress after each.
+
+    Finished batches land in the embedding cache, so a job resumed after a crash or a requeue
+    gets them back without API calls and only pays for the remainder; the final chunk sync
+    is still a single transaction.
+    """
+
+    def embed_fn(texts: List[str], token_counts: List[int]) -> List[Optional[List[float]]]:
+        out: List[Optional[List[float]]] = []
+        while True:
+            if not update_ingestion_progress(job_id, worker_id, len(out), len(texts)):
+                raise LeaseLost(f"job {job_id} was reclaimed by another worker")
+            if len(out) >= len(texts):
+                return out
+            i = len(out)
+            out.extend(embed_with_backoff(texts[i : i + batch_chunks], token_counts[i : i + batch_chunks], embed=embed, sleep=sleep))
+
+    return embed_fn
+
+
+@timed()
+def process_job(job: Dict[str, Any], worker_id: str, sleep=time.sleep) -> Optional[Dict[str, Any]]:
+    """Ingest one claimed job and record its outcome. Returns the embed_and_store stats on success."""
+    from rag import embed_and_store
+
+    job_id = job["id"]
+    if job.get("chunks_done"):
+        print(f"Ingest: resuming job {job_id} at chunk {job['chunks_done']} (attempt {job['attempts']})")
+    try:
+        stats = embed_and_store(
+            job["title"],
+            job["content"] or "",
+            metadata=job.get("metadata") or {},
+            doc_key=job["doc_key"],
+            embed_fn=progress_embedder(job_id, worker_id, sleep=sleep),
+        )
+    except LeaseLost as e:
+        # Another worker owns the job now; leave its row alone.
+        print("Ingest:", e)
+        return None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if job["attempts"] < INGEST_MAX_ATTEMPTS:
+            delay = backoff_delay(job["attempts"], e)
+            print(f"Ingest: job {job_id} failed ({error}), requeued in {delay:.0f}s")
+            finish_ingestion_job(job_id, worker_id, error=error, retry_in=delay)
+        else:
+            print(f"Ingest: job {job_id} failed permanently after {job['attempts']} attempts: {error}")
+            finish_ingestion_job(job_id, worker_id, error=error)
+        return None
+    finish_ingestion_job(job_id, worker_id, stats=stats)
+    return stats
+
+
+def worker_loop(worker_id: Optional[str] = None, should_stop: Callable[[], bool] = lambda: False, once: bool = False) -> int:
+    """Claim and process jobs until `should_stop()` (or, with `once`, until the queue is empty).
+
+    Returns the number of jobs processed.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    processed = 0
+    while not should_stop():
+        try:
+            job = claim_ingestion_job(worker_id, INGEST_LEASE_SECONDS, max_attempts=INGEST_MAX_ATTEMPTS)
+        except Exception as e:
+            print("Ingest: could not claim a job:", e)
+            job = None
+        if job is None:
+            if once:
+                break
+            time.sleep(INGEST_POLL_SECONDS)
+            continue
+        with span("ingest.job"):
+            process_job(job, worker_id)
+        processed += 1
+    return processed
+
+
+def _run_process(once: bool):
+    stopping = []
+    # Finish the current job on SIGTERM/SIGINT, then exit; a hard kill is covered by the lease.
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    signal.signal(signal.SIGINT, lambda *_: stopping.append(True))
+    worker_loop(should_stop=lambda: bool(stopping), once=once)
+
+
+def run_worker(processes: int = INGEST_WORKER_PROCESSES, once: bool = False):
+    """Run `processes` worker processes until they are signalled (or the queue drains with `once`)."""
+    import multiprocessing
+
+    procs = [multiprocessing.Process(target=_run_process, args=(once,), name=f"ingest-{i}") for i in range(processes)]
+    for p in procs:
+        p.start()
+
+    def _forward(signum, _frame):
+        for p in procs:
+            if p.is_alive():
+                os.kill(p.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, _forward)
+    signal.signal(signal.SIGINT, _forward)
+    for p in procs:
+        p.join()
+
+
+def main(argv=None) -> int:
+    """Background ingestion worker for the ingestion_jobs queue."""
+    import argparse
+
+    ap = argparse.ArgumentParser(description=main.__doc__)
+    ap.add_argument("--processes", type=int, default=INGEST_WORKER_PROCESSES)
+    ap.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    args = ap.parse_args(argv)
+    run_worker(max(1, args.processes), once=args.once)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,268 @@
+import os
+import re
+import threading
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+# Intents scoring at least this much (not counting the RAG prior) are all reported, for multi-intent utterances.
+ROUTER_MULTI_INTENT_MIN = float(os.getenv("ROUTER_MULTI_INTENT_MIN", "1.0"))
+# Below this keyword confidence (or with no keyword hits) the hashed n-gram centroid classifier is consulted (0 disables it).
+ROUTER_CENTROID_MIN_CONFIDENCE = float(os.getenv("ROUTER_CENTROID_MIN_CONFIDENCE", "0.5"))
+# Cosine similarity a centroid needs before it overrides the keyword route.
+ROUTER_CENTROID_MIN_SIMILARITY = float(os.getenv("ROUTER_CENTROID_MIN_SIMILARITY", "0.35"))
+
+INTENTS = ("db", "telegram", "rag", "smalltalk")
+# Score every utterance starts with for RAG, the default tool.
+RAG_PRIOR = 0.5
+
+# phrase -> (intent, weight). Matching is on whole tokens and leftmost-longest, so
+# "latest update" claims "update" for RAG before the DB verb rule can see it.
+KEYWORDS: Dict[str, Tuple[str, float]] = {
+    # DB objects
+    "customer": ("db", 1.0),
+    "customers": ("db", 1.0),
+    "account": ("db", 1.0),
+    "accounts": ("db", 1.0),
+    "customer record": ("db", 1.5),
+    "user record": ("db", 1.5),
+    "crm": ("db", 1.0),
+    # Telegram objects
+    "telegram": ("telegram", 1.5),
+    "group": ("telegram", 1.0),
+    "groups": ("telegram", 1.0),
+    "chat": ("telegram", 0.8),
+    "chats": ("telegram", 0.8),
+    "channel": ("telegram", 0.8),
+    "group chat": ("telegram", 1.5),
+    # Questions about content go to RAG
+    "what": ("rag", 1.0),
+    "how": ("rag", 1.0),
+    "why": ("rag", 1.0),
+    "when": ("rag", 0.8),
+    "where": ("rag", 0.8),
+    "which": ("rag", 0.6),
+    "explain": ("rag", 1.0),
+    "tell me about": ("rag", 1.0),
+    "documentation": ("rag", 1.0),
+    "manual": ("rag", 0.8),
+    "policy": ("rag", 0.8),
+    "procedure": ("rag", 1.0),
+    "latest update": ("rag", 1.0),
+    "last update": ("rag", 1.0),
+    "an update": ("rag", 0.8),
+    "the update": ("rag", 0.6),
+    "software update": ("rag", 1.0),
+    "firmware update": ("rag", 1.0),
+    "chat history": ("rag", 0.5),
+    # Small talk never needs retrieval
+    "hi": ("smalltalk", 1.5),
+    "hello": ("smalltalk", 1.5),
+    "hey": ("smalltalk", 1.5),
+    "thanks": ("smalltalk", 1.5),
+    "thank you": ("smalltalk", 1.5),
+    "good morning": ("smalltalk", 1.5),
+    "bye": ("smalltalk", 1.5),
+    "goodbye": ("smalltalk", 1.5),
+    "how are you": ("smalltalk", 1.5),
+    "nice to meet you": ("smalltalk", 2.0),
+}
+# Action verbs. Their weight goes to the object intent found in the same clause (write verbs
+# default to DB when there is none), and is larger when the verb opens the clause
+# ("delete customer 4", not "the delete failed").
+WRITE_VERBS = {"update", "delete", "create", "add", "remove", "rename", "change", "insert", "edit"}
+ACTION_VERBS = WRITE_VERBS | {"list", "show"}
+ACTION_WEIGHT = 0.4
+LEADING_ACTION_WEIGHT = 1.2
+# Tokens skipped when deciding whether a verb leads its clause.
+POLITE_PREFIX = {"please", "can", "could", "would", "you", "kindly", "i", "want", "to", "need", "and", "then", "also"}
+CLAUSE_BREAKS = {"and", "then", "also"}
+
+# Seed utterances for the centroid classifier used on low-confidence routes.
+EXAMPLES: Dict[str, List[str]] = {
+    "db": [
+        "update the billing address for acme",
+        "delete customer 42",
+        "create a new account for jane doe",
+        "change the email on my account",
+        "look up the customer record for order 1881",
+        "remove user bob from the crm",
+    ],
+    "telegram": [
+        "list the telegram groups",
+        "add the support chat to telegram",
+        "remove group 1200 from the bot",
+        "which chats is the bot in",
+        "rename the sales group",
+        "show me our telegram channels",
+    ],
+    "rag": [
+        "how do I reset the pump",
+        "what does the warranty cover",
+        "explain the torque settings for the valve",
+        "what was the latest firmware update",
+        "find the shipping policy for pallets",
+        "summarize the safety manual",
+    ],
+    "smalltalk": ["hello there", "thanks a lot", "good morning", "bye for now", "how are you", "nice to meet you"],
+}
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+_NGRAM_DIM = 1 << 12
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall((text or "").lower())
+
+
+def split_clauses(text: str) -> List[str]:
+    """Split an utterance on clause connectives ("and", "then", "also") and commas."""
+    words = "|".join(sorted(CLAUSE_BREAKS))
+    pattern = rf"\s*,\s*(?:(?:{words})\s+)?|\s+(?:{words})\s+"
+    return [c for c in (p.strip() for p in re.split(pattern, text or "", flags=re.IGNORECASE)) if c]
+
+
+def _ngram_vector(text: str) -> np.ndarray:
+    """L2-normalized hashed character trigram counts; a tiny local text embedding."""
+    v = np.zeros(_NGRAM_DIM, dtype=np.float32)
+    for tok in tokenize(text):
+        padded = f" {tok} "
+        for i in range(len(padded) - 2):
+            v[zlib.crc32(padded[i : i + 3].encode()) & (_NGRAM_DIM - 1)] += 1.0
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm else v
+
+
+class IntentRouter:
+    """Compiled keyword automaton over tokens, with a centroid classifier fallback.
+
+    `classify` returns {"intent", "confidence", "intents": [(intent, confidence), ...], "source"}
+    where `intents` lists every intent that cleared `multi_min` (best first), so
+    "delete customer 7 and list telegram groups" yields both db and telegram.
+    """
+
+    def __init__(
+        self,
+        keywords: Dict[str, Tuple[str, float]] = KEYWORDS,
+        examples: Optional[Dict[str, List[str]]] = EXAMPLES,
+        multi_min: float = ROUTER_MULTI_INTENT_MIN,
+        centroid_min_confidence: float = ROUTER_CENTROID_MIN_CONFIDENCE,
+    ):
+        # Token trie: nested dicts, with the rule stored under the None key of a terminal node.
+        self._trie: Dict[Any, Any] = {}
+        for phrase, rule in keywords.items():
+            node = self._trie
+            for tok in tokenize(phrase):
+                node = node.setdefault(tok, {})
+            node[None] = rule
+        self.multi_min = multi_min
+        self.centroid_min_confidence = centroid_min_confidence
+        self._labels: List[str] = []
+        self._centroids: Optional[np.ndarray] = None
+        if examples and centroid_min_confidence:
+            self.fit_centroids(examples)
+
+    def fit_centroids(self, examples: Dict[str, Iterable[str]]):
+        labels, rows = [], []
+        for intent, texts in examples.items():
+            vecs = [_ngram_vector(t) for t in texts]
+            if not vecs:
+                continue
+            c = np.mean(vecs, axis=0)
+            norm = float(np.linalg.norm(c))
+            labels.append(intent)
+            rows.append(c / norm if norm else c)
+        self._labels = labels
+        self._centroids = np.stack(rows) if rows else None
+
+    def _match(self, tokens: List[str]) -> Iterable[Tuple[int, int, Tuple[str, float]]]:
+        """Leftmost-longest phrase matches as (start, end, rule)."""
+        i, n = 0, len(tokens)
+        while i < n:
+            node, j, best = self._trie, i, None
+            while j < n and tokens[j] in node:
+                node = node[tokens[j]]
+                j += 1
+                if None in node:
+                    best = (j, node[None])
+            if best is None:
+                i += 1
+                continue
+            yield i, best[0], best[1]
+            i = best[0]
+
+    def keyword_scores(self, text: str) -> Dict[str, float]:
+        tokens = tokenize(text)
+        scores = dict.fromkeys(INTENTS, 0.0)
+        scores["rag"] = RAG_PRIOR
+        claimed = [False] * len(tokens)
+        # Object intents per clause, so a verb's weight follows the thing it acts on.
+        clause = [0] * len(tokens)
+        cid = 0
+        for idx, tok in enumerate(tokens):
+            if tok in CLAUSE_BREAKS:
+                cid += 1
+            clause[idx] = cid
+        objects: Dict[int, List[str]] = {}
+        for start, end, (intent, weight) in self._match(tokens):
+            scores[intent] += weight
+            for k in range(start, end):
+                claimed[k] = True
+            if intent in ("db", "telegram"):
+                objects.setdefault(clause[start], []).append(intent)
+        leading = True
+        for idx, tok in enumerate(tokens):
+            if tok in CLAUSE_BREAKS:
+                leading = True
+                continue
+            if tok in ACTION_VERBS and not claimed[idx]:
+                targets = objects.get(clause[idx]) or (["db"] if tok in WRITE_VERBS else [])
+                weight = LEADING_ACTION_WEIGHT if leading else ACTION_WEIGHT
+                for intent in set(targets):
+                    scores[intent] += weight
+            if tok not in POLITE_PREFIX:
+                leading = False
+        return scores
+
+    def centroid_scores(self, text: str) -> Optional[Dict[str, float]]:
+        if self._centroids is None:
+            return None
+        sims = self._centroids @ _ngram_vector(text)
+        return {label: float(s) for label, s in zip(self._labels, sims)}
+
+    def classify(self, text: str) -> Dict[str, Any]:
+        scores = self.keyword_scores(text)
+        total = sum(scores.values())
+        ranked = sorted(((i, s / total) for i, s in scores.items() if s > 0), key=lambda x: -x[1])
+        if total == RAG_PRIOR or ranked[0][1] < self.centroid_min_confidence:
+            # No keyword evidence, or a near tie: ask the centroid model, keeping the
+            # keyword answer unless some centroid is actually close.
+            centroid = self.centroid_scores(text)
+            if centroid and max(centroid.values()) >= ROUTER_CENTROID_MIN_SIMILARITY:
+                positive = {i: max(0.0, s) for i, s in centroid.items()}
+                norm = sum(positive.values())
+                best = max(positive, key=positive.get)
+                return {"intent": best, "confidence": positive[best] / norm, "intents": [(best, positive[best] / norm)], "source": "centroid"}
+        evidence = dict(scores, rag=scores["rag"] - RAG_PRIOR)
+        intents = [(i, c) for i, c in ranked if evidence[i] >= self.multi_min] or ranked[:1]
+        if intents[0][0] != ranked[0][0]:
+            intents.insert(0, ranked[0])
+        return {"intent": intents[0][0], "confidence": intents[0][1], "intents": intents, "source": "keywords"}
+
+
+_router: Optional[IntentRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> IntentRouter:
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = IntentRouter()
+    return _router
+
+
+def classify_intent(text: str) -> Dict[str, Any]:
+    """Classify `text` with the shared router; see IntentRouter.classify."""
+    return get_router().classify(text)
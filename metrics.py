@@ -0,0 +1,176 @@
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+# Samples kept per span name for percentile estimates.
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1000"))
+# Optional JSONL file that receives one line per finished span.
+METRICS_LOG_PATH = os.getenv("METRICS_LOG_PATH") or None
+# Port for the Prometheus text endpoint (0 disables it).
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 0)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class _Series:
+    __slots__ = ("samples", "count", "total", "errors", "max")
+
+    def __init__(self):
+        self.samples = deque(maxlen=METRICS_WINDOW)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.max = 0.0
+
+
+_series: Dict[str, _Series] = {}
+_recent = deque(maxlen=200)
+_lock = threading.Lock()
+_log_lock = threading.Lock()
+_local = threading.local()
+
+
+def observe(name: str, seconds: float, error: bool = False, parent: Optional[str] = None):
+    """Record one duration for `name`."""
+    with _lock:
+        s = _series.get(name)
+        if s is None:
+            s = _series[name] = _Series()
+        s.samples.append(seconds)
+        s.count += 1
+        s.total += seconds
+        s.max = max(s.max, seconds)
+        if error:
+            s.errors += 1
+        _recent.append({"ts": time.time(), "name": name, "seconds": seconds, "error": error, "parent": parent})
+    if METRICS_LOG_PATH:
+        line = json.dumps({"ts": time.time(), "span": name, "seconds": round(seconds, 6), "error": error, "parent": parent})
+        with _log_lock:
+            with open(METRICS_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+@contextmanager
+def span(name: str):
+    """Time a block. Nested spans record their enclosing span as `parent`."""
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    parent = stack[-1] if stack else None
+    stack.append(name)
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        stack.pop()
+        observe(name, time.perf_counter() - start, error=error, parent=parent)
+
+
+def timed(name: Optional[str] = None) -> Callable:
+    """Decorator form of `span`; defaults to "<module>.<function>"."""
+
+    def deco(fn):
+        label = name or f"{fn.__module__}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return deco
+
+
+def _quantile(sorted_samples: List[float], q: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    # Nearest-rank percentile.
+    idx = min(len(sorted_samples) - 1, max(0, math.ceil(q * len(sorted_samples)) - 1))
+    return sorted_samples[idx]
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """Per-span count, error count, sum, max and p50/p95/p99 over the recent window (seconds)."""
+    with _lock:
+        items = [(n, list(s.samples), s.count, s.total, s.errors, s.max) for n, s in _series.items()]
+    out = {}
+    for name, samples, count, total, errors, mx in sorted(items):
+        samples.sort()
+        row = {"count": count, "errors": errors, "sum": total, "max": mx}
+        for q in QUANTILES:
+            row[f"p{int(q * 100)}"] = _quantile(samples, q)
+        out[name] = row
+    return out
+
+
+def recent_spans(limit: int = 50) -> List[Dict[str, Any]]:
+    """Most recent finished spans, newest first."""
+    with _lock:
+        return list(_recent)[-limit:][::-1]
+
+
+def reset():
+    with _lock:
+        _series.clear()
+        _recent.clear()
+
+
+def render_prometheus() -> str:
+    """Prometheus text exposition: one summary (quantiles, _sum, _count) per span."""
+    lines = [
+        "# HELP voice_agent_span_seconds Latency of instrumented voice agent stages.",
+        "# TYPE voice_agent_span_seconds summary",
+    ]
+    errors = ["# HELP voice_agent_span_errors_total Spans that raised.", "# TYPE voice_agent_span_errors_total counter"]
+    for name, row in snapshot().items():
+        label = name.replace("\\", "\\\\").replace('"', '\\"')
+        for q in QUANTILES:
+            lines.append(f'voice_agent_span_seconds{{span="{label}",quantile="{q}"}} {row[f"p{int(q * 100)}"]:.6f}')
+        lines.append(f'voice_agent_span_seconds_sum{{span="{label}"}} {row["sum"]:.6f}')
+        lines.append(f'voice_agent_span_seconds_count{{span="{label}"}} {row["count"]}')
+        errors.append(f'voice_agent_span_errors_total{{span="{label}"}} {row["errors"]}')
+    return "\n".join(lines + errors) + "\n"
+
+
+_server = None
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = "127.0.0.1"):
+    """Serve /metrics (Prometheus text) and /metrics.json on a daemon thread. Idempotent."""
+    global _server
+    if _server is not None or not port:
+        return _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body, ctype = json.dumps(snapshot()).encode(), "application/json"
+            elif self.path.startswith("/metrics"):
+                body, ctype = render_prometheus().encode(), "text/plain; version=0.0.4"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    _server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _server
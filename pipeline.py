@@ -0,0 +1,188 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Union
+
+# Per-stage timeouts in seconds for a voice request.
+STAGE_TIMEOUTS = {
+    "preprocess": float(os.getenv("PIPELINE_PREPROCESS_TIMEOUT", "10")),
+    "transcribe": float(os.getenv("PIPELINE_TRANSCRIBE_TIMEOUT", "60")),
+    "cache": float(os.getenv("PIPELINE_CACHE_TIMEOUT", "1")),
+    "embed": float(os.getenv("PIPELINE_EMBED_TIMEOUT", "10")),
+    "search": float(os.getenv("PIPELINE_SEARCH_TIMEOUT", "5")),
+    "tool": float(os.getenv("PIPELINE_TOOL_TIMEOUT", "15")),
+    # Listing recent documents when retrieval failed.
+    "fallback": float(os.getenv("PIPELINE_FALLBACK_TIMEOUT", "5")),
+}
+# Threads used to run the blocking OpenAI / psycopg2 / whisper calls off the event loop.
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "32"))
+RAG_TOP_K = 5
+
+
+class StageTimeout(RuntimeError):
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"{stage} stage timed out after {timeout:.1f}s")
+        self.stage = stage
+        self.timeout = timeout
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _loop_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+    return _executor
+
+
+async def run_stage(name: str, fn: Callable, *args, timeout: Optional[float] = None, timings: Optional[Dict[str, float]] = None, **kwargs):
+    """Run a blocking call on the pipeline executor with a timeout.
+
+    On timeout or cancellation the awaiting request moves on immediately; the worker thread
+    finishes its call in the background and the result is discarded.
+    """
+    timeout = STAGE_TIMEOUTS.get(name) if timeout is None else timeout
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    fut = loop.run_in_executor(_get_executor(), lambda: fn(*args, **kwargs))
+    try:
+        return await asyncio.wait_for(fut, timeout)
+    except asyncio.TimeoutError:
+        raise StageTimeout(name, timeout)
+    finally:
+        if timings is not None:
+            timings[name] = time.perf_counter() - start
+
+
+async def answer_text(text: str, timeouts: Optional[Dict[str, float]] = None, timings: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """Route a transcript and run the chosen tool(s). Vector-mode RAG is split into embed and search stages."""
+    from agent_router import route_text
+    from answer_cache import cached_exact, cached_search_rag
+    from db import list_documents, search_similar_by_embedding
+    from intent_router import classify_intent
+    from rag import SEARCH_MODE, SEARCH_SNIPPET_CHARS, embed_texts
+
+    timeouts = timeouts or {}
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    routing = classify_intent(text)
+    timings["route"] = time.perf_counter() - start
+    if routing["intent"] != "rag" or len(routing["intents"]) > 1:
+        # Compound requests run their tools concurrently inside route_text.
+        return await run_stage("tool", route_text, text, timeout=timeouts.get("tool"), timings=timings)
+
+    try:
+        if SEARCH_MODE != "vector":
+            # Hybrid/lexical retrieval manages its own per-leg latency budgets.
+            results = await run_stage("search", cached_search_rag, text, k=RAG_TOP_K, timeout=timeouts.get("search"), timings=timings)
+            return {"tool": "rag", "query": text, "results": results}
+        # Exact repeats are answered without paying for the query embedding.
+        try:
+            cached = await run_stage("cache", cached_exact, text, k=RAG_TOP_K, timeout=timeouts.get("cache"), timings=timings)
+        except Exception as e:
+            print("Answer cache lookup failed:", e)
+            cached = None
+        if cached is not None:
+            return {"tool": "rag", "query": text, "results": cached}
+        emb = (await run_stage("embed", embed_texts, [text], timeout=timeouts.get("embed"), timings=timings))[0]
+        if emb is None:
+            raise RuntimeError("Failed to compute query embedding")
+        results = await run_stage(
+            "search",
+            cached_search_rag,
+            text,
+            k=RAG_TOP_K,
+            embedding=emb,
+            search=lambda: search_similar_by_embedding(emb, k=RAG_TOP_K, snippet_chars=SEARCH_SNIPPET_CHARS or None),
+            timeout=timeouts.get("search"),
+            timings=timings,
+        )
+        return {"tool": "rag", "query": text, "results": results}
+    except Exception as e:
+        # Like rag_tool: report the error and fall back to the most recent documents.
+        out = {"tool": "rag", "query": text, "error": str(e)}
+        try:
+            out["fallback_docs"] = await run_stage("fallback", list_documents, limit=RAG_TOP_K, timeout=timeouts.get("fallback"), timings=timings)
+        except Exception as fallback_error:
+            print("RAG fallback failed:", fallback_error)
+        return out
+
+
+async def handle_voice_request(
+    audio: Optional[Union[str, bytes]],
+    timeouts: Optional[Dict[str, float]] = None,
+    filename: Optional[str] = None,
+    transcript: Optional[str] = None,
+) -> Dict[str, Any]:
+    """preprocess -> transcribe -> route -> embed -> search for one clip, with per-stage timeouts.
+
+    `audio` is a file path or the encoded bytes of a clip (pass `filename` so the transcription
+    API knows the container); audio stays in memory throughout. Returns {"transcript", "result",
+    "timings", "audio"}; `audio` holds the preprocessing stats (bytes and seconds before/after) or
+    None when the original clip was sent. A transcription timeout raises StageTimeout.
+    With `transcript` (from an earlier run on the same clip) the clip is not touched and only
+    routing and retrieval run, so their results always reflect the current corpus.
+    """
+    from audio_preprocess import AUDIO_PREPROCESS, EXTENSIONS, preprocess_audio
+    from transcribe import transcribe_bytes
+
+    timeouts = timeouts or {}
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+    stats = None
+    if transcript is None:
+        if isinstance(audio, str):
+            filename = filename or os.path.basename(audio)
+            with open(audio, "rb") as f:
+                audio = f.read()
+        data, name = audio, filename or "audio.wav"
+        if AUDIO_PREPROCESS:
+            try:
+                data, stats = await run_stage("preprocess", preprocess_audio, audio, timeout=timeouts.get("preprocess"), timings=timings)
+                name = "audio" + EXTENSIONS[stats["format"]]
+            except Exception as e:
+                # Undecodable input or PyAV missing: the transcription API can still take the original.
+                print("Audio preprocessing failed, sending the original clip:", e)
+        transcript = await run_stage("transcribe", transcribe_bytes, data, name, timeout=timeouts.get("transcribe"), timings=timings)
+    result = await answer_text(transcript, timeouts=timeouts, timings=timings)
+    timings["total"] = time.perf_counter() - start
+    return {"transcript": transcript, "result": result, "timings": timings, "audio": stats}
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    # One event loop per process, on a daemon thread, shared by every Streamlit session.
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="pipeline-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def submit_voice_request(
+    audio: Optional[Union[str, bytes]],
+    timeouts: Optional[Dict[str, float]] = None,
+    filename: Optional[str] = None,
+    transcript: Optional[str] = None,
+) -> Future:
+    """Schedule a voice request on the shared loop; `.cancel()` on the future cancels it."""
+    return asyncio.run_coroutine_threadsafe(handle_voice_request(audio, timeouts, filename, transcript), _get_loop())
+
+
+def run_voice_request(
+    audio: Optional[Union[str, bytes]],
+    timeouts: Optional[Dict[str, float]] = None,
+    filename: Optional[str] = None,
+    transcript: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Blocking wrapper for synchronous callers such as the Streamlit script thread."""
+    return submit_voice_request(audio, timeouts, filename, transcript).result()
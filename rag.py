@@ -1,61 +1,310 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Callable
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from dotenv import load_dotenv
 load_dotenv()
 
-from db import insert_document, search_similar_by_embedding
+from chunker import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, chunk_stream, get_encoding
+from db import get_document_chunk_hashes, search_lexical, search_similar_by_embedding, sync_document_chunks, update_document
+from embedding_cache import get_embedding_cache, text_hash
+from metrics import span, timed
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Limits for multi-input embedding requests. The API caps a single input at 8191 tokens
+# and a whole request at 2048 inputs / ~300k tokens; stay comfortably below the latter.
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "250000"))
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "256"))
+# Shorter embeddings via the API's `dimensions` parameter (text-embedding-3-* only); unset keeps
+# the model default. db.py sizes documents.embedding from the same variable.
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS") or 0) or None
 
-def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
-    try:
-        # Prefer langchain splitter if available
-        from langchain.text_splitter import RecursiveCharacterTextSplitter
-
-        splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-        return splitter.split_text(text)
-    except Exception:
-        # Fallback naive splitter
-        chunks = []
-        i = 0
-        while i < len(text):
-            chunks.append(text[i : i + chunk_size])
-            i += chunk_size - chunk_overlap
-        return chunks
-
-
-def embed_and_store(title: str, text: str, metadata: Dict[str, Any] = None):
-    """Chunk text, compute embeddings (using OpenAI if available), and store chunks in Postgres vector DB via insert_document."""
-    embedding_model = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
-    chunks = chunk_text(text)
-    for i, chunk in enumerate(chunks):
-        embedding = None
-        try:
-            if OPENAI_API_KEY:
-                import openai
+# Retrieval mode for search_rag: hybrid (lexical + vector, fused) | vector | lexical.
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid")
+# Latency budgets (seconds) for each hybrid leg, measured from the start of the search.
+HYBRID_VECTOR_BUDGET = float(os.getenv("HYBRID_VECTOR_BUDGET", "2.0"))
+HYBRID_LEXICAL_BUDGET = float(os.getenv("HYBRID_LEXICAL_BUDGET", "1.0"))
+# Reciprocal rank fusion constant; larger values flatten the influence of top ranks.
+RRF_K = int(os.getenv("RRF_K", "60"))
+# search_rag returns this many leading characters as `snippet` instead of full `content`
+# (0 returns full content). Fetch the rest on demand with db.get_document(s).
+SEARCH_SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "300"))
+
+
+def _embedding_model() -> str:
+    return os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Token count for `text` under the embedding model's tokenizer (approximate without tiktoken)."""
+    enc = get_encoding(model or _embedding_model())
+    if enc is None:
+        return max(1, len(text) // 4)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def _truncate_tokens(text: str, max_tokens: int, model: str) -> str:
+    enc = get_encoding(model)
+    if enc is None:
+        return text[: max_tokens * 4]
+    return enc.decode(enc.encode(text, disallowed_special=())[:max_tokens])
+
+
+def batch_by_tokens(
+    token_counts: List[int],
+    max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+    max_inputs: int = EMBEDDING_BATCH_MAX_INPUTS,
+) -> Iterator[List[int]]:
+    """Group input indices into batches that respect per-request token and input limits."""
+    batch: List[int] = []
+    batch_tokens = 0
+    for i, n in enumerate(token_counts):
+        if batch and (batch_tokens + n > max_tokens or len(batch) >= max_inputs):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += n
+    if batch:
+        yield batch
 
-                openai.api_key = OPENAI_API_KEY
-                resp = openai.Embedding.create(input=chunk, model=embedding_model)
-                embedding = resp["data"][0]["embedding"]
+
+@timed()
+def embed_texts(
+    texts: List[str],
+    model: Optional[str] = None,
+    token_counts: Optional[List[int]] = None,
+    raise_errors: bool = False,
+) -> List[Optional[List[float]]]:
+    """Embed many texts with as few multi-input API requests as the token limits allow.
+
+    Cached embeddings (see embedding_cache.py) are reused; only misses reach the API, and
+    identical texts within the call are embedded once. Returns one embedding per input, in
+    order; entries are None for batches that failed, or with `raise_errors` the first API
+    error is raised (batches embedded before it are already cached).
+    """
+    model = model or _embedding_model()
+    if not texts:
+        return []
+    cache = get_embedding_cache()
+    # Vectors of different widths from one model must not share cache entries.
+    cache_model = f"{model}@{EMBEDDING_DIMENSIONS}" if EMBEDDING_DIMENSIONS else model
+    embeddings = cache.get_many(cache_model, texts)
+    if all(e is not None for e in embeddings) or not OPENAI_API_KEY:
+        return embeddings
+    import openai
+
+    openai.api_key = OPENAI_API_KEY
+    # Unique texts still to embed, mapped to every position they occupy.
+    pending: Dict[str, List[int]] = {}
+    for i, e in enumerate(embeddings):
+        if e is None:
+            pending.setdefault(texts[i], []).append(i)
+    todo = list(pending)
+    if token_counts is None:
+        counts = [count_tokens(t, model) for t in todo]
+    else:
+        counts = [token_counts[pending[t][0]] for t in todo]
+    inputs = list(todo)
+    for i, n in enumerate(counts):
+        if n > EMBEDDING_MAX_INPUT_TOKENS:
+            inputs[i] = _truncate_tokens(inputs[i], EMBEDDING_MAX_INPUT_TOKENS, model)
+    capped = [min(n, EMBEDDING_MAX_INPUT_TOKENS) for n in counts]
+    extra = {"dimensions": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {}
+    for batch in batch_by_tokens(capped):
+        try:
+            with span("openai.embeddings"):
+                resp = openai.Embedding.create(input=[inputs[i] for i in batch], model=model, **extra)
         except Exception as e:
-            print("Embedding failed for chunk", i, e)
+            if raise_errors:
+                raise
+            print("Embedding failed for", len(batch), "chunks:", e)
+            continue
+        fresh = [None] * len(batch)
+        for item in resp["data"]:
+            fresh[item["index"]] = item["embedding"]
+        for j, emb in zip(batch, fresh):
+            for i in pending[todo[j]]:
+                embeddings[i] = emb
+        cache.put_many(cache_model, [todo[j] for j in batch], fresh)
+    return embeddings
+
+
+@timed()
+def chunk_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """Split text into token-sized chunks on sentence/paragraph boundaries (see chunker.py)."""
+    return list(chunk_stream([text], max_tokens=max_tokens, overlap_tokens=overlap_tokens, model=_embedding_model()))
+
+
+@timed()
+def embed_and_store(
+    title: str,
+    text: str,
+    metadata: Dict[str, Any] = None,
+    doc_key: Optional[str] = None,
+    embed_fn: Optional[Callable[[List[str], List[int]], List[Optional[List[float]]]]] = None,
+) -> Dict[str, Any]:
+    """Chunk text, embed new chunks in batched requests and sync them into Postgres.
+
+    Chunks are tracked under `doc_key` (defaults to `title`) by content hash, so re-ingesting
+    an edited document only embeds and inserts chunks whose text changed, deletes chunks that
+    disappeared and leaves the rest in place, all in one transaction. The stored hashes are
+    read up front so the bulk of the embedding happens outside the sync's lock; anything a
+    concurrent sync changed in the meantime is embedded between sync attempts, with no lock held.
 
+    `embed_fn(texts, token_counts)` replaces the embed_texts call; the ingestion worker uses
+    it to embed in batches with progress reporting and retries.
+
+    Returns stats: chunks, embedded, tokens (embedded), inserted/updated/unchanged/deleted,
+    seconds, chunks_per_sec and tokens_per_sec.
+    """
+    start = time.perf_counter()
+    embedding_model = _embedding_model()
+    doc_key = doc_key or title
+    chunks = chunk_text(text)
+    hashes = [text_hash(c) for c in chunks]
+    known = set(get_document_chunk_hashes(doc_key))
+
+    new_hashes: Dict[str, str] = {}
+    for chunk, h in zip(chunks, hashes):
+        if h not in known and h not in new_hashes:
+            new_hashes[h] = chunk
+    to_embed = list(new_hashes.values())
+    token_counts = [count_tokens(c, embedding_model) for c in to_embed]
+    if embed_fn is None:
+        embeddings = embed_texts(to_embed, model=embedding_model, token_counts=token_counts)
+    else:
+        embeddings = embed_fn(to_embed, token_counts)
+
+    rows = []
+    for i, (chunk, h) in enumerate(zip(chunks, hashes)):
         md = dict((metadata or {}).copy())
         md.update({"chunk_index": i})
-        insert_document(title=f"{title} - chunk {i}", content=chunk, metadata=md, embedding=embedding)
+        rows.append({"title": f"{title} - chunk {i}", "content": chunk, "metadata": md, "chunk_index": i, "content_hash": h})
+    counts = sync_document_chunks(
+        doc_key,
+        rows,
+        dict(zip(new_hashes, embeddings)),
+        # The few chunks a concurrent sync changed in the meantime: embedded directly, so they
+        # do not show up as the job's progress in the ingest worker's embed_fn.
+        embed_missing=lambda texts: embed_texts(texts, model=embedding_model),
+    )
+
+    elapsed = time.perf_counter() - start
+    tokens = sum(token_counts)
+    stats = {
+        "chunks": len(chunks),
+        "tokens": tokens,
+        "embedded": sum(1 for e in embeddings if e is not None),
+        "seconds": elapsed,
+        "chunks_per_sec": len(chunks) / elapsed if elapsed else 0.0,
+        "tokens_per_sec": tokens / elapsed if elapsed else 0.0,
+    }
+    stats.update(counts)
+    return stats
+
 
+def update_document_text(doc_id: int, content: str, title: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None) -> bool:
+    """Update a stored chunk's text together with its embedding so the index never goes stale."""
+    embedding = embed_texts([content])[0]
+    return update_document(doc_id, title=title, content=content, metadata=metadata, embedding=embedding)
 
-def search_rag(query: str, k: int = 5) -> List[Dict[str, Any]]:
-    """Compute embedding for the query and return top-k similar chunks from the DB."""
+
+def _search_vector(query: str, k: int, filters: Optional[Dict[str, Any]] = None, snippet_chars: Optional[int] = None) -> List[Dict[str, Any]]:
     if not OPENAI_API_KEY:
         raise RuntimeError("OPENAI_API_KEY required for embed-based search")
-    import openai
+    emb = embed_texts([query])[0]
+    if emb is None:
+        raise RuntimeError("Failed to compute query embedding")
+    return search_similar_by_embedding(emb, k=k, filters=filters, snippet_chars=snippet_chars)
 
-    openai.api_key = OPENAI_API_KEY
-    embedding_model = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
-    resp = openai.Embedding.create(input=query, model=embedding_model)
-    emb = resp["data"][0]["embedding"]
-    results = search_similar_by_embedding(emb, k=k)
-    return results
 
+def rrf_fuse(result_lists: List[List[Dict[str, Any]]], k: int, rrf_k: int = RRF_K) -> List[Dict[str, Any]]:
+    """Reciprocal rank fusion of ranked row lists (rows keyed by `id`); adds a `score` field."""
+    scores: Dict[Any, float] = {}
+    rows: Dict[Any, Dict[str, Any]] = {}
+    for results in result_lists:
+        for rank, row in enumerate(results):
+            scores[row["id"]] = scores.get(row["id"], 0.0) + 1.0 / (rrf_k + rank + 1)
+            rows.setdefault(row["id"], dict(row))
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [dict(rows[i], score=scores[i]) for i in ranked]
+
+
+_search_executor: Optional[ThreadPoolExecutor] = None
+_search_executor_lock = threading.Lock()
+
+
+def _get_search_executor() -> ThreadPoolExecutor:
+    global _search_executor
+    if _search_executor is None:
+        with _search_executor_lock:
+            if _search_executor is None:
+                _search_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hybrid-search")
+    return _search_executor
+
+
+def _leg_result(name: str, future, deadline: float) -> Optional[List[Dict[str, Any]]]:
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FutureTimeout:
+        print(f"Hybrid search: {name} leg exceeded its latency budget")
+    except Exception as e:
+        print(f"Hybrid search: {name} leg failed:", e)
+    return None
+
+
+@timed()
+def search_hybrid(
+    query: str,
+    k: int = 5,
+    candidates: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    snippet_chars: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Run lexical and vector retrieval concurrently and fuse them with reciprocal rank fusion.
+
+    Each leg has its own latency budget; if the embedding API is slow or down the lexical
+    results are returned on their own (and vice versa).
+    """
+    n = candidates or max(k * 4, 20)
+    start = time.monotonic()
+    pool = _get_search_executor()
+    lexical = pool.submit(search_lexical, query, n, filters=filters, snippet_chars=snippet_chars)
+    vector = pool.submit(_search_vector, query, n, filters=filters, snippet_chars=snippet_chars) if OPENAI_API_KEY else None
+    lex_rows = _leg_result("lexical", lexical, start + HYBRID_LEXICAL_BUDGET)
+    vec_rows = _leg_result("vector", vector, start + HYBRID_VECTOR_BUDGET)
+    legs = [r for r in (vec_rows, lex_rows) if r is not None]
+    if not legs:
+        raise RuntimeError("Both lexical and vector retrieval failed or timed out")
+    return rrf_fuse(legs, k)
+
+
+@timed()
+def search_rag(
+    query: str,
+    k: int = 5,
+    mode: Optional[str] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    full_content: bool = False,
+) -> List[Dict[str, Any]]:
+    """Return top-k chunks for the query using SEARCH_MODE (or `mode`): hybrid, vector or lexical.
+
+    `filters` are metadata predicates pushed down into SQL, e.g.
+    {"source": "manual", "group_id": [12, 15], "created_after": datetime(2024, 1, 1)}.
+    Hits carry id, title, metadata, a score/distance and a `snippet`; pass `full_content=True`
+    (or set SEARCH_SNIPPET_CHARS=0) to get the whole `content` instead.
+    """
+    mode = mode or SEARCH_MODE
+    snippet_chars = None if full_content or not SEARCH_SNIPPET_CHARS else SEARCH_SNIPPET_CHARS
+    if mode == "vector":
+        return _search_vector(query, k, filters=filters, snippet_chars=snippet_chars)
+    if mode == "lexical":
+        return search_lexical(query, k, filters=filters, snippet_chars=snippet_chars)
+    if mode == "hybrid":
+        return search_hybrid(query, k, filters=filters, snippet_chars=snippet_chars)
+    raise ValueError(f"unknown search mode {mode!r}; expected 'hybrid', 'vector' or 'lexical'")
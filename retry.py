@@ -0,0 +1,69 @@
+import random
+import time
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+_RETRYABLE_NAMES = ("RateLimit", "Timeout", "APIConnection", "ServiceUnavailable", "TryAgain")
+
+
+def _status_code(e: BaseException) -> Optional[int]:
+    for attr in ("http_status", "status_code", "status"):
+        code = getattr(e, attr, None)
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def retry_after(e: BaseException) -> Optional[float]:
+    """Seconds the API asked us to wait (Retry-After / x-ratelimit-reset headers), if any."""
+    headers = getattr(e, "headers", None) or getattr(getattr(e, "response", None), "headers", None) or {}
+    for name in ("retry-after", "Retry-After", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        value = headers.get(name) if hasattr(headers, "get") else None
+        if value is None:
+            continue
+        try:
+            return float(str(value).rstrip("s"))
+        except ValueError:
+            continue
+    return None
+
+
+def is_retryable(e: BaseException) -> bool:
+    """Rate limits, timeouts, connection errors and 5xx responses are worth retrying."""
+    code = _status_code(e)
+    if code is not None:
+        return code == 429 or code >= 500
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    return any(n in type(e).__name__ for n in _RETRYABLE_NAMES)
+
+
+def backoff_delay(attempt: int, e: Optional[BaseException] = None, base: float = 1.0, cap: float = 60.0) -> float:
+    """Delay before retry number `attempt` (0-based): the server's Retry-After if given, else jittered exponential."""
+    hinted = retry_after(e) if e is not None else None
+    if hinted is not None:
+        return min(cap, hinted)
+    return min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+
+def call_with_backoff(
+    fn: Callable[[], T],
+    retries: int,
+    base: float = 1.0,
+    cap: float = 60.0,
+    sleep: Callable[[float], None] = time.sleep,
+    label: str = "call",
+) -> T:
+    """Call `fn`, retrying retryable errors up to `retries` times with backoff_delay between attempts."""
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, e, base, cap)
+            print(f"{label} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            sleep(delay)
+            attempt += 1
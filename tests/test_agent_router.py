@@ -0,0 +1,38 @@
+import time
+
+import agent_router
+
+
+def _slow_tools(monkeypatch, delays):
+    def run_tool(tool, text):
+        time.sleep(delays[tool])
+        return {"tool": tool, "query": text}
+
+    monkeypatch.setattr(agent_router, "run_tool", run_tool)
+
+
+def test_compound_request_runs_tools_concurrently(monkeypatch):
+    _slow_tools(monkeypatch, {"db": 0.3, "telegram": 0.3})
+    start = time.perf_counter()
+    out = agent_router.route_text("delete customer 42 and list the telegram groups")
+    assert time.perf_counter() - start < 0.5
+    assert out["tool"] == "multi"
+    assert [r["tool"] for r in out["results"]] == ["db", "telegram"]
+    assert out["results"][0]["query"] == "delete customer 42"
+    assert {i for i, _ in out["routing"]["intents"]} == {"db", "telegram"}
+
+
+def test_slow_tool_returns_partial_results(monkeypatch):
+    _slow_tools(monkeypatch, {"rag": 1.0, "telegram": 0.0})
+    plan = [{"tool": "rag", "text": "refund policy"}, {"tool": "telegram", "text": "list groups"}]
+    start = time.perf_counter()
+    out = agent_router.run_plan(plan, timeouts={"rag": 0.1})
+    assert time.perf_counter() - start < 0.5
+    assert out["timed_out"] == ["rag"]
+    assert [r["tool"] for r in out["results"]] == ["telegram"]
+
+
+def test_single_intent_runs_one_tool(monkeypatch):
+    _slow_tools(monkeypatch, {"smalltalk": 0.0})
+    out = agent_router.route_text("hello")
+    assert out["tool"] == "smalltalk" and out["routing"]["intent"] == "smalltalk"
@@ -0,0 +1,149 @@
+import types
+
+import answer_cache
+from answer_cache import SemanticCache
+
+
+def _cache(version, **kwargs):
+    return SemanticCache(version_fn=lambda: version[0], **kwargs)
+
+
+def test_exact_hit_ignores_case_and_whitespace():
+    cache = _cache([0])
+    scope = cache.scope(5)
+    cache.store("How do I reset the pump?", scope, [{"id": 1}])
+    assert cache.lookup("  how do I reset   the pump? ", scope) == [{"id": 1}]
+    assert cache.stats()["exact_hits"] == 1
+
+
+def test_semantic_hit_respects_threshold_and_scope():
+    cache = _cache([0], threshold=0.9)
+    scope = cache.scope(5)
+    cache.store("reset the pump", scope, [{"id": 1}], embedding=[1.0, 0.0])
+    assert cache.lookup("pump reset steps", scope, embedding=[0.99, 0.05]) == [{"id": 1}]
+    assert cache.lookup("pump warranty", scope, embedding=[0.5, 0.86]) is None
+    other = cache.scope(5, {"source": "manual"})
+    assert cache.lookup("pump reset steps", other, embedding=[0.99, 0.05]) is None
+    stats = cache.stats()
+    assert stats["semantic_hits"] == 1 and stats["misses"] == 2
+
+
+def test_corpus_change_invalidates_entries():
+    version = [1]
+    cache = _cache(version)
+    scope = cache.scope(5)
+    cache.lookup("q", scope)
+    cache.store("q", scope, [{"id": 1}])
+    assert cache.lookup("q", scope) == [{"id": 1}]
+    version[0] = 2
+    assert cache.lookup("q", scope) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    cache = _cache([0], max_items=2, ttl=10)
+    scope = cache.scope(5)
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    for q in ("a", "b", "c"):
+        cache.store(q, scope, [{"q": q}])
+    assert cache.lookup("a", scope) is None
+    assert cache.lookup("c", scope) == [{"q": "c"}]
+    now[0] += 11
+    assert cache.lookup("c", scope) is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cached_search_rag_only_searches_on_miss(monkeypatch):
+    import rag
+
+    calls = []
+    monkeypatch.setattr(rag, "OPENAI_API_KEY", None)
+    monkeypatch.setattr(answer_cache, "_cache", _cache([0]))
+    search = lambda: calls.append(1) or [{"id": 3}]  # noqa: E731
+    assert answer_cache.cached_search_rag("q", search=search) == [{"id": 3}]
+    assert answer_cache.cached_search_rag("Q ", search=search) == [{"id": 3}]
+    assert len(calls) == 1
+
+
+def test_exact_hits_skip_the_embedding_and_slow_embeddings_are_bounded(monkeypatch):
+    import threading
+    import time
+
+    import rag
+
+    release = threading.Event()
+    embedded = []
+
+    def slow_embed(texts, **kwargs):
+        embedded.append(texts)
+        release.wait(5)
+        return [[1.0, 0.0]]
+
+    monkeypatch.setattr(rag, "OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(rag, "embed_texts", slow_embed)
+    monkeypatch.setattr(rag, "HYBRID_VECTOR_BUDGET", 0.05)
+    cache = _cache([0])
+    monkeypatch.setattr(answer_cache, "_cache", cache)
+    cache.store("q", cache.scope(5), [{"id": 1}])
+
+    assert answer_cache.cached_search_rag("Q", search=lambda: [{"id": 2}]) == [{"id": 1}]
+    assert embedded == []
+
+    start = time.monotonic()
+    assert answer_cache.cached_search_rag("other", search=lambda: [{"id": 2}]) == [{"id": 2}]
+    assert time.monotonic() - start < 1
+    assert embedded == [["other"]]
+    release.set()
+
+
+def test_results_searched_across_a_corpus_change_are_not_cached(monkeypatch):
+    import rag
+
+    version = [1]
+    monkeypatch.setattr(rag, "OPENAI_API_KEY", None)
+    monkeypatch.setattr(answer_cache, "_cache", _cache(version))
+
+    def search_during_ingest():
+        version[0] += 1  # a document write commits while the search runs
+        return [{"id": 1}]
+
+    answer_cache.cached_search_rag("q", search=search_during_ingest)
+    assert answer_cache.get_answer_cache().stats()["items"] == 0
+    answer_cache.cached_search_rag("q", search=lambda: [{"id": 2}])
+    assert answer_cache.cached_search_rag("q", search=lambda: [{"id": 3}]) == [{"id": 2}]
+
+
+def test_search_between_trigger_and_commit_is_not_served_after_commit(monkeypatch):
+    from contextlib import contextmanager
+
+    import db
+    import rag
+
+    seq = [1]
+    committed = [False]
+
+    class Cursor:
+        def execute(self, sql, params=None):
+            if "nextval('corpus_version_seq')" in sql:
+                seq[0] += 1
+
+        def close(self):
+            pass
+
+    class Pool:
+        @contextmanager
+        def connection(self):
+            yield types.SimpleNamespace(cursor=Cursor)
+            committed[0] = True
+
+    monkeypatch.setattr(db, "get_pool", lambda: Pool())
+    monkeypatch.setattr(rag, "OPENAI_API_KEY", None)
+    monkeypatch.setattr(answer_cache, "_cache", _cache(seq))
+    search = lambda: [{"id": "new" if committed[0] else "old"}]  # noqa: E731
+
+    with db.connection(corpus_write=True) as conn:
+        conn.cursor().execute("SELECT nextval('corpus_version_seq')")  # the statement trigger
+        # The write is not visible yet, but the version has already moved.
+        assert answer_cache.cached_search_rag("q", search=search) == [{"id": "old"}]
+    assert answer_cache.cached_search_rag("q", search=search) == [{"id": "new"}]
@@ -0,0 +1,25 @@
+import numpy as np
+
+from audio_preprocess import trim_silence
+from audio_stream import SAMPLE_RATE
+
+
+def tone(seconds, amplitude=0.3):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (amplitude * 32767 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+
+
+def silence(seconds):
+    return np.zeros(int(seconds * SAMPLE_RATE), dtype=np.int16)
+
+
+def test_trim_silence_drops_edges_and_shortens_pauses():
+    clip = np.concatenate([silence(2.0), tone(1.0), silence(3.0), tone(1.0), silence(2.0)])
+    out = trim_silence(clip, padding_ms=90, max_pause_ms=600)
+    assert out.dtype == np.int16
+    assert 2.5 <= len(out) / SAMPLE_RATE <= 3.0
+
+
+def test_trim_silence_edge_cases():
+    assert len(trim_silence(silence(1.0))) == 0
+    assert len(trim_silence(tone(0.5))) == len(tone(0.5))
@@ -0,0 +1,37 @@
+import gc
+
+from audio_store import SessionAudioStore, get_session_store
+
+
+def test_same_bytes_share_one_clip_and_results():
+    store = SessionAudioStore()
+    key = store.put(b"RIFF-one", "a.wav")
+    assert store.put(b"RIFF-one", "again.wav") == key
+    calls = []
+    transcribe = lambda clip: calls.append(clip.read()) or "hello"  # noqa: E731
+    assert store.cached(key, "transcript", transcribe) == "hello"
+    assert store.cached(key, "transcript", transcribe) == "hello"
+    assert calls == [b"RIFF-one"]
+    assert store.stats()["clips"] == 1
+
+
+def test_sessions_are_isolated_and_bounded():
+    a, b = {}, {}
+    store_a, store_b = get_session_store(a), get_session_store(b)
+    assert get_session_store(a) is store_a and store_a is not store_b
+    key = store_a.put(b"clip", "a.wav")
+    assert store_b.get(key) is None
+    small = SessionAudioStore(max_clips=2)
+    keys = [small.put(bytes([i]) * 10) for i in range(3)]
+    assert small.get(keys[0]) is None and small.read(keys[2]) == bytes([2]) * 10
+
+
+def test_large_clips_spool_to_disk_and_close_with_the_session():
+    session = {}
+    store = get_session_store(session)
+    store.spool_bytes = 16
+    clip = store.get(store.put(b"x" * 100))
+    assert clip.on_disk
+    del session, store
+    gc.collect()
+    assert clip._file.closed
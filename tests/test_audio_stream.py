@@ -0,0 +1,69 @@
+import numpy as np
+
+from audio_stream import SAMPLE_RATE, AudioRingBuffer, StreamingTranscriber, VADSegmenter
+
+
+def tone(seconds, amplitude=0.3):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+
+
+def silence(seconds):
+    return np.zeros(int(seconds * SAMPLE_RATE), dtype=np.float32)
+
+
+def test_segments_split_on_pauses():
+    vad = VADSegmenter(silence_ms=300, min_speech_ms=90)
+    segs = vad.feed(np.concatenate([silence(0.5), tone(1.0), silence(0.6), tone(0.5)]))
+    assert len(segs) == 1
+    assert 1.0 <= len(segs[0]) / SAMPLE_RATE < 1.6
+    tail = vad.flush()
+    assert tail is not None and len(tail) / SAMPLE_RATE >= 0.5
+
+
+def test_noise_is_dropped():
+    vad = VADSegmenter(min_speech_ms=250)
+    assert vad.feed(np.concatenate([tone(0.06), silence(1.0)])) == []
+    assert vad.flush() is None
+
+
+def test_streaming_transcriber_joins_segments():
+    calls = []
+
+    def fake(samples, sr):
+        calls.append(len(samples))
+        return f"seg{len(calls)}"
+
+    st = StreamingTranscriber(transcribe_fn=fake, segmenter=VADSegmenter(silence_ms=300, min_speech_ms=90))
+    for chunk in np.array_split(np.concatenate([tone(0.5), silence(0.5), tone(0.5)]), 50):
+        st.feed((chunk * 32767).astype(np.int16))
+    assert st.finish(timeout=5) == "seg1 seg2"
+
+
+def test_ring_buffer_keeps_newest_audio_in_order():
+    buf = AudioRingBuffer(max_seconds=10 / SAMPLE_RATE)
+    buf.write(np.arange(6, dtype=np.int16))
+    buf.write(np.arange(6, 13, dtype=np.int16))
+    older, newer = buf.views()
+    assert np.concatenate([older, newer]).tolist() == list(range(3, 13))
+    assert buf.dropped_samples == 3
+    buf.write(np.arange(100, 125, dtype=np.int16))
+    older, newer = buf.views()
+    assert np.concatenate([older, newer]).tolist() == list(range(115, 125))
+
+
+def test_ring_buffer_converts_float_to_int16():
+    buf = AudioRingBuffer(max_seconds=1)
+    buf.write(np.array([0.0, 1.0, -2.0], dtype=np.float32))
+    older, _ = buf.views()
+    assert older.dtype == np.int16
+    assert older.tolist() == [0, 32767, -32767]
+
+
+def test_ring_buffer_snapshot_is_not_overwritten_by_later_writes():
+    buf = AudioRingBuffer(max_seconds=4 / SAMPLE_RATE)
+    buf.write(np.arange(4, dtype=np.int16))
+    older, newer = buf.views()
+    buf.write(np.arange(10, 14, dtype=np.int16))
+    buf.clear()
+    assert np.concatenate([older, newer]).tolist() == [0, 1, 2, 3]
@@ -0,0 +1,114 @@
+import json
+
+import batch_transcribe
+
+
+class RateLimitError(Exception):
+    headers = {"retry-after": "0"}
+
+
+def _write(path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def _rows(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_inputs_from_directory_and_manifests(tmp_path):
+    _write(tmp_path / "calls" / "b.wav", b"b")
+    _write(tmp_path / "calls" / "2024" / "a.mp3", b"a")
+    _write(tmp_path / "calls" / "notes.txt", b"n")
+    paths = [i["path"] for i in batch_transcribe.iter_inputs(str(tmp_path / "calls"))]
+    assert [p.split("calls")[1] for p in paths] == ["/b.wav", "/2024/a.mp3"]
+
+    (tmp_path / "list.txt").write_text("# archive\ncalls/b.wav\n\n")
+    assert [i["path"] for i in batch_transcribe.iter_inputs(str(tmp_path / "list.txt"))] == [str(tmp_path / "calls" / "b.wav")]
+
+    (tmp_path / "m.jsonl").write_text(json.dumps({"path": "calls/b.wav", "title": "Call B", "metadata": {"agent": 7}}) + "\n")
+    (item,) = batch_transcribe.iter_inputs(str(tmp_path / "m.jsonl"))
+    assert item["title"] == "Call B" and item["metadata"] == {"agent": 7}
+
+
+def test_batch_streams_results_and_skips_by_hash(tmp_path):
+    a = _write(tmp_path / "in" / "a.wav", b"first call")
+    _write(tmp_path / "in" / "copy-of-a.wav", b"first call")
+    _write(tmp_path / "in" / "b.wav", b"second call")
+    out = str(tmp_path / "out.jsonl")
+    calls = []
+
+    def fake_api(path):
+        calls.append(path)
+        return "text of " + path.rsplit("/", 1)[1]
+
+    stats = batch_transcribe.run_batch(batch_transcribe.iter_inputs(str(tmp_path / "in")), out, backend="api", api_fn=fake_api)
+    assert stats["transcribed"] == 2 and stats["skipped"] == 1
+    rows = _rows(out)
+    assert {r["path"] for r in rows} == {a, str(tmp_path / "in" / "b.wav")}
+    assert all(r["backend"] == "api" and r["sha256"] for r in rows)
+
+    # A second run (e.g. after an interruption) transcribes nothing again.
+    stats = batch_transcribe.run_batch(batch_transcribe.iter_inputs(str(tmp_path / "in")), out, backend="api", api_fn=fake_api)
+    assert stats["transcribed"] == 0 and stats["skipped"] == 3
+    assert len(calls) == 2 and len(_rows(out)) == 2
+
+
+def test_failed_files_are_recorded_and_retried_next_run(tmp_path):
+    _write(tmp_path / "in" / "a.wav", b"a")
+    out = str(tmp_path / "out.jsonl")
+
+    def broken(path):
+        raise ValueError("unsupported format")
+
+    stats = batch_transcribe.run_batch(batch_transcribe.iter_inputs(str(tmp_path / "in")), out, backend="api", api_fn=broken)
+    assert stats["failed"] == 1 and "unsupported format" in _rows(out)[0]["error"]
+
+    stats = batch_transcribe.run_batch(batch_transcribe.iter_inputs(str(tmp_path / "in")), out, backend="api", api_fn=lambda p: "ok")
+    assert stats["transcribed"] == 1 and _rows(out)[-1]["text"] == "ok"
+
+
+def test_api_calls_back_off_on_rate_limits(monkeypatch):
+    attempts, sleeps = [], []
+
+    def flaky(path):
+        attempts.append(path)
+        if len(attempts) < 3:
+            raise RateLimitError()
+        return "hello"
+
+    monkeypatch.setattr(batch_transcribe.transcribe, "_transcribe_openai", flaky)
+    assert batch_transcribe.transcribe_api("x.wav", sleep=sleeps.append) == "hello"
+    assert sleeps == [0.0, 0.0]
+
+
+def test_transcripts_are_queued_for_ingestion(tmp_path, monkeypatch):
+    import ingest_worker
+
+    _write(tmp_path / "in" / "call.wav", b"call")
+    queued = []
+    monkeypatch.setattr(ingest_worker, "enqueue", lambda title, text, md, doc_key=None: queued.append((title, text, md, doc_key)) or 41)
+
+    out = str(tmp_path / "out.jsonl")
+    batch_transcribe.run_batch(batch_transcribe.iter_inputs(str(tmp_path / "in")), out, backend="api", ingest="queue", api_fn=lambda p: "hi")
+    ((title, text, md, doc_key),) = queued
+    assert title == "call" and text == "hi" and md["source"] == "transcript"
+    assert doc_key.startswith("audio:") and _rows(out)[0]["ingested"] == 41
+
+
+def test_openai_transcription_takes_paths_and_file_objects(tmp_path, monkeypatch):
+    import sys
+    import types
+
+    sent = []
+    fake = types.SimpleNamespace(api_key=None)
+    fake.Audio = types.SimpleNamespace(transcribe=lambda model, f: sent.append((f.name, f.read())) or {"text": "hi"})
+    monkeypatch.setitem(sys.modules, "openai", fake)
+
+    path = _write(tmp_path / "a.wav", b"RIFF")
+    assert batch_transcribe.transcribe._transcribe_openai(path) == "hi"
+    monkeypatch.setattr(batch_transcribe.transcribe, "OPENAI_API_KEY", "sk-test")
+    assert batch_transcribe.transcribe.transcribe_bytes(b"ogg", "clip.ogg") == "hi"
+    assert sent == [(path, b"RIFF"), ("clip.ogg", b"ogg")]
@@ -0,0 +1,42 @@
+from chunker import chunk_stream
+
+
+def words(n, start=0):
+    return " ".join(f"w{i}" for i in range(start, start + n))
+
+
+def test_chunks_respect_token_budget_and_sentences():
+    text = " ".join(f"Sentence number {i} is here." for i in range(200))
+    chunks = list(chunk_stream([text], max_tokens=50, overlap_tokens=10))
+    assert len(chunks) > 1
+    for c in chunks:
+        assert len(c) // 4 <= 60
+        assert c.endswith(".")
+        assert c.startswith("Sentence")
+
+
+def test_overlap_repeats_trailing_sentence():
+    text = " ".join(f"Sentence number {i} is here." for i in range(40))
+    chunks = list(chunk_stream([text], max_tokens=30, overlap_tokens=8))
+    last_sentence = chunks[0].split(". ")[-1]
+    assert chunks[1].startswith(last_sentence.rstrip("."))
+
+
+def test_streamed_pieces_match_whole_text():
+    paras = [f"Paragraph {p}. " + " ".join(f"Line {p}-{i} text." for i in range(30)) for p in range(20)]
+    text = "\n\n".join(paras)
+    pieces = [text[i : i + 37] for i in range(0, len(text), 37)]
+    whole = list(chunk_stream([text], max_tokens=60, overlap_tokens=10))
+    streamed = list(chunk_stream(pieces, max_tokens=60, overlap_tokens=10, block_size=500))
+    assert streamed == whole
+    assert "\n\n" in "".join(whole)
+
+
+def test_oversized_sentence_is_split():
+    chunks = list(chunk_stream([words(2000)], max_tokens=100, overlap_tokens=0))
+    assert len(chunks) > 5
+    assert "".join(chunks).replace(" ", "") == words(2000).replace(" ", "")
+
+
+def test_empty_input():
+    assert list(chunk_stream(["", "   \n\n  "])) == []
@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+from db import ConnectionPool, PoolTimeout
+
+
+class FakeConn:
+    def __init__(self):
+        self.closed = 0
+        self.status = TRANSACTION_STATUS_IDLE
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        raise AssertionError("health check not expected")
+
+    def get_transaction_status(self):
+        return self.status
+
+    def commit(self):
+        self.commits += 1
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+def make_pool(**kwargs):
+    made = []
+
+    def connect():
+        made.append(FakeConn())
+        return made[-1]
+
+    opts = dict(minconn=0, maxconn=2, max_lifetime=0, timeout=0.05, health_check_idle=3600)
+    opts.update(kwargs)
+    return ConnectionPool(connect, **opts), made
+
+
+def test_connections_are_reused():
+    pool, made = make_pool()
+    with pool.connection() as c1:
+        pass
+    with pool.connection() as c2:
+        pass
+    assert c1 is c2
+    assert len(made) == 1
+    stats = pool.stats()
+    assert stats["checkouts"] == 2
+    assert stats["in_use"] == 0
+    assert stats["idle"] == 1
+
+
+def test_exhausted_pool_times_out():
+    pool, _ = make_pool(maxconn=1)
+    conn = pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    pool.putconn(conn)
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_waiter_gets_returned_connection():
+    pool, made = make_pool(maxconn=1, timeout=2)
+    conn = pool.getconn()
+    got = []
+    t = threading.Thread(target=lambda: got.append(pool.getconn()))
+    t.start()
+    pool.putconn(conn)
+    t.join()
+    assert got == [conn]
+    assert len(made) == 1
+
+
+def test_expired_connection_is_recycled():
+    pool, made = make_pool(max_lifetime=1e-9)
+    with pool.connection():
+        pass
+    with pool.connection():
+        pass
+    assert len(made) == 2
+    assert made[0].closed
+
+
+def test_error_rolls_back_and_open_transaction_is_reset():
+    pool, made = make_pool()
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            conn.status = TRANSACTION_STATUS_INTRANS
+            raise ValueError("boom")
+    assert made[0].rollbacks == 1
+    assert made[0].commits == 0
+    assert pool.stats()["idle"] == 1
@@ -0,0 +1,50 @@
+from embedding_cache import EmbeddingCache, text_hash
+
+
+def test_normalized_text_shares_key():
+    assert text_hash("hello   world\n") == text_hash(" hello world")
+    assert text_hash("hello world") != text_hash("Hello world")
+
+
+def test_memory_hits_and_misses():
+    cache = EmbeddingCache(max_items=10, ttl=0, persist=False)
+    assert cache.get_many("m", ["a", "b"]) == [None, None]
+    cache.put_many("m", ["a"], [[0.5, 0.25]])
+    assert cache.get_many("m", ["a", "b"]) == [[0.5, 0.25], None]
+    assert cache.get_many("other-model", ["a"]) == [None]
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 4
+
+
+def test_lru_eviction():
+    cache = EmbeddingCache(max_items=2, ttl=0, persist=False)
+    cache.put_many("m", ["a", "b"], [[1.0], [2.0]])
+    cache.get_many("m", ["a"])
+    cache.put_many("m", ["c"], [[3.0]])
+    assert cache.get_many("m", ["a", "b", "c"]) == [[1.0], None, [3.0]]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_persistent_tier_is_pruned_every_n_writes(monkeypatch):
+    import threading
+
+    import db
+
+    pruned = threading.Event()
+    calls = []
+    monkeypatch.setattr(db, "put_cached_embeddings", lambda model, items: None)
+
+    def fake_prune(max_age_seconds=None, max_rows=None):
+        calls.append(max_rows)
+        pruned.set()
+        return 7
+
+    monkeypatch.setattr(db, "prune_embedding_cache", fake_prune)
+    cache = EmbeddingCache(max_items=10, ttl=0, persist=True, prune_every=3)
+    cache.put_many("m", ["a", "b"], [[1.0], [2.0]])
+    assert calls == []
+    cache.put_many("m", ["c"], [[3.0]])
+    assert pruned.wait(2)
+    cache._prune_thread.join(2)
+    assert len(calls) == 1 and cache.stats()["pruned"] == 7
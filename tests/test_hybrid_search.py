@@ -0,0 +1,32 @@
+import time
+
+import rag
+
+
+def test_rrf_prefers_documents_found_by_both_legs():
+    vector = [{"id": 1}, {"id": 2}, {"id": 3}]
+    lexical = [{"id": 3}, {"id": 4}]
+    fused = rag.rrf_fuse([vector, lexical], k=3)
+    assert [r["id"] for r in fused] == [3, 1, 2]
+    assert fused[0]["score"] > fused[1]["score"]
+
+
+def test_hybrid_falls_back_to_lexical_when_vector_is_slow(monkeypatch):
+    def slow_vector(query, k, **kwargs):
+        time.sleep(0.5)
+        return [{"id": 99}]
+
+    monkeypatch.setattr(rag, "OPENAI_API_KEY", "test")
+    monkeypatch.setattr(rag, "HYBRID_VECTOR_BUDGET", 0.05)
+    monkeypatch.setattr(rag, "_search_vector", slow_vector)
+    monkeypatch.setattr(rag, "search_lexical", lambda query, k, **kwargs: [{"id": 7, "title": "SKU AB-1234"}])
+    start = time.perf_counter()
+    results = rag.search_hybrid("AB-1234 pump", k=5)
+    assert time.perf_counter() - start < 0.3
+    assert [r["id"] for r in results] == [7]
+
+
+def test_hybrid_without_api_key_is_lexical_only(monkeypatch):
+    monkeypatch.setattr(rag, "OPENAI_API_KEY", None)
+    monkeypatch.setattr(rag, "search_lexical", lambda query, k, **kwargs: [{"id": 1}, {"id": 2}])
+    assert [r["id"] for r in rag.search_hybrid("anything", k=1)] == [1]
@@ -0,0 +1,151 @@
+import pytest
+
+import ingest_worker
+import rag
+import retry
+
+
+class RateLimitError(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__("rate limited")
+        self.headers = {"retry-after": retry_after} if retry_after is not None else {}
+
+
+class FakeQueue:
+    """Stands in for the ingestion_jobs helpers in db.py."""
+
+    def __init__(self, owner="w1"):
+        self.owner = owner
+        self.progress = []
+        self.finished = []
+
+    def update(self, job_id, worker_id, done, total):
+        self.progress.append((done, total))
+        return worker_id == self.owner
+
+    def finish(self, job_id, worker_id, stats=None, error=None, retry_in=None):
+        self.finished.append({"stats": stats, "error": error, "retry_in": retry_in})
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    q = FakeQueue()
+    monkeypatch.setattr(ingest_worker, "update_ingestion_progress", q.update)
+    monkeypatch.setattr(ingest_worker, "finish_ingestion_job", q.finish)
+    return q
+
+
+def test_retryable_errors():
+    assert retry.is_retryable(RateLimitError())
+    assert retry.is_retryable(TimeoutError())
+    assert not retry.is_retryable(ValueError("bad input"))
+    assert ingest_worker.backoff_delay(0, RateLimitError("7")) == 7.0
+    assert 0 < ingest_worker.backoff_delay(3) <= ingest_worker.INGEST_BACKOFF_MAX
+
+
+def test_embed_with_backoff_honours_retry_after():
+    calls, sleeps = [], []
+
+    def flaky(texts, token_counts=None, raise_errors=False):
+        calls.append(list(texts))
+        if len(calls) < 3:
+            raise RateLimitError("2")
+        return [[1.0] for _ in texts]
+
+    out = ingest_worker.embed_with_backoff(["a", "b"], [1, 1], embed=flaky, sleep=sleeps.append)
+    assert out == [[1.0], [1.0]]
+    assert sleeps == [2.0, 2.0]
+
+
+def test_embed_with_backoff_gives_up_on_permanent_errors():
+    def broken(texts, token_counts=None, raise_errors=False):
+        raise ValueError("invalid input")
+
+    with pytest.raises(ValueError):
+        ingest_worker.embed_with_backoff(["a"], [1], embed=broken, sleep=lambda s: None)
+
+
+def test_progress_is_recorded_per_batch(queue):
+    embed = lambda texts, token_counts=None, raise_errors=False: [[float(len(t))] for t in texts]  # noqa: E731
+    fn = ingest_worker.progress_embedder(1, "w1", batch_chunks=2, embed=embed)
+    out = fn(["a", "bb", "ccc", "dddd", "eeeee"], [1] * 5)
+    assert out == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert queue.progress == [(0, 5), (2, 5), (4, 5), (5, 5)]
+
+
+def test_lost_lease_stops_the_job(queue, monkeypatch):
+    synced = []
+    monkeypatch.setattr(rag, "chunk_text", lambda text: ["one", "two"])
+    monkeypatch.setattr(rag, "get_document_chunk_hashes", lambda key: [])
+    monkeypatch.setattr(rag, "sync_document_chunks", lambda *a, **k: synced.append(a))
+    job = {"id": 3, "doc_key": "d", "title": "Doc", "content": "x", "metadata": {}, "attempts": 1, "chunks_done": 0}
+
+    assert ingest_worker.process_job(job, "someone-else") is None
+    assert synced == [] and queue.finished == []
+
+
+def test_failed_job_is_requeued_then_failed(queue, monkeypatch):
+    def boom(*a, **k):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(rag, "embed_and_store", boom)
+    job = {"id": 4, "doc_key": "d", "title": "Doc", "content": "x", "metadata": {}, "attempts": 1, "chunks_done": 0}
+    ingest_worker.process_job(job, "w1")
+    assert queue.finished[-1]["retry_in"] is not None and "db down" in queue.finished[-1]["error"]
+
+    job["attempts"] = ingest_worker.INGEST_MAX_ATTEMPTS
+    ingest_worker.process_job(job, "w1")
+    assert queue.finished[-1]["retry_in"] is None and queue.finished[-1]["error"]
+
+
+def test_successful_job_records_stats(queue, monkeypatch):
+    monkeypatch.setattr(rag, "chunk_text", lambda text: ["one", "two", "three"])
+    monkeypatch.setattr(rag, "get_document_chunk_hashes", lambda key: [])
+    monkeypatch.setattr(rag, "embed_texts", lambda texts, model=None, token_counts=None, raise_errors=False: [[1.0] for _ in texts])
+    monkeypatch.setattr(rag, "sync_document_chunks", lambda key, rows, embs, embed_missing=None: {"inserted": len(rows), "updated": 0, "unchanged": 0, "deleted": 0})
+    job = {"id": 5, "doc_key": "d", "title": "Doc", "content": "x", "metadata": {}, "attempts": 1, "chunks_done": 0}
+
+    stats = ingest_worker.process_job(job, "w1")
+    assert stats["inserted"] == 3 and stats["embedded"] == 3
+    assert queue.finished == [{"stats": stats, "error": None, "retry_in": None}]
+    assert queue.progress[-1] == (3, 3)
+
+
+def test_worker_claims_with_the_attempt_limit(monkeypatch):
+    claims = []
+    monkeypatch.setattr(ingest_worker, "claim_ingestion_job", lambda *a, **k: claims.append((a, k)))
+    assert ingest_worker.worker_loop("w1", once=True) == 0
+    assert claims == [(("w1", ingest_worker.INGEST_LEASE_SECONDS), {"max_attempts": ingest_worker.INGEST_MAX_ATTEMPTS})]
+
+
+def test_stale_jobs_out_of_attempts_are_failed_not_reclaimed(monkeypatch):
+    import db
+
+    executed = []
+
+    class Cursor:
+        def execute(self, sql, params=None):
+            executed.append((sql, params))
+
+        def fetchone(self):
+            return None
+
+        def close(self):
+            pass
+
+    class Ctx:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def cursor(self, **kwargs):
+            return Cursor()
+
+    monkeypatch.setattr(db, "connection", lambda: Ctx())
+    assert db.claim_ingestion_job("w1", 30, max_attempts=5) is None
+    (fail_sql, fail_params), (claim_sql, _) = executed
+    assert "SET status = 'failed'" in fail_sql and "attempts >= %s" in fail_sql
+    assert fail_params == (5, 30)
+    assert claim_sql.startswith("UPDATE ingestion_jobs SET status = 'running'")
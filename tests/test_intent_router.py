@@ -0,0 +1,30 @@
+from intent_router import IntentRouter, classify_intent
+
+
+def test_noun_update_is_not_a_db_write():
+    assert classify_intent("what was the latest update")["intent"] == "rag"
+    assert classify_intent("update the account for acme corp")["intent"] == "db"
+
+
+def test_verb_follows_its_object():
+    assert classify_intent("delete telegram group 88")["intent"] == "telegram"
+    assert classify_intent("delete customer 42")["intent"] == "db"
+
+
+def test_multiple_intents_are_reported():
+    out = classify_intent("delete customer 42 and list the telegram groups")
+    assert {i for i, _ in out["intents"]} == {"db", "telegram"}
+    assert out["intents"][0][0] == out["intent"]
+    assert 0 < out["confidence"] <= 1
+
+
+def test_smalltalk_skips_rag():
+    assert classify_intent("hi there")["intent"] == "smalltalk"
+
+
+def test_centroid_fallback_without_keyword_hits():
+    router = IntentRouter(keywords={}, examples={"db": ["delete customer"], "rag": ["reset the pump"]})
+    out = router.classify("reset pump")
+    assert out["source"] == "centroid" and out["intent"] == "rag"
+    no_fallback = IntentRouter(keywords={}, examples=None).classify("reset pump")
+    assert no_fallback["intent"] == "rag" and no_fallback["source"] == "keywords"
@@ -0,0 +1,25 @@
+import json
+from datetime import datetime
+
+from db import _metadata_filter_sql
+
+
+def test_no_filters():
+    assert _metadata_filter_sql(None) == ("", [])
+
+
+def test_scalars_become_one_containment_predicate():
+    sql, params = _metadata_filter_sql({"source": "manual", "group_id": 12})
+    assert sql == "metadata @> %s::jsonb"
+    assert json.loads(params[0]) == {"source": "manual", "group_id": 12}
+
+
+def test_lists_and_date_ranges():
+    after = datetime(2024, 1, 1)
+    sql, params = _metadata_filter_sql({"group_id": [1, 2], "created_after": after, "team": "ops"})
+    assert sql == "metadata @> %s::jsonb AND (metadata @> %s::jsonb OR metadata @> %s::jsonb) AND created_at >= %s"
+    assert params == ['{"team": "ops"}', '{"group_id": 1}', '{"group_id": 2}', after]
+
+
+def test_empty_list_matches_nothing():
+    assert _metadata_filter_sql({"group_id": []}) == ("FALSE", [])
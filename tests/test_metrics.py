@@ -0,0 +1,39 @@
+import pytest
+
+import metrics
+
+
+def setup_function():
+    metrics.reset()
+
+
+def test_percentiles_over_window():
+    for ms in range(1, 101):
+        metrics.observe("stage", ms / 1000)
+    row = metrics.snapshot()["stage"]
+    assert row["count"] == 100
+    assert row["p50"] == pytest.approx(0.050)
+    assert row["p95"] == pytest.approx(0.095)
+    assert row["p99"] == pytest.approx(0.099)
+
+
+def test_nested_spans_record_parent_and_errors():
+    @metrics.timed("outer")
+    def outer():
+        with metrics.span("inner"):
+            pass
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        outer()
+    spans = metrics.recent_spans()
+    assert [s["name"] for s in spans] == ["outer", "inner"]
+    assert spans[1]["parent"] == "outer"
+    assert metrics.snapshot()["outer"]["errors"] == 1
+
+
+def test_prometheus_text():
+    metrics.observe("db.get_document", 0.002)
+    text = metrics.render_prometheus()
+    assert 'voice_agent_span_seconds{span="db.get_document",quantile="0.99"} 0.002000' in text
+    assert 'voice_agent_span_seconds_count{span="db.get_document"} 1' in text
@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import pytest
+
+from pipeline import StageTimeout, run_stage
+
+
+def test_run_stage_returns_result_and_records_timing():
+    timings = {}
+    out = asyncio.run(run_stage("embed", lambda x: x * 2, 21, timeout=1, timings=timings))
+    assert out == 42
+    assert "embed" in timings
+
+
+def test_run_stage_times_out():
+    with pytest.raises(StageTimeout) as exc:
+        asyncio.run(run_stage("search", time.sleep, 0.5, timeout=0.05))
+    assert exc.value.stage == "search"
+
+
+def test_slow_stages_run_concurrently():
+    async def many():
+        return await asyncio.gather(*(run_stage("tool", time.sleep, 0.2, timeout=2) for _ in range(5)))
+
+    start = time.perf_counter()
+    asyncio.run(many())
+    assert time.perf_counter() - start < 0.8
+
+
+def test_known_transcript_skips_transcription_but_reruns_routing(monkeypatch):
+    import pipeline
+    import transcribe
+
+    routed = []
+
+    async def fake_answer(text, timeouts=None, timings=None):
+        routed.append(text)
+        return {"tool": "rag", "results": [len(routed)]}
+
+    def no_transcription(*args):
+        raise AssertionError("clip was transcribed again")
+
+    monkeypatch.setattr(pipeline, "answer_text", fake_answer)
+    monkeypatch.setattr(transcribe, "transcribe_bytes", no_transcription)
+    first = asyncio.run(pipeline.handle_voice_request(None, transcript="reset the pump"))
+    second = asyncio.run(pipeline.handle_voice_request(None, transcript="reset the pump"))
+    assert routed == ["reset the pump", "reset the pump"]
+    assert first["result"]["results"] == [1] and second["result"]["results"] == [2]
+    assert "transcribe" not in second["timings"] and second["audio"] is None
+
+
+def test_failing_search_falls_back_to_recent_documents(monkeypatch):
+    import answer_cache
+    import db
+    import intent_router
+    import pipeline
+    import rag
+
+    def broken_search(*args, **kwargs):
+        raise ConnectionError("database unavailable")
+
+    monkeypatch.setattr(intent_router, "classify_intent", lambda text: {"intent": "rag", "intents": ["rag"]})
+    monkeypatch.setattr(rag, "SEARCH_MODE", "hybrid")
+    monkeypatch.setattr(answer_cache, "cached_search_rag", broken_search)
+    monkeypatch.setattr(db, "list_documents", lambda limit=10: [{"id": 1}][:limit])
+    out = asyncio.run(pipeline.answer_text("pump manual"))
+    assert out["error"] == "database unavailable"
+    assert out["fallback_docs"] == [{"id": 1}]
+
+
+def test_slow_fallback_is_bounded(monkeypatch):
+    import answer_cache
+    import db
+    import intent_router
+    import pipeline
+    import rag
+
+    def broken_search(*args, **kwargs):
+        raise ConnectionError("database unavailable")
+
+    monkeypatch.setattr(intent_router, "classify_intent", lambda text: {"intent": "rag", "intents": ["rag"]})
+    monkeypatch.setattr(rag, "SEARCH_MODE", "hybrid")
+    monkeypatch.setattr(answer_cache, "cached_search_rag", broken_search)
+    monkeypatch.setattr(db, "list_documents", lambda limit=10: time.sleep(0.5))
+    monkeypatch.setitem(pipeline.STAGE_TIMEOUTS, "fallback", 0.05)
+    start = time.perf_counter()
+    out = asyncio.run(pipeline.answer_text("pump manual"))
+    assert time.perf_counter() - start < 0.4
+    assert out["error"] == "database unavailable" and "fallback_docs" not in out
+
+
+def test_vector_mode_exact_cache_hit_skips_the_embedding(monkeypatch):
+    import answer_cache
+    import intent_router
+    import pipeline
+    import rag
+
+    def no_embedding(*args, **kwargs):
+        raise AssertionError("query was embedded")
+
+    cache = answer_cache.SemanticCache(version_fn=lambda: 0)
+    cache.store("pump manual", cache.scope(pipeline.RAG_TOP_K), [{"id": 7}])
+    monkeypatch.setattr(answer_cache, "_cache", cache)
+    monkeypatch.setattr(intent_router, "classify_intent", lambda text: {"intent": "rag", "intents": ["rag"]})
+    monkeypatch.setattr(rag, "SEARCH_MODE", "vector")
+    monkeypatch.setattr(rag, "embed_texts", no_embedding)
+    out = asyncio.run(pipeline.answer_text("Pump manual"))
+    assert out["results"] == [{"id": 7}]
+    assert cache.stats()["exact_hits"] == 1 and cache.stats()["misses"] == 0
@@ -0,0 +1,16 @@
+from rag import batch_by_tokens
+
+
+def test_batches_respect_token_budget():
+    batches = list(batch_by_tokens([100, 100, 100, 50], max_tokens=250, max_inputs=10))
+    assert batches == [[0, 1], [2, 3]]
+
+
+def test_batches_respect_input_cap():
+    batches = list(batch_by_tokens([1] * 5, max_tokens=1000, max_inputs=2))
+    assert batches == [[0, 1], [2, 3], [4]]
+
+
+def test_oversized_input_gets_its_own_batch():
+    batches = list(batch_by_tokens([10, 500, 10], max_tokens=100, max_inputs=10))
+    assert batches == [[0], [1], [2]]
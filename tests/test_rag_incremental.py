@@ -0,0 +1,31 @@
+import rag
+from embedding_cache import text_hash
+
+
+def test_only_new_chunks_are_embedded(monkeypatch):
+    chunks = ["alpha section", "beta section", "gamma section", "alpha section"]
+    embedded = []
+    synced = {}
+
+    monkeypatch.setattr(rag, "chunk_text", lambda text: list(chunks))
+    monkeypatch.setattr(rag, "get_document_chunk_hashes", lambda key: [text_hash("alpha section"), text_hash("old section")])
+
+    def fake_embed(texts, model=None, token_counts=None):
+        embedded.extend(texts)
+        return [[float(len(t))] for t in texts]
+
+    def fake_sync(doc_key, rows, embeddings, embed_missing=None):
+        synced.update(doc_key=doc_key, rows=rows, embeddings=embeddings)
+        return {"inserted": 2, "updated": 0, "unchanged": 2, "deleted": 1}
+
+    monkeypatch.setattr(rag, "embed_texts", fake_embed)
+    monkeypatch.setattr(rag, "sync_document_chunks", fake_sync)
+
+    stats = rag.embed_and_store("Manual", "ignored", {"source": "upload"})
+
+    assert embedded == ["beta section", "gamma section"]
+    assert synced["doc_key"] == "Manual"
+    assert [r["chunk_index"] for r in synced["rows"]] == [0, 1, 2, 3]
+    assert synced["rows"][3]["content_hash"] == text_hash("alpha section")
+    assert set(synced["embeddings"]) == {text_hash("beta section"), text_hash("gamma section")}
+    assert stats["deleted"] == 1 and stats["embedded"] == 2
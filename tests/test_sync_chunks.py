@@ -0,0 +1,148 @@
+import os
+import uuid
+
+import pytest
+
+import db
+from embedding_cache import text_hash
+
+
+class FakeDB:
+    """Just enough of a cursor for db.sync_document_chunks: serves the stored rows, records writes."""
+
+    def __init__(self, stored):
+        # stored: [(content, chunk_index, has_embedding)]
+        self.rows = [
+            (i + 1, text_hash(content), idx, f"Doc - chunk {idx}", {"chunk_index": idx}, has)
+            for i, (content, idx, has) in enumerate(stored)
+        ]
+        self.executed = []
+        self.values = []
+        self.rowcount = 0
+        self._result = []
+        self.open = 0  # transactions in progress
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+        self._result = list(self.rows) if sql.startswith("SELECT id, content_hash") else []
+        if sql.startswith("DELETE"):
+            self.rowcount = len(params[0])
+
+    def fetchall(self):
+        return self._result
+
+    def close(self):
+        pass
+
+    def cursor(self, **kwargs):
+        return self
+
+    def __enter__(self):
+        self.open += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.open -= 1
+        return False
+
+    def execute_values(self, cur, sql, values, template=None, page_size=100, fetch=False):
+        self.values.append((sql.split()[0], list(values)))
+        return [(i,) for i in range(len(values))] if fetch else None
+
+
+def _chunks(*contents):
+    return [
+        {"title": f"Doc - chunk {i}", "content": c, "metadata": {"chunk_index": i}, "chunk_index": i, "content_hash": text_hash(c)}
+        for i, c in enumerate(contents)
+    ]
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    def install(stored):
+        f = FakeDB(stored)
+        monkeypatch.setattr(db, "connection", lambda **kw: f)
+        monkeypatch.setattr(db, "execute_values", f.execute_values)
+        return f
+
+    return install
+
+
+def test_extra_copy_of_a_stored_chunk_reuses_its_embedding(fake):
+    f = fake([("alpha", 0, True)])
+    asked = []
+    counts = db.sync_document_chunks("d", _chunks("alpha", "alpha", "beta"), {text_hash("beta"): [0.2]}, embed_missing=asked.append)
+    assert asked == []
+    inserts = [v for kind, v in f.values if kind == "INSERT"][0]
+    assert [v[1] for v in inserts] == ["alpha", "beta"]
+    assert inserts[1][3] == [0.2]
+    # The copy is inserted without a vector and filled from the stored row in the same transaction.
+    assert any("SET embedding = s.embedding" in sql for sql in f.executed)
+    assert counts["inserted"] == 2 and counts["unchanged"] == 1
+
+
+def test_rows_without_embedding_are_repaired(fake):
+    f = fake([("alpha", 0, False), ("beta", 1, True)])
+    counts = db.sync_document_chunks("d", _chunks("alpha", "beta"), {}, embed_missing=lambda texts: [[float(len(t))] for t in texts])
+    updates = [v for kind, v in f.values if kind == "UPDATE"]
+    assert updates == [[([5.0], 1)]]
+    assert counts["repaired"] == 1 and counts["unchanged"] == 1
+
+
+def test_chunks_removed_by_a_concurrent_sync_are_embedded_outside_the_lock(fake):
+    # The caller saw "beta" stored and did not embed it, but another sync deleted it since.
+    f = fake([("alpha", 0, True)])
+    asked = []
+
+    def embed_missing(texts):
+        # No transaction (and so no advisory lock) is held, and nothing was written yet.
+        assert f.open == 0 and f.values == []
+        asked.extend(texts)
+        return [[1.0] for _ in texts]
+
+    db.sync_document_chunks("d", _chunks("alpha", "beta"), {}, embed_missing=embed_missing)
+    assert asked == ["beta"]
+    assert sum(sql.startswith("SELECT pg_advisory_xact_lock") for sql in f.executed) == 2
+    inserts = [v for kind, v in f.values if kind == "INSERT"][0]
+    assert inserts[0][3] == [1.0]
+
+
+def test_chunks_that_cannot_be_embedded_are_stored_without_a_vector(fake):
+    f = fake([])
+    asked = []
+    db.sync_document_chunks("d", _chunks("alpha"), {}, embed_missing=lambda texts: asked.append(texts) or [None])
+    assert asked == [["alpha"]]
+    inserts = [v for kind, v in f.values if kind == "INSERT"][0]
+    assert inserts[0][3] is None
+
+
+def test_duplicate_prefers_the_row_with_an_embedding(fake):
+    # Two stored copies, only the second embedded; the document now has one copy.
+    f = fake([("alpha", 0, False), ("alpha", 1, True)])
+    asked = []
+    counts = db.sync_document_chunks("d", _chunks("alpha"), {}, embed_missing=asked.append)
+    assert asked == [] and counts["deleted"] == 1
+    delete = [sql for sql in f.executed if sql.startswith("DELETE")]
+    assert delete and counts["unchanged"] == 0  # the kept row moved to chunk 0
+
+
+@pytest.mark.skipif(not os.getenv("DATABASE_URL"), reason="needs a Postgres+pgvector database")
+def test_sync_against_postgres_leaves_no_null_embeddings():
+    db.init_db()
+    key = f"test-sync-{uuid.uuid4().hex}"
+    vec = [1.0] + [0.0] * (db.EMBEDDING_DIM - 1)
+    try:
+        db.sync_document_chunks(key, _chunks("alpha", "beta"), {text_hash("alpha"): vec, text_hash("beta"): None})
+        assert db.get_document_chunk_hashes(key) == [text_hash("alpha")]
+        counts = db.sync_document_chunks(
+            key, _chunks("alpha", "alpha", "beta"), {}, embed_missing=lambda texts: [vec for _ in texts]
+        )
+        assert counts["repaired"] == 1 and counts["inserted"] == 1
+        with db.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT count(*), count(embedding) FROM documents WHERE doc_key = %s", (key,))
+            assert cur.fetchone() == (3, 3)
+            cur.close()
+    finally:
+        with db.connection() as conn:
+            conn.cursor().execute("DELETE FROM documents WHERE doc_key = %s", (key,))
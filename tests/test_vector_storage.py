@@ -0,0 +1,152 @@
+import pytest
+
+import db
+
+
+def test_default_index_is_full_precision():
+    assert "USING hnsw (embedding vector_cosine_ops)" in db._vector_index_sql("hnsw", "cosine")
+
+
+def test_halfvec_storage_uses_halfvec_opclass(monkeypatch):
+    monkeypatch.setattr(db, "VECTOR_STORAGE", "halfvec")
+    monkeypatch.setattr(db, "EMBEDDING_DIM", 512)
+    assert db._vec_type() == "halfvec(512)"
+    assert "(embedding halfvec_l2_ops)" in db._vector_index_sql("ivfflat", "l2")
+
+
+def test_binary_quantization_indexes_sign_bits(monkeypatch):
+    monkeypatch.setattr(db, "VECTOR_QUANTIZATION", "binary")
+    sql = db._vector_index_sql("hnsw", "cosine")
+    assert "USING hnsw ((binary_quantize(embedding)::bit(1536)) bit_hamming_ops)" in sql
+
+
+def test_binary_search_reranks_oversampled_candidates(monkeypatch):
+    executed = []
+
+    class Cursor:
+        def execute(self, sql, params=None):
+            executed.append((sql, params))
+
+        def fetchall(self):
+            return []
+
+        def close(self):
+            pass
+
+    class Conn:
+        def cursor(self, **kwargs):
+            return Cursor()
+
+    class Ctx:
+        def __enter__(self):
+            return Conn()
+
+        def __exit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(db, "VECTOR_QUANTIZATION", "binary")
+    monkeypatch.setattr(db, "connection", lambda: Ctx())
+    db.search_similar_by_embedding([0.1] * 3, k=5, rerank_factor=4)
+    sql, params = executed[-1]
+    assert "ORDER BY binary_quantize(embedding)::bit(1536) <~> binary_quantize(%s::vector(1536))" in sql
+    assert sql.endswith("ORDER BY distance LIMIT %s")
+    assert params[-2:] == (20, 5)
+
+    # 80 candidates exceed HNSW's default beam of 40, so the query widens it.
+    monkeypatch.setattr(db, "VECTOR_INDEX_TYPE", "hnsw")
+    monkeypatch.setattr(db, "HNSW_EF_SEARCH", None)
+    db.search_similar_by_embedding([0.1] * 3, k=5, rerank_factor=16)
+    assert ("SET LOCAL hnsw.ef_search = 80", None) in executed
+
+
+def test_oversampled_candidates_widen_the_hnsw_beam(monkeypatch):
+    monkeypatch.setattr(db, "VECTOR_INDEX_TYPE", "hnsw")
+    monkeypatch.setattr(db, "HNSW_EF_SEARCH", None)
+    monkeypatch.setattr(db, "_iterative_scan_supported", True)
+
+    cur = RecordingCursor()
+    db._set_search_tunables(cur, limit=80)
+    assert cur.executed == ["SET LOCAL hnsw.ef_search = 80"]
+
+    cur = RecordingCursor()
+    db._set_search_tunables(cur, ef_search=200, limit=80)
+    assert cur.executed == ["SET LOCAL hnsw.ef_search = 200"]
+
+    # Beyond the ef_search maximum, an iterative scan supplies the remaining candidates.
+    cur = RecordingCursor()
+    db._set_search_tunables(cur, limit=4000)
+    assert cur.executed[0] == "SET LOCAL hnsw.ef_search = 1000"
+    assert "SET LOCAL hnsw.iterative_scan = relaxed_order" in cur.executed
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+
+
+def test_iterative_scan_only_sets_the_configured_index(monkeypatch):
+    monkeypatch.setattr(db, "_iterative_scan_supported", True)
+    monkeypatch.setattr(db, "VECTOR_ITERATIVE_SCAN", "strict_order")
+
+    monkeypatch.setattr(db, "VECTOR_INDEX_TYPE", "ivfflat")
+    cur = RecordingCursor()
+    db._set_search_tunables(cur, iterative=True)
+    assert cur.executed == ["SET LOCAL ivfflat.iterative_scan = relaxed_order"]
+
+    monkeypatch.setattr(db, "VECTOR_INDEX_TYPE", "hnsw")
+    cur = RecordingCursor()
+    db._set_search_tunables(cur, iterative=True)
+    assert cur.executed == ["SET LOCAL hnsw.iterative_scan = strict_order"]
+
+
+def _migration_db(monkeypatch, column, indexdef):
+    executed = []
+
+    class Cursor:
+        def __init__(self):
+            self._row = None
+
+        def execute(self, sql, params=None):
+            executed.append(sql)
+            if sql.startswith("SELECT format_type"):
+                self._row = (column,)
+            elif sql.startswith("SELECT indexdef"):
+                self._row = (indexdef,) if indexdef else None
+
+        def fetchone(self):
+            return self._row
+
+        def close(self):
+            pass
+
+    class Ctx:
+        autocommit = False
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def cursor(self, **kwargs):
+            return Cursor()
+
+    monkeypatch.setattr(db, "connection", lambda **kw: Ctx())
+    return executed
+
+
+def test_rejected_migration_keeps_the_index(monkeypatch):
+    monkeypatch.setattr(db, "EMBEDDING_DIM", 3072)
+    executed = _migration_db(monkeypatch, "vector(1536)", "CREATE INDEX documents_embedding_idx ...")
+    with pytest.raises(RuntimeError, match="cannot widen"):
+        db.migrate_embedding_storage()
+    assert not any(sql.startswith("DROP INDEX") for sql in executed)
+
+
+def test_migration_is_a_no_op_when_column_and_index_match(monkeypatch):
+    executed = _migration_db(monkeypatch, "vector(1536)", "CREATE INDEX documents_embedding_idx ON documents USING hnsw (embedding vector_cosine_ops)")
+    assert db.migrate_embedding_storage()["changed"] is False
+    assert not any(sql.startswith(("DROP", "ALTER")) for sql in executed)
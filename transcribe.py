@@ -1,44 +1,192 @@
 import os
-from typing import Optional
+import threading
+from typing import IO, List, Optional, Union
 from dotenv import load_dotenv
-
 load_dotenv()
 
+from metrics import span, timed
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Local whisper fallback. Model size: tiny | base | small | medium | large.
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")
+# Device for the local model, e.g. "cpu" or "cuda"; empty lets whisper pick.
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE") or None
+# "float16", "float32" or "auto" (float16 on GPU, float32 on CPU).
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "auto")
+# Load the local model when the Streamlit app starts instead of on the first clip.
+WHISPER_PREWARM = os.getenv("WHISPER_PREWARM", "0") in ("1", "true", "True")
+
+_model = None
+_model_lock = threading.Lock()
+# whisper models are not safe to call from several threads at once.
+_inference_lock = threading.Lock()
+
+
+def get_local_model():
+    """Return the process-wide local whisper model, loading it on first use."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                import whisper
+
+                with span("whisper.load_model"):
+                    _model = whisper.load_model(WHISPER_MODEL, device=WHISPER_DEVICE)
+    return _model
+
+
+def prewarm() -> bool:
+    """Load the local whisper model ahead of the first request. Returns False if unavailable."""
+    try:
+        get_local_model()
+        return True
+    except Exception as e:
+        print("Whisper prewarm failed:", e)
+        return False
+
+
+def _fp16(model) -> bool:
+    if WHISPER_COMPUTE_TYPE == "float16":
+        return True
+    if WHISPER_COMPUTE_TYPE == "float32":
+        return False
+    return getattr(model, "device", None) is not None and model.device.type == "cuda"
+
 
+def _transcribe_local(file_paths: List[str]) -> List[str]:
+    model = get_local_model()
+    fp16 = _fp16(model)
+    texts = []
+    with _inference_lock:
+        for path in file_paths:
+            with span("whisper.transcribe"):
+                result = model.transcribe(path, fp16=fp16)
+            texts.append(result.get("text", ""))
+    return texts
+
+
+def _transcribe_local_array(samples) -> str:
+    try:
+        model = get_local_model()
+    except Exception as e:
+        raise RuntimeError("No transcription method available: " + str(e))
+    with _inference_lock, span("whisper.transcribe"):
+        result = model.transcribe(samples, fp16=_fp16(model))
+    return result.get("text", "")
+
+
+def _transcribe_openai(audio: Union[str, IO[bytes]]) -> str:
+    """Send a file path, or a binary file object with a `name` (the API infers the container from it)."""
+    if isinstance(audio, str):
+        with open(audio, "rb") as f:
+            return _transcribe_openai(f)
+    import openai
+
+    openai.api_key = OPENAI_API_KEY
+    # Use the OpenAI audio transcription endpoint (model name may change).
+    # This call may vary with openai sdk versions; it's a best-effort wrapper.
+    with span("openai.transcription"):
+        transcription = openai.Audio.transcribe("whisper-1", audio)
+    # transcription may be a dict with 'text'
+    if isinstance(transcription, dict) and transcription.get("text"):
+        return transcription["text"]
+    return str(transcription)
+
+
+@timed()
 def transcribe_audio(file_path: str) -> str:
     """Transcribe an audio file. Prefers OpenAI's transcription API if OPENAI_API_KEY is set. Otherwise, falls back to local whisper if installed.
 
     Returns the transcript text.
     """
-    # Prefer OpenAI API
+    return transcribe_batch([file_path])[0]
+
+
+@timed()
+def transcribe_array(samples, sample_rate: int = 16000) -> str:
+    """Transcribe in-memory mono audio (float32 in [-1, 1] or int16), e.g. a live VAD segment.
+
+    Local whisper consumes 16 kHz float32 directly; the OpenAI API gets an in-memory WAV.
+    """
+    import numpy as np
+
+    samples = np.asarray(samples)
+    if samples.dtype == np.int16:
+        samples = samples.astype(np.float32) / 32768.0
+    samples = samples.astype(np.float32, copy=False).reshape(-1)
     if OPENAI_API_KEY:
         try:
-            import openai
-
-            openai.api_key = OPENAI_API_KEY
-            # Use the OpenAI audio transcription endpoint (model name may change)
-            with open(file_path, "rb") as f:
-                # This call may vary with openai sdk versions; it's a best-effort wrapper.
-                transcription = openai.Audio.transcribe("whisper-1", f)
-                # transcription may be a dict with 'text'
-                if isinstance(transcription, dict) and transcription.get("text"):
-                    return transcription["text"]
-                return str(transcription)
+            import io
+            import soundfile as sf
+
+            buf = io.BytesIO()
+            sf.write(buf, samples, sample_rate, format="WAV", subtype="PCM_16")
+            buf.seek(0)
+            buf.name = "segment.wav"
+            return _transcribe_openai(buf)
         except Exception as e:
             print("OpenAI transcription failed, falling back to local whisper:", e)
 
+    if sample_rate != 16000:
+        raise ValueError("local whisper needs 16 kHz audio")
+    return _transcribe_local_array(samples)
+
+
+@timed()
+def transcribe_bytes(data: bytes, filename: str = "audio.wav") -> str:
+    """Transcribe encoded audio held in memory, without writing it to disk.
+
+    The OpenAI API gets the bytes directly (`filename` tells it the container); local whisper gets
+    them decoded to 16 kHz float32 via PyAV.
+    """
+    import io
+
+    if OPENAI_API_KEY:
+        try:
+            buf = io.BytesIO(data)
+            buf.name = filename
+            return _transcribe_openai(buf)
+        except Exception as e:
+            print("OpenAI transcription failed, falling back to local whisper:", e)
+
+    from audio_preprocess import decode_audio
+
+    samples = decode_audio(io.BytesIO(data)).astype("float32") / 32768.0
+    return _transcribe_local_array(samples)
+
+
+@timed()
+def transcribe_batch(file_paths: List[str]) -> List[str]:
+    """Transcribe several files in one call, loading the local model at most once.
+
+    Files the OpenAI API fails on fall back to local whisper together. Returns transcripts in order.
+    """
+    results: List[Optional[str]] = [None] * len(file_paths)
+    # Prefer OpenAI API
+    if OPENAI_API_KEY:
+        for i, path in enumerate(file_paths):
+            try:
+                results[i] = _transcribe_openai(path)
+            except Exception as e:
+                print("OpenAI transcription failed, falling back to local whisper:", e)
+
+    pending = [i for i, r in enumerate(results) if r is None]
+    if not pending:
+        return results
+
     # Fallback to local whisper (if installed)
     try:
-        import whisper
-
-        model = whisper.load_model("small")
-        result = model.transcribe(file_path)
-        return result.get("text", "")
+        texts = _transcribe_local([file_paths[i] for i in pending])
     except Exception as e:
         raise RuntimeError("No transcription method available: " + str(e))
+    for i, text in zip(pending, texts):
+        results[i] = text
+    return results
 
 
 if __name__ == "__main__":
-    print("transcribe.py module - call transcribe_audio(file_path)")
+    # `python transcribe.py <dir-or-manifest> [-o out.jsonl] [--ingest queue]`; see batch_transcribe.py.
+    from batch_transcribe import main
+
+    raise SystemExit(main())